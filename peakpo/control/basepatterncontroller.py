@@ -1,8 +1,8 @@
 import os
 from PyQt5 import QtWidgets
-from utils import get_sorted_filelist, find_from_filelist, readchi, \
-    make_filename, writechi
+from utils import readchi, make_filename, writechi, FileIndex
 from utils import undo_button_press
+from model.prefetcher import Prefetcher
 from .mplcontroller import MplController
 from .cakecontroller import CakeController
 
@@ -14,6 +14,8 @@ class BasePatternController(object):
         self.widget = widget
         self.plot_ctrl = MplController(self.model, self.widget)
         self.cake_ctrl = CakeController(self.model, self.widget)
+        self.file_index = None
+        self.prefetcher = Prefetcher()
         self.connect_channel()
 
     def connect_channel(self):
@@ -51,11 +53,12 @@ class BasePatternController(object):
             QtWidgets.QMessageBox.warning(
                 self.widget, "Warning", "Choose a base pattern first.")
             return
-        filelist = get_sorted_filelist(
-            self.model.chi_path,
-            sorted_by_name=self.widget.radioButton_SortbyNme.isChecked())
-        idx = find_from_filelist(filelist,
-                                 os.path.split(self.model.base_ptn.fname)[1])
+        filelist = self._get_file_index()
+        idx = filelist.index(self.model.base_ptn.fname)
+        if idx == -1:
+            # the folder may have changed within its mtime resolution
+            filelist.refresh(force=True)
+            idx = filelist.index(self.model.base_ptn.fname)
         if idx == -1:
             QtWidgets.QMessageBox.warning(
                 self.widget, "Warning", "Cannot find current file")
@@ -93,10 +96,26 @@ class BasePatternController(object):
             self._load_a_new_pattern(new_filename)
             # self.model.set_base_ptn_color(self.obj_color)
             self.plot_ctrl.update()
+            self._prefetch_neighbours()
         else:
             QtWidgets.QMessageBox.warning(self.widget, "Warning",
                                           new_filename + " does not exist.")
 
+    def _get_file_index(self):
+        """
+        return index of chi files in chi_path, refreshed if the folder
+        has changed.  a new index is made when chi_path changes.
+        """
+        sorted_by_name = self.widget.radioButton_SortbyNme.isChecked()
+        if (self.file_index is None) or \
+                (self.file_index.path != self.model.chi_path):
+            self.file_index = FileIndex(self.model.chi_path,
+                                        sorted_by_name=sorted_by_name)
+        else:
+            self.file_index.set_sort(sorted_by_name)
+        self.file_index.refresh()
+        return self.file_index
+
     def load_new_base_pattern_from_name(self):
         if self.widget.lineEdit_DiffractionPatternFileName.isModified():
             filen = self.widget.lineEdit_DiffractionPatternFileName.text()
@@ -118,6 +137,7 @@ class BasePatternController(object):
                 self.plot_new_graph()
             else:
                 self.apply_changes_to_graph()
+            self._prefetch_neighbours()
         else:
             QtWidgets.QMessageBox.warning(
                 self.widget, 'Warning', 'Cannot find ' + filen)
@@ -128,30 +148,38 @@ class BasePatternController(object):
         """
         load and process base pattern.  does not signal to update_graph
         """
-        self.model.set_base_ptn(
-            new_filename, self.widget.doubleSpinBox_SetWavelength.value())
+        temp_dir = os.path.join(os.path.split(new_filename)[0],
+                                'temporary_pkpo')
+        if self.widget.checkBox_UseTempBGSub.isChecked():
+            temp_dir_chi = temp_dir
+        else:
+            temp_dir_chi = None
+        new_base_ptn, diff_img = self.prefetcher.pop(
+            new_filename, self._get_prefetch_settings())
+        if new_base_ptn is None:
+            self.model.set_base_ptn(
+                new_filename, self.widget.doubleSpinBox_SetWavelength.value(),
+                temp_dir=temp_dir_chi)
+        else:
+            self.model.replace_base_ptn(new_base_ptn)
         # self.widget.textEdit_DiffractionPatternFileName.setText(
         #    '1D Pattern: ' + self.model.get_base_ptn_filename())
         self.widget.lineEdit_DiffractionPatternFileName.setText(
             str(self.model.get_base_ptn_filename()))
-        temp_dir = os.path.join(self.model.chi_path, 'temporary_pkpo')
-        if self.widget.checkBox_UseTempBGSub.isChecked():
-            if os.path.exists(temp_dir):
-                success = self.model.base_ptn.read_bg_from_tempfile(
-                    temp_dir=temp_dir)
-                if success:
-                    self._update_bg_params_in_widget()
-                    print('Read temp chi successfully.')
-                else:
-                    self._update_bgsub_from_current_values()
-                    print('No temp chi file found. Force new bgsub fit.')
+        if (new_base_ptn is not None) and self._bg_is_current():
+            print('Use prefetched background.')
+        elif self.widget.checkBox_UseTempBGSub.isChecked():
+            bg_roi, bg_params = self._get_bg_roi_params()
+            success = self.model.base_ptn.read_bg_from_tempfile(
+                bg_roi, bg_params, temp_dir=temp_dir)
+            if success:
+                print('Read background cache successfully.')
             else:
-                os.makedirs(temp_dir)
                 self._update_bgsub_from_current_values()
-                print('No temp chi file found. Force new bgsub fit.')
+                print('No valid background cache. Force new bgsub fit.')
         else:
             self._update_bgsub_from_current_values()
-            print('Temp chi ignored. Force new bgsub fit.')
+            print('Background cache ignored. Force new bgsub fit.')
         filen_tif = self.model.make_filename('tif', original=True)
         filen_mar3450 = self.model.make_filename('mar3450', original=True)
         if not (os.path.exists(filen_tif) or os.path.exists(filen_mar3450)):
@@ -160,18 +188,76 @@ class BasePatternController(object):
         # self._update_bg_params_in_widget()
         if self.widget.checkBox_ShowCake.isChecked() and \
                 (self.model.poni is not None):
-            self.cake_ctrl.process_temp_cake()
+            if diff_img is None:
+                self.cake_ctrl.process_temp_cake()
+            else:
+                self.cake_ctrl.set_prefetched_cake(diff_img)
             # not sure this is correct.
             # self.cake_ctrl.addremove_cake(update_plot=False)
 
-    def _update_bg_params_in_widget(self):
-        self.widget.spinBox_BGParam0.setValue(self.model.base_ptn.params_chbg[0])
-        self.widget.spinBox_BGParam1.setValue(self.model.base_ptn.params_chbg[1])
-        self.widget.spinBox_BGParam2.setValue(self.model.base_ptn.params_chbg[2])
-        self.widget.doubleSpinBox_Background_ROI_min.setValue(self.model.base_ptn.roi[0])
-        self.widget.doubleSpinBox_Background_ROI_max.setValue(self.model.base_ptn.roi[1])
+    def _bg_is_current(self):
+        """
+        check if background of the base pattern is made with the roi and
+        parameters in the widget
+        """
+        bg_roi, bg_params = self._get_bg_roi_params()
+        base_ptn = self.model.base_ptn
+        return (base_ptn.y_bgsub is not None) and \
+            (list(base_ptn.roi) == bg_roi) and \
+            (list(base_ptn.params_chbg) == bg_params)
 
-    def _update_bgsub_from_current_values(self):
+    def _get_prefetch_settings(self):
+        """
+        snapshot of the widget values which affect loading of a pattern.
+        prefetched patterns are used only if these do not change.
+        """
+        if self.widget.checkBox_UseTempBGSub.isChecked():
+            temp_dir = os.path.join(self.model.chi_path, 'temporary_pkpo')
+        else:
+            temp_dir = None
+        if self.widget.checkBox_ShowCake.isChecked() and \
+                (self.model.poni is not None):
+            cake_settings = [self.model.poni,
+                             (self.widget.spinBox_MaskMin.value(),
+                              self.widget.spinBox_MaskMax.value()),
+                             self.widget.checkBox_UseTempCake.isChecked(),
+                             self.model.cake_dtype, self.model.cake_compress]
+        else:
+            cake_settings = None
+        return {'wavelength': self.widget.doubleSpinBox_SetWavelength.value(),
+                'bg_roi': [self.widget.doubleSpinBox_Background_ROI_min.value(),
+                           self.widget.doubleSpinBox_Background_ROI_max.value()],
+                'bg_params': [self.widget.spinBox_BGParam0.value(),
+                              self.widget.spinBox_BGParam1.value(),
+                              self.widget.spinBox_BGParam2.value()],
+                'temp_dir': temp_dir,
+                'cake_settings': cake_settings}
+
+    def _prefetch_neighbours(self):
+        """
+        start loading files which are n_prefetch steps before and after
+        the base pattern in a worker thread
+        """
+        if (self.model.n_prefetch <= 0) or (not self.model.base_ptn_exist()):
+            return
+        filelist = self._get_file_index()
+        idx = filelist.index(self.model.base_ptn.fname)
+        if idx == -1:
+            return
+        step = self.widget.spinBox_FileStep.value()
+        filenames = []
+        for i in range(1, self.model.n_prefetch + 1):
+            for idx_new in (idx + i * step, idx - i * step):
+                if (idx_new >= 0) and (idx_new < filelist.__len__()):
+                    filenames.append(filelist[idx_new])
+        self.prefetcher.max_size = 2 * self.model.n_prefetch + 2
+        self.prefetcher.request(filenames, self._get_prefetch_settings())
+
+    def _get_bg_roi_params(self):
+        """
+        read background roi and parameters from the widget.  roi is
+        clipped to the data range of the base pattern.
+        """
         x_raw, y_raw = self.model.base_ptn.get_raw()
         if (x_raw.min() >= self.widget.doubleSpinBox_Background_ROI_min.value()) or \
                 (x_raw.max() <= self.widget.doubleSpinBox_Background_ROI_min.value()):
@@ -179,12 +265,16 @@ class BasePatternController(object):
         if (x_raw.max() <= self.widget.doubleSpinBox_Background_ROI_max.value()) or \
                 (x_raw.min() >= self.widget.doubleSpinBox_Background_ROI_max.value()):
             self.widget.doubleSpinBox_Background_ROI_max.setValue(x_raw.max())
-        self.model.base_ptn.subtract_bg(
-            [self.widget.doubleSpinBox_Background_ROI_min.value(),
-                self.widget.doubleSpinBox_Background_ROI_max.value()],
-            [self.widget.spinBox_BGParam0.value(),
-                self.widget.spinBox_BGParam1.value(),
-                self.widget.spinBox_BGParam2.value()], yshift=0)
+        bg_roi = [self.widget.doubleSpinBox_Background_ROI_min.value(),
+                  self.widget.doubleSpinBox_Background_ROI_max.value()]
+        bg_params = [self.widget.spinBox_BGParam0.value(),
+                     self.widget.spinBox_BGParam1.value(),
+                     self.widget.spinBox_BGParam2.value()]
+        return bg_roi, bg_params
+
+    def _update_bgsub_from_current_values(self):
+        bg_roi, bg_params = self._get_bg_roi_params()
+        self.model.base_ptn.subtract_bg(bg_roi, bg_params, yshift=0)
         self.model.base_ptn.write_temporary_bgfiles()
 
     def apply_changes_to_graph(self):
@@ -202,9 +202,8 @@ class CakeAziController(object):
             return None
         # self.produce_cake()
         self.cakemake_ctrl.read_settings()
-        tth = []
-        intensity = []
         mid_angle = self.widget.spinBox_AziShift.value()
+        azi_ranges = []
         for azi_i in azi_list:
             azi_conv = []
             if mid_angle <= 180:
@@ -221,17 +220,9 @@ class CakeAziController(object):
                     azi_real.append(azi_conv_i - 360)
                 else:
                     azi_real.append(azi_conv_i)
-            tth_i, intensity_i = self.model.diff_img.integrate_to_1d(
-                azimuth_range=(azi_real[0], azi_real[1]))
-            tth.append(tth_i)
-            intensity.append(intensity_i)
-        intensity_merged = np.zeros_like(intensity[0])
-        for tth_i, intensity_i in zip(tth, intensity):
-            if not np.array_equal(tth_i, tth[0]):
-                QtWidgets.QMessageBox.warning(
-                    self.widget, 'Warning', 'Error occured.  No output.')
-                return None
-            intensity_merged += intensity_i
+            azi_ranges.append(azi_real)
+        tth, intensity_merged = self.model.diff_img.integrate_sectors(
+            azi_ranges, merge=True)
         n_azi = azi_list.__len__()
         first_azi = azi_list[0]
         intensity_output = intensity_merged
@@ -247,7 +238,7 @@ class CakeAziController(object):
         preheader_line0 = azi_text + ' \n'
         preheader_line1 = '2-theta\n'
         preheader_line2 = '\n'
-        writechi(filen_chi, tth[0], intensity_output,
+        writechi(filen_chi, tth, intensity_output,
                  preheader=preheader_line0 + preheader_line1 +
                  preheader_line2)
         return filen_chi
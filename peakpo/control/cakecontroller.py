@@ -129,6 +129,15 @@ class CakeController(object):
         self.widget.textEdit_DiffractionImageFilename.setText(
             self.model.diff_img.img_filename)
 
+    def set_prefetched_cake(self, diff_img):
+        """
+        use a cake made in advance for the base pattern.
+        no signal to update_graph
+        """
+        self.model.diff_img = diff_img
+        self.widget.textEdit_DiffractionImageFilename.setText(
+            self.model.diff_img.img_filename)
+
     def apply_mask(self):
         self.produce_cake()
         self._apply_changes_to_graph()
@@ -155,7 +164,8 @@ class CakeController(object):
             if os.path.exists(temp_dir):
                 self._load_new_image()
                 success = self.model.diff_img.read_cake_from_tempfile(
-                    temp_dir=temp_dir)
+                    temp_dir=temp_dir, poni_filename=self.model.poni,
+                    mask_range=self._get_mask_range())
                 if success:
                     pass
                 else:
@@ -168,7 +178,13 @@ class CakeController(object):
 
     def _update_temp_cake_files(self, temp_dir):
         self.produce_cake()
-        self.model.diff_img.write_temp_cakefiles(temp_dir=temp_dir)
+        self.model.diff_img.write_temp_cakefiles(
+            temp_dir=temp_dir, mask_range=self._get_mask_range(),
+            dtype=self.model.cake_dtype, compress=self.model.cake_compress)
+
+    def _get_mask_range(self):
+        return (self.widget.spinBox_MaskMin.value(),
+                self.widget.spinBox_MaskMax.value())
 
     def get_poni(self):
         """
@@ -0,0 +1,100 @@
+import time
+from PyQt5 import QtCore
+
+# minimum time between progress reports in seconds
+PROGRESS_INTERVAL = 0.1
+
+
+class FitWorkerSignals(QtCore.QObject):
+    """
+    signals of FitWorker.  QRunnable is not a QObject and cannot have
+    signals of its own.
+    """
+    # number of evaluations, chisqr
+    progress = QtCore.pyqtSignal(int, float)
+    # section, success, error message
+    finished = QtCore.pyqtSignal(object, bool, str)
+
+
+class FitWorker(QtCore.QRunnable):
+    """
+    fit a section in a QThreadPool thread so that the window keeps
+    responding.  the section should be a copy which nothing else touches
+    during the fit.  results are delivered through signals, which run
+    the connected slots in the main thread.
+    """
+
+    def __init__(self, section):
+        """
+        :param section: Section prepared for fitting
+        """
+        super(FitWorker, self).__init__()
+        self.section = section
+        self.signals = FitWorkerSignals()
+        self.cancelled = False
+        self._t_progress = 0.
+
+    def cancel(self):
+        """
+        stop the fit at the next evaluation
+        """
+        self.cancelled = True
+
+    def _iter_cb(self, n_eval, chisqr):
+        t_now = time.time()
+        if t_now - self._t_progress >= PROGRESS_INTERVAL:
+            self._t_progress = t_now
+            self.signals.progress.emit(n_eval, chisqr)
+        return self.cancelled
+
+    def run(self):
+        try:
+            success = self.section.conduct_fitting(iter_cb=self._iter_cb)
+        except Exception as inst:
+            self.signals.finished.emit(self.section, False, str(inst))
+            return
+        if self.cancelled:
+            self.signals.finished.emit(self.section, False, 'Cancelled.')
+            return
+        self.signals.finished.emit(self.section, success, '')
+
+
+class BatchFitWorkerSignals(QtCore.QObject):
+    """
+    signals of BatchFitWorker
+    """
+    # table of results or None, error message
+    finished = QtCore.pyqtSignal(object, str)
+
+
+class BatchFitWorker(QtCore.QRunnable):
+    """
+    fit sections over waterfall patterns in a QThreadPool thread, so
+    that the window keeps responding while the process pool works.
+    the sections should be copies which nothing else touches during
+    the fit.
+    """
+
+    def __init__(self, model, sections, pressures, temperatures):
+        """
+        :param model: PeakPoModel with waterfall patterns
+        :param sections: list of Section to fit
+        :param pressures: pressures for the table, one for each pattern
+        :param temperatures: temperatures for the table, one for each pattern
+        """
+        super(BatchFitWorker, self).__init__()
+        self.model = model
+        self.sections = sections
+        self.pressures = pressures
+        self.temperatures = temperatures
+        self.signals = BatchFitWorkerSignals()
+
+    def run(self):
+        try:
+            table = self.model.fit_sections_over_waterfall(
+                sections=self.sections, pressures=self.pressures,
+                temperatures=self.temperatures)
+        except Exception as inst:
+            self.signals.finished.emit(None, str(inst))
+            return
+        self.signals.finished.emit(table, '')
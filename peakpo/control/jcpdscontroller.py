@@ -7,7 +7,14 @@ from matplotlib import colors
 import matplotlib.cm as cmx
 from .mplcontroller import MplController
 from .jcpdstablecontroller import JcpdsTableController
-from utils import xls_jlist, dialog_savefile
+import numpy as np
+from utils import xls_jlist, dialog_savefile, SearchMatchDialog
+from ds_jcpds import JcpdsLibrary, get_jcpds_library
+
+# number of selected files from which the folder is indexed
+JCPDS_LIBRARY_MIN_FILES = 20
+# pressures in GPa tested by search-match
+SEARCH_MATCH_PRESSURES = np.arange(0., 201., 1.)
 
 
 class JcpdsController(object):
@@ -33,6 +40,8 @@ class JcpdsController(object):
         self.widget.pushButton_MoveUp.clicked.connect(self.move_up_jcpds)
         self.widget.pushButton_MoveDown.clicked.connect(self.move_down_jcpds)
         self.widget.pushButton_ExportXLS.clicked.connect(self.save_xls)
+        self.widget.pushButton_SearchMatchJCPDS.clicked.connect(
+            self.search_match)
         self.widget.pushButton_ViewJCPDS.clicked.connect(self.view_jcpds)
         self.widget.checkBox_JCPDSinPattern.clicked.connect(
             lambda: self._apply_changes_to_graph(limits=None))
@@ -64,6 +73,20 @@ class JcpdsController(object):
         if files == []:
             return
         self.model.set_jcpds_path(os.path.split(str(files[0]))[0])
+        # index the folder only for many files or if it was indexed before
+        library = None
+        if (files.__len__() >= JCPDS_LIBRARY_MIN_FILES) or \
+                os.path.exists(JcpdsLibrary(
+                    self.model.jcpds_path).index_filename):
+            library = get_jcpds_library(self.model.jcpds_path)
+        self._add_to_jlist(files, append=append, library=library)
+
+    def _add_to_jlist(self, files, append=False, library=None):
+        """
+        read jcpds files, give them colors, and put them in the jlist
+
+        :param library: JcpdsLibrary to take cards from instead of files
+        """
         n_color = 9
         # jet = plt.get_cmap('gist_rainbow')
         jet = cmx.get_cmap('gist_rainbow')
@@ -84,7 +107,7 @@ class JcpdsController(object):
             i = 0
         for f in files:
             color = colors.rgb2hex(scalarMap.to_rgba(c_value[i]))
-            if self.model.append_a_jcpds(str(f), color):
+            if self.model.append_a_jcpds(str(f), color, library=library):
                 i += 1
                 if i >= n_color - 1:
                     i = 0
@@ -99,6 +122,46 @@ class JcpdsController(object):
         else:
             self._apply_changes_to_graph(limits=(0., 25., 0., 100.))
 
+    def search_match(self):
+        """
+        rank cards in a folder against peak positions in sections and
+        load the cards the user chooses, at the best pressure
+        """
+        if self.model.get_peak_positions_in_sections() == []:
+            QtWidgets.QMessageBox.warning(
+                self.widget, "Warning",
+                "Set peaks in a section or fit sections first.")
+            return
+        path = QtWidgets.QFileDialog.getExistingDirectory(
+            self.widget, "Choose A JCPDS Folder", self.model.jcpds_path)
+        if path == '':
+            return
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            candidates = self.model.search_match_jcpds(
+                path, self.widget.doubleSpinBox_SetWavelength.value(),
+                SEARCH_MATCH_PRESSURES,
+                temperature=self.widget.doubleSpinBox_Temperature.value())
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        if candidates == []:
+            QtWidgets.QMessageBox.warning(
+                self.widget, "Warning", "No JCPDS in the folder matches.")
+            return
+        dialog = SearchMatchDialog(candidates, self.widget)
+        if dialog.exec_() != QtWidgets.QDialog.Accepted:
+            return
+        chosen = dialog.get_selected()
+        if chosen == []:
+            return
+        self.model.set_jcpds_path(path)
+        self._add_to_jlist(
+            [os.path.join(path, candidate['filename'])
+             for candidate in chosen],
+            append=True, library=get_jcpds_library(path))
+        # the best candidate sets the pressure for the plot
+        self.widget.doubleSpinBox_Pressure.setValue(chosen[0]['pressure'])
+
     def move_up_jcpds(self):
         # get selected cell number
         idx_selected = self._find_a_jcpds()
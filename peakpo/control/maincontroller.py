@@ -25,7 +25,7 @@ from utils import dialog_savefile, writechi, extract_extension, \
     convert_wl_to_energy
 # do not change the module structure for ds_jcpds and ds_powdiff for
 # retro compatibility
-from ds_jcpds import UnitCell
+from ds_jcpds import UnitCell, ReflectionIndex
 from ds_powdiff import get_DataSection
 
 
@@ -51,6 +51,7 @@ class MainController(object):
         self.session_ctrl = SessionController(self.model, self.widget)
         self.peakfit_ctrl = PeakFitController(self.model, self.widget)
         self.peakfit_table_ctrl = PeakfitTableController(self.model, self.widget)
+        self.reflection_index = ReflectionIndex()
         self.read_setting()
         self.connect_channel()
         #
@@ -203,10 +204,15 @@ class MainController(object):
         if reply == QtWidgets.QMessageBox.No:
             return
         if self._temporary_pkpo_exists():
-            temp_chi = os.path.join(self.model.chi_path, 'temporary_pkpo',
-                                    '*.chi')
-            for f in glob.glob(temp_chi):
-                os.remove(f)
+            temp_dir = os.path.join(self.model.chi_path, 'temporary_pkpo')
+            # *.chi are from older versions
+            for ext in ('*.chi', '*.bg.npz', '*.chi.npy'):
+                for f in glob.glob(os.path.join(temp_dir, ext)):
+                    try:
+                        os.remove(f)
+                    except OSError:
+                        # sidecar of the current pattern can be mapped
+                        print('Cannot remove ' + f)
 
     def del_temp_cake(self):
         reply = QtWidgets.QMessageBox.question(
@@ -218,9 +224,13 @@ class MainController(object):
             return
         if self._temporary_pkpo_exists():
             temp_cake = os.path.join(self.model.chi_path, 'temporary_pkpo',
-                                     '*.npy')
+                                     '*.cake.np*')
             for f in glob.glob(temp_cake):
-                os.remove(f)
+                try:
+                    os.remove(f)
+                except OSError:
+                    # cake of the current image can be mapped
+                    print('Cannot remove ' + f)
 
     def _temporary_pkpo_exists(self):
         temp_dir = os.path.join(self.model.chi_path, 'temporary_pkpo')
@@ -329,6 +339,12 @@ class MainController(object):
         # print('write:' + self.model.chi_path)
         self.settings.setValue('chi_path', self.model.chi_path)
         self.settings.setValue('jcpds_path', self.model.jcpds_path)
+        if self.model.n_workers is not None:
+            self.settings.setValue('n_workers', self.model.n_workers)
+        self.settings.setValue('n_prefetch', self.model.n_prefetch)
+        if self.model.cake_dtype is not None:
+            self.settings.setValue('cake_dtype', self.model.cake_dtype)
+        self.settings.setValue('cake_compress', int(self.model.cake_compress))
 
     def read_setting(self):
         """
@@ -338,6 +354,18 @@ class MainController(object):
         # self.settings.setFallbacksEnabled(False)
         self.model.set_chi_path(self.settings.value('chi_path'))
         self.model.set_jcpds_path(self.settings.value('jcpds_path'))
+        n_workers = self.settings.value('n_workers')
+        if n_workers is not None:
+            self.model.n_workers = int(n_workers)
+        n_prefetch = self.settings.value('n_prefetch')
+        if n_prefetch is not None:
+            self.model.n_prefetch = int(n_prefetch)
+        cake_dtype = self.settings.value('cake_dtype')
+        if cake_dtype is not None:
+            self.model.cake_dtype = str(cake_dtype)
+        cake_compress = self.settings.value('cake_compress')
+        if cake_compress is not None:
+            self.model.cake_compress = bool(int(cake_compress))
 
     """
     def closeEvent(self, event):
@@ -503,9 +531,7 @@ class MainController(object):
             self.widget.doubleSpinBox_Background_ROI_max.setValue(bg_roi[1])
         self.model.base_ptn.subtract_bg(bg_roi, bg_params, yshift=0)
         self.model.base_ptn.write_temporary_bgfiles()
-        if self.model.waterfall_exist():
-            for pattern in self.model.waterfall_ptn:
-                pattern.subtract_bg(bg_roi, bg_params, yshift=0)
+        self.model.subtract_bg_waterfall(bg_roi, bg_params)
         self.plot_new_graph()
 
     def apply_pt_to_graph(self):
@@ -517,99 +543,27 @@ class MainController(object):
         self.plot_ctrl.update()
 
     def _find_closestjcpds(self, x):
-        jcount = 0
+        phases = []
         for phase in self.model.jcpds_lst:
             if phase.display:
-                jcount += 1
-        ucount = 0
+                phases.append(phase)
         for phase in self.model.ucfit_lst:
             if phase.display:
-                ucount += 1
-        if (jcount + ucount) == 0:
+                phases.append(phase)
+        if phases == []:
             return ''
-        if jcount != 0:
-            idx_j = []
-            diff_j = []
-            tth_j = []
-            h_j = []
-            k_j = []
-            l_j = []
-            names_j = []
-            dsp_j = []
-            int_j = []
-            for j in self.model.jcpds_lst:
-                if j.display:
-                    i, d, t = j.find_DiffLine(
-                        x, self.widget.doubleSpinBox_SetWavelength.value())
-                    idx_j.append(i)
-                    diff_j.append(d)
-                    tth_j.append(t)
-                    h_j.append(j.DiffLines[i].h)
-                    k_j.append(j.DiffLines[i].k)
-                    l_j.append(j.DiffLines[i].l)
-                    dsp_j.append(j.DiffLines[i].dsp)
-                    int_j.append(j.DiffLines[i].intensity)
-                    names_j.append(j.name)
-        if ucount != 0:
-            idx_u = []
-            diff_u = []
-            tth_u = []
-            h_u = []
-            k_u = []
-            l_u = []
-            names_u = []
-            dsp_u = []
-            int_u = []
-            for u in self.model.ucfit_lst:
-                if u.display:
-                    i, d, t = u.find_DiffLine(
-                        x, self.widget.doubleSpinBox_SetWavelength.value())
-                    idx_u.append(i)
-                    diff_u.append(d)
-                    tth_u.append(t)
-                    h_u.append(u.DiffLines[i].h)
-                    k_u.append(u.DiffLines[i].k)
-                    l_u.append(u.DiffLines[i].l)
-                    dsp_u.append(u.DiffLines[i].dsp)
-                    int_u.append(u.DiffLines[i].intensity)
-                    names_u.append(u.name)
-        if (jcount != 0) and (ucount == 0):
-            idx_min = diff_j.index(min(diff_j))
-            tth_min = tth_j[idx_min]
-            dsp_min = dsp_j[idx_min]
-            int_min = int_j[idx_min]
-            h_min = h_j[idx_min]
-            k_min = k_j[idx_min]
-            l_min = l_j[idx_min]
-            name_min = names_j[idx_min]
-        elif (jcount == 0) and (ucount != 0):
-            idx_min = diff_u.index(min(diff_u))
-            tth_min = tth_u[idx_min]
-            dsp_min = dsp_u[idx_min]
-            int_min = int_u[idx_min]
-            h_min = h_u[idx_min]
-            k_min = k_u[idx_min]
-            l_min = l_u[idx_min]
-            name_min = names_u[idx_min]
-        else:
-            if min(diff_j) <= min(diff_u):
-                idx_min = diff_j.index(min(diff_j))
-                tth_min = tth_j[idx_min]
-                dsp_min = dsp_j[idx_min]
-                int_min = int_j[idx_min]
-                h_min = h_j[idx_min]
-                k_min = k_j[idx_min]
-                l_min = l_j[idx_min]
-                name_min = names_j[idx_min]
-            else:
-                idx_min = diff_u.index(min(diff_u))
-                tth_min = tth_u[idx_min]
-                dsp_min = dsp_u[idx_min]
-                int_min = int_u[idx_min]
-                h_min = h_u[idx_min]
-                k_min = k_u[idx_min]
-                l_min = l_u[idx_min]
-                name_min = names_u[idx_min]
+        self.reflection_index.update(
+            phases, self.widget.doubleSpinBox_SetWavelength.value())
+        found = self.reflection_index.find(x)
+        if found is None:
+            return ''
+        phase, i, tth_min = found
+        dsp_min = phase.DiffLines[i].dsp
+        int_min = phase.DiffLines[i].intensity
+        h_min = phase.DiffLines[i].h
+        k_min = phase.DiffLines[i].k
+        l_min = phase.DiffLines[i].l
+        name_min = phase.name
         line1 = '2\u03B8 = {0:.4f} \u00B0, d-sp = {1:.4f} \u212B'.format(
             float(tth_min), float(dsp_min))
         line2 = 'intensity = {0: .0f}, hkl = {1: .0f} {2: .0f} {3: .0f}'.\
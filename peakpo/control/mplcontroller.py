@@ -2,7 +2,6 @@ import os
 import time
 import datetime
 import numpy as np
-import numpy.ma as ma
 from matplotlib.widgets import MultiCursor
 import matplotlib.transforms as transforms
 # import matplotlib.colors as colors
@@ -109,7 +108,7 @@ class MplController(object):
                 self.model.diff_img_exist():
             self.widget.mpl.canvas.resize_axes(
                 self.widget.horizontalSlider_CakeAxisSize.value())
-            self._plot_cake()
+            self._plot_cake(limits)
         else:
             self.widget.mpl.canvas.resize_axes(1)
         self._set_nightday_view()
@@ -253,14 +252,14 @@ class MplController(object):
                             currentText()))
             i += 1
 
-    def _plot_cake(self):
+    def _plot_cake(self, limits):
         intensity_cake, tth_cake, chi_cake = self.model.diff_img.get_cake()
+        pyramid = self.model.diff_img.get_cake_pyramid()
         min_slider_pos = self.widget.horizontalSlider_VMin.value()
         max_slider_pos = self.widget.horizontalSlider_VMax.value()
         if (max_slider_pos <= min_slider_pos):
             self.widget.horizontalSlider_VMin.setValue(1)
             self.widget.horizontalSlider_VMax.setValue(99)
-        intensity_cake_plot = ma.masked_values(intensity_cake, 0.)
         prefactor = self.widget.spinBox_MaxCakeScale.value() / \
             (10. ** self.widget.horizontalSlider_MaxScaleBars.value())
         # intensity_cake_plot.max() / \
@@ -273,17 +272,19 @@ class MplController(object):
         else:
             cmap = 'gray_r'
         mid_angle = self.widget.spinBox_AziShift.value()
-        if mid_angle != 0:
-            int_new = np.array(intensity_cake_plot)
-            int_new[0:mid_angle] = intensity_cake[360 - mid_angle:361]
-            int_new[mid_angle:361] = intensity_cake[0:360 - mid_angle]
-        else:
-            int_new = np.array(intensity_cake_plot)
-        self.widget.mpl.canvas.ax_cake.imshow(
-            int_new, origin="lower",
-            extent=[tth_cake.min(), tth_cake.max(),
-                    chi_cake.min(), chi_cake.max()],
+        # show a coarser level of the cake when a screen pixel covers
+        # many two theta bins
+        ax_cake = self.widget.mpl.canvas.ax_cake
+        level = pyramid.select_level(limits[1] - limits[0],
+                                     ax_cake.get_window_extent().width)
+        cake_image = ax_cake.imshow(
+            pyramid.get_image(level, mid_angle), origin="lower",
+            extent=pyramid.extent,
             aspect="auto", cmap=cmap, clim=climits)  # gray_r
+        ax_cake.callbacks.connect(
+            'xlim_changed',
+            lambda ax: self._update_cake_level(ax, cake_image, pyramid,
+                                               mid_angle))
         tth_list, azi_list, note_list = self._read_azilist()
         tth_min = tth_cake.min()
         tth_max = tth_cake.max()
@@ -314,6 +315,17 @@ class MplController(object):
                     linewidth=0, facecolor='r', alpha=0.2)
                 self.widget.mpl.canvas.ax_cake.add_patch(rect)
 
+    def _update_cake_level(self, ax_cake, cake_image, pyramid, mid_angle):
+        """
+        swap cake level after zoom or pan with the toolbar
+        """
+        xlim = ax_cake.get_xlim()
+        level = pyramid.select_level(abs(xlim[1] - xlim[0]),
+                                     ax_cake.get_window_extent().width)
+        image = pyramid.get_image(level, mid_angle)
+        if cake_image.get_array().shape != image.shape:
+            cake_image.set_data(image)
+
     def _plot_jcpds(self, axisrange):
         # t_start = time.time()
         if (not self.widget.checkBox_JCPDSinPattern.isChecked()) and \
@@ -1,8 +1,13 @@
 import os
+import copy
 import dill
-from PyQt5 import QtWidgets
+import numpy as np
+from PyQt5 import QtWidgets, QtCore
+from utils import dialog_savefile
+from ds_section import write_batch_fit_table
 from .mplcontroller import MplController
 from .peakfittablecontroller import PeakfitTableController
+from .fitworker import FitWorker, BatchFitWorker
 
 
 class PeakFitController(object):
@@ -13,6 +18,12 @@ class PeakFitController(object):
         self.plot_ctrl = MplController(self.model, self.widget)
         self.peakfit_table_ctrl = PeakfitTableController(
             self.model, self.widget)
+        self.fit_worker = None
+        self.progress_dialog = None
+        self._section_in_fit = None
+        self.batch_fit_worker = None
+        self.batch_progress_dialog = None
+        self._batch_filenames = None
         self.connect_channel()
 
     def connect_channel(self):
@@ -30,10 +41,13 @@ class PeakFitController(object):
             connect(self.set_section_to_current)
         self.widget.pushButton_AddRemoveFromJlist.clicked.connect(
             self.get_peaks_from_jcpds)
+        self.widget.pushButton_FindPeaks.clicked.connect(self.find_peaks)
         self.widget.pushButton_ZoomToSection.clicked.connect(
             self.zoom_to_section)
         self.widget.pushButton_PkFtSectionSavetoXLS.clicked.\
             connect(self.save_to_xls)
+        self.widget.pushButton_PkFtSectionFitWaterfall.clicked.\
+            connect(self.fit_sections_over_waterfall)
         self.widget.pushButton_PkFtSectionImport.clicked.connect(
             self.import_section_from_dpp)
         self.widget.pushButton_PlotSelectedPkFtResults.clicked.connect(
@@ -135,6 +149,36 @@ class PeakFitController(object):
         self.peakfit_table_ctrl.update_peak_constraints()
         self.plot_ctrl.update()
 
+    def find_peaks(self):
+        """
+        replace peaks in the current section with peaks found
+        automatically, using the initial FWHM for smoothing
+        """
+        if self.fit_worker is not None:
+            return
+        if not self.model.current_section_exist():
+            QtWidgets.QMessageBox.warning(self.widget, "Warning",
+                                          "Set a section first.")
+            return
+        if self.model.current_section.peaks_exist():
+            reply = QtWidgets.QMessageBox.question(
+                self.widget, "Question",
+                "Found peaks replace the peaks and any unsaved result "
+                "in the section.  Proceed?",
+                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                QtWidgets.QMessageBox.Yes)
+            if reply == QtWidgets.QMessageBox.No:
+                return
+        n_peaks = self.model.current_section.find_peaks(
+            self.widget.doubleSpinBox_InitialFWHM.value())
+        if n_peaks == 0:
+            QtWidgets.QMessageBox.warning(
+                self.widget, "Warning", "No peak is found in the section.")
+        self.set_tableWidget_PkParams_unsaved()
+        self.peakfit_table_ctrl.update_peak_parameters()
+        self.peakfit_table_ctrl.update_peak_constraints()
+        self.plot_ctrl.update()
+
     def get_style_for_unsaved(self):
         return "Background-color:rgb(255,204,255);color:rgb(0,0,0);"
 
@@ -331,6 +375,8 @@ class PeakFitController(object):
     '''
 
     def conduct_fitting(self):
+        if self.fit_worker is not None:
+            return
         if not self.model.current_section_exist():
             QtWidgets.QMessageBox.warning(
                 self.widget, "Warning", "No section is defined")
@@ -341,9 +387,44 @@ class PeakFitController(object):
             return
         width = self.widget.doubleSpinBox_InitialFWHM.value()
         order = self.widget.spinBox_BGPolyOrder.value()
-        self.model.current_section.prepare_for_fitting(order)
-        success = self.model.current_section.conduct_fitting()
+        # fit a copy in a worker thread, the window keeps responding
+        self._section_in_fit = self.model.current_section
+        section = copy.deepcopy(self.model.current_section)
+        section.prepare_for_fitting(order)
+        self.fit_worker = FitWorker(section)
+        self.fit_worker.signals.progress.connect(self._show_fitting_progress)
+        self.fit_worker.signals.finished.connect(self._finish_fitting)
+        self.progress_dialog = QtWidgets.QProgressDialog(
+            'Fitting started.', 'Cancel', 0, 0, self.widget)
+        self.progress_dialog.setWindowTitle('Peak fitting')
+        self.progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        self.progress_dialog.setMinimumDuration(0)
+        self.progress_dialog.canceled.connect(self.fit_worker.cancel)
+        self.widget.pushButton_ConductFitting.setEnabled(False)
+        QtCore.QThreadPool.globalInstance().start(self.fit_worker)
+
+    def _show_fitting_progress(self, n_eval, chisqr):
+        if self.progress_dialog is None:
+            return
+        self.progress_dialog.setLabelText(
+            'Evaluation {0:d}, chi-square = {1:.6g}'.format(n_eval, chisqr))
+
+    def _finish_fitting(self, section, success, message):
+        self.progress_dialog.canceled.disconnect()
+        self.progress_dialog.reset()
+        self.progress_dialog.deleteLater()
+        self.progress_dialog = None
+        self.fit_worker = None
+        self.widget.pushButton_ConductFitting.setEnabled(True)
+        section_in_fit = self._section_in_fit
+        self._section_in_fit = None
+        if self.model.current_section is not section_in_fit:
+            QtWidgets.QMessageBox.warning(
+                self.widget, "Warning",
+                'Section has changed during fitting.  Result is ignored.')
+            return
         if success:
+            self.model.current_section = section
             QtWidgets.QMessageBox.warning(self.widget, "Information",
                                           'Fitting finished.')
             self.plot_ctrl.update()
@@ -351,9 +432,97 @@ class PeakFitController(object):
             self.peakfit_table_ctrl.update_baseline_constraints()
             self.peakfit_table_ctrl.update_peak_constraints()
             self.set_tableWidget_PkParams_unsaved()
+        elif message == 'Cancelled.':
+            QtWidgets.QMessageBox.warning(self.widget, "Information",
+                                          'Fitting cancelled.')
         else:
             QtWidgets.QMessageBox.warning(self.widget, "Information",
-                                          'Fitting failed.')
+                                          'Fitting failed. ' + message)
+
+    def fit_sections_over_waterfall(self):
+        """
+        fit saved sections over all waterfall patterns, each fit starting
+        from the result for the neighbouring pattern, and save the results
+        in a csv file
+        """
+        if (self.fit_worker is not None) or \
+                (self.batch_fit_worker is not None):
+            return
+        if not self.model.waterfall_exist():
+            QtWidgets.QMessageBox.warning(
+                self.widget, "Warning", "Add patterns to waterfall first.")
+            return
+        sections = [section for section in self.model.section_lst
+                    if section.fitted()]
+        if (sections == []) and self.model.current_section_exist() and \
+                self.model.current_section.fitted():
+            sections = [self.model.current_section]
+        if sections == []:
+            QtWidgets.QMessageBox.warning(
+                self.widget, "Warning", "Fit and save sections first.")
+            return
+        n_ptns = self.model.waterfall_ptn.__len__()
+        pressure = self.widget.doubleSpinBox_Pressure.value()
+        text, ok = QtWidgets.QInputDialog.getText(
+            self.widget, "Pressures",
+            "Pressures for the first and last waterfall patterns in GPa.\n"
+            "Pressures in between are interpolated.",
+            text="{0:.2f}, {0:.2f}".format(pressure))
+        if not ok:
+            return
+        try:
+            p_first, p_last = [float(value) for value in text.split(',')]
+        except ValueError:
+            QtWidgets.QMessageBox.warning(
+                self.widget, "Warning",
+                "Give two pressures separated by a comma.")
+            return
+        pressures = np.linspace(p_first, p_last, n_ptns)
+        temperatures = [self.widget.doubleSpinBox_Temperature.value()] * \
+            n_ptns
+        # fit copies in a worker thread, the window keeps responding
+        self._batch_filenames = [
+            pattern.fname for pattern in self.model.waterfall_ptn]
+        self.batch_fit_worker = BatchFitWorker(
+            self.model, copy.deepcopy(sections), pressures, temperatures)
+        self.batch_fit_worker.signals.finished.connect(
+            self._finish_batch_fitting)
+        self.batch_progress_dialog = QtWidgets.QProgressDialog(
+            'Fitting {0:d} sections over {1:d} patterns.'.format(
+                sections.__len__(), n_ptns), None, 0, 0, self.widget)
+        self.batch_progress_dialog.setWindowTitle('Peak fitting')
+        self.batch_progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        self.batch_progress_dialog.setMinimumDuration(0)
+        self.widget.pushButton_PkFtSectionFitWaterfall.setEnabled(False)
+        QtCore.QThreadPool.globalInstance().start(self.batch_fit_worker)
+
+    def _finish_batch_fitting(self, table, message):
+        self.batch_progress_dialog.reset()
+        self.batch_progress_dialog.deleteLater()
+        self.batch_progress_dialog = None
+        self.batch_fit_worker = None
+        self.widget.pushButton_PkFtSectionFitWaterfall.setEnabled(True)
+        filenames = self._batch_filenames
+        self._batch_filenames = None
+        if table is None:
+            QtWidgets.QMessageBox.warning(
+                self.widget, "Warning", 'Fitting failed. ' + message)
+            return
+        if self.model.base_ptn_exist():
+            filen_csv_t = self.model.make_filename('batchfit.csv')
+        else:
+            filen_csv_t = os.path.join(self.model.chi_path, 'batchfit.csv')
+        filen_csv = dialog_savefile(self.widget, filen_csv_t)
+        if filen_csv == '':
+            return
+        write_batch_fit_table(filen_csv, table, filenames=filenames)
+        n_failed = np.unique(table[~table['success']][
+            ['section', 'file_index']]).size
+        n_fits = np.unique(table[['section', 'file_index']]).size
+        if n_failed > 0:
+            QtWidgets.QMessageBox.warning(
+                self.widget, "Warning",
+                "{0:d} of {1:d} fits failed.".format(n_failed, n_fits))
 
     def save_to_xls(self):
         filen_xls = self.model.make_filename('peakfit.xls')
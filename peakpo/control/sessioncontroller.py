@@ -274,6 +274,8 @@ class SessionController(object):
             for ptn in self.model.session.waterfallpatterns:
                 if os.path.exists(ptn.fname):
                     new_wf_ptn_names.append(ptn.fname)
+                    new_wf_wavelength.append(ptn.wavelength)
+                    new_wf_display.append(ptn.display)
                 elif os.path.exists(os.path.join(
                         self.model.chi_path, os.path.basename(ptn.fname))):
                     new_wf_ptn_names.append(
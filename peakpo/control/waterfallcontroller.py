@@ -138,20 +138,21 @@ class WaterfallController(object):
 
     def _add_patterns(self, files):
         if files is not None:
-            for f in files:
-                filename = str(f)
-                wavelength = self.widget.doubleSpinBox_SetWavelength.value()
-                bg_roi = [self.widget.doubleSpinBox_Background_ROI_min.value(),
-                          self.widget.doubleSpinBox_Background_ROI_max.value()]
-                bg_params = [self.widget.spinBox_BGParam0.value(),
-                             self.widget.spinBox_BGParam1.value(),
-                             self.widget.spinBox_BGParam2.value()]
-                if self.widget.checkBox_UseTempBGSub.isChecked():
-                    temp_dir = os.path.join(self.model.chi_path, 'temporary_pkpo')
-                else:
-                    temp_dir = None
-                self.model.append_a_waterfall_ptn(
-                    filename, wavelength, bg_roi, bg_params, temp_dir=temp_dir)
+            filenames = [str(f) for f in files]
+            wavelength = self.widget.doubleSpinBox_SetWavelength.value()
+            bg_roi = [self.widget.doubleSpinBox_Background_ROI_min.value(),
+                      self.widget.doubleSpinBox_Background_ROI_max.value()]
+            bg_params = [self.widget.spinBox_BGParam0.value(),
+                         self.widget.spinBox_BGParam1.value(),
+                         self.widget.spinBox_BGParam2.value()]
+            if self.widget.checkBox_UseTempBGSub.isChecked():
+                temp_dir = os.path.join(self.model.chi_path, 'temporary_pkpo')
+            else:
+                temp_dir = None
+            self.widget.setCursor(QtCore.Qt.WaitCursor)
+            self.model.append_waterfall_ptns(
+                filenames, wavelength, bg_roi, bg_params, temp_dir=temp_dir)
+            self.widget.unsetCursor()
             self.waterfall_table_ctrl.update()
             self._apply_changes_to_graph()
         return
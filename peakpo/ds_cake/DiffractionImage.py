@@ -1,17 +1,166 @@
 import os
 import time
-from PIL import Image
-import fabio
+import hashlib
+import json
+import struct
+import zipfile
+import threading
+from collections import OrderedDict
 import numpy.ma as ma
 import numpy as np
+from scipy.sparse import csr_matrix
 import pyFAI
 import matplotlib.pyplot as plt
-from utils import make_filename, extract_extension
+from utils import make_filename, save_atomic
+from .imagecache import load_image
+from .cakepyramid import CakePyramid
+
+# integrators are kept warm across images.  pyFAI stores the csr matrix
+# in the integrator, so one integrator per geometry and binning is kept.
+MAX_INTEGRATORS = 4
+_integrators = OrderedDict()
+_integrators_lock = threading.Lock()
+
+
+# change this when the cake container or caking changes the output
+CAKE_CACHE_VERSION = 'cake2'
+
+# two theta binning for cake and 1d integration.  a bin is the angle of
+# a pixel seen from the sample divided by TTH_OVERSAMPLING, unless DTTH
+# (in degree) is given.  number of bins is capped at MAX_TTH_BINS.
+TTH_OVERSAMPLING = 2.
+DTTH = None
+MAX_TTH_BINS = 8192
+
+# sparse operators for sector integration, see get_sector_operator
+MAX_SECTOR_OPERATORS = 2
+_sector_operators = OrderedDict()
+
+
+def hash_poni(poni_filename):
+    with open(poni_filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def get_integrator(poni_filename, *engine_key):
+    """
+    return a cached pyFAI azimuthal integrator for a poni file.
+
+    :param poni_filename: poni filename
+    :param engine_key: anything else which changes the csr matrix,
+        such as image shape, number of bins and ranges.
+    :return: pyFAI AzimuthalIntegrator
+    """
+    key = (hash_poni(poni_filename),) + engine_key
+    with _integrators_lock:
+        if key in _integrators:
+            _integrators.move_to_end(key)
+            return _integrators[key]
+    integrator = pyFAI.load(poni_filename)
+    with _integrators_lock:
+        _integrators[key] = integrator
+        while _integrators.__len__() > MAX_INTEGRATORS:
+            _integrators.popitem(last=False)
+    return integrator
+
+
+def get_sector_operator(poni_filename, shape, n_bins, radial_range,
+                        azimuth_ranges, polarization_factor=0.99):
+    """
+    return a cached sparse operator for sector integration.
+    see make_sector_operator for parameters.
+    """
+    key = (hash_poni(poni_filename), shape, n_bins, tuple(radial_range),
+           tuple(tuple(azi) for azi in azimuth_ranges), polarization_factor)
+    with _integrators_lock:
+        if key in _sector_operators:
+            _sector_operators.move_to_end(key)
+            return _sector_operators[key]
+    operator = make_sector_operator(
+        get_integrator(poni_filename, 'geometry'), shape, n_bins,
+        radial_range, azimuth_ranges,
+        polarization_factor=polarization_factor)
+    with _integrators_lock:
+        _sector_operators[key] = operator
+        while _sector_operators.__len__() > MAX_SECTOR_OPERATORS:
+            _sector_operators.popitem(last=False)
+    return operator
+
+
+def make_sector_operator(integrator, shape, n_bins, radial_range,
+                         azimuth_ranges, polarization_factor=0.99):
+    """
+    make a sparse matrix which sums pixels to radial bins of every
+    azimuthal sector.  row i_sector * n_bins + i_bin of the matrix has
+    ones for pixels whose centers fall in the bin and the sector.
+
+    :param integrator: pyFAI AzimuthalIntegrator for the geometry
+    :param shape: image shape
+    :param n_bins: number of two theta bins
+    :param radial_range: two theta range in degrees
+    :param azimuth_ranges: list of [azi_min, azi_max] in degrees between
+        -180 and 180.  azi_min > azi_max for a sector across 180.
+    :return: operator, correction for each pixel, two theta of bins
+    """
+    tth = np.rad2deg(integrator.twoThetaArray(shape)).ravel()
+    azi = np.rad2deg(integrator.chiArray(shape)).ravel()
+    bin_width = (radial_range[1] - radial_range[0]) / n_bins
+    i_bin = np.floor((tth - radial_range[0]) / bin_width).astype(np.int64)
+    in_range = (i_bin >= 0) & (i_bin < n_bins)
+    rows = []
+    cols = []
+    for i, (azi_min, azi_max) in enumerate(azimuth_ranges):
+        if azi_min <= azi_max:
+            in_sector = (azi >= azi_min) & (azi < azi_max)
+        else:
+            in_sector = (azi >= azi_min) | (azi < azi_max)
+        pixels = np.nonzero(in_range & in_sector)[0]
+        rows.append(i * n_bins + i_bin[pixels])
+        cols.append(pixels)
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    operator = csr_matrix(
+        (np.ones(rows.size, dtype=np.float32), (rows, cols)),
+        shape=(azimuth_ranges.__len__() * n_bins, tth.size))
+    correction = integrator.solidAngleArray(shape) * \
+        integrator.polarization(shape, factor=polarization_factor)
+    tth_bins = radial_range[0] + (np.arange(n_bins) + 0.5) * bin_width
+    return operator, correction.ravel().astype(np.float32), tth_bins
+
+
+def mmap_npz_member(filename, name):
+    """
+    memory map an array stored without compression in a npz file.
+
+    :param filename: npz filename
+    :param name: name of the array in the npz
+    :return: read-only np.memmap, None if the array is compressed
+    """
+    with zipfile.ZipFile(filename) as zf:
+        info = zf.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(filename, 'rb') as f:
+        # local file header is 30 bytes, followed by name and extra field
+        f.seek(info.header_offset + 26)
+        len_name, len_extra = struct.unpack('<HH', f.read(4))
+        f.seek(info.header_offset + 30 + len_name + len_extra)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                     shape=shape, order='F' if fortran_order else 'C')
 
 
 class DiffImg(object):
     def __init__(self):
         self.img_filename = None
+        self.poni_filename = None
         self.poni = None
         self.img = None
         self.intensity = None
@@ -22,13 +171,11 @@ class DiffImg(object):
         self.mask = None
 
     def load(self, img_filename):
+        """
+        image is shared with a cache and is read only
+        """
         self.img_filename = img_filename
-        if extract_extension(self.img_filename) == 'tif':
-            data = Image.open(self.img_filename)
-        elif extract_extension(self.img_filename) == 'mar3450':
-            data_fabio = fabio.open(img_filename)
-            data = data_fabio.data
-        self.img = np.array(data)[::-1]
+        self.img = load_image(img_filename)
 
     def histogram(self):
         if self.img is None:
@@ -44,7 +191,8 @@ class DiffImg(object):
         f.show()
 
     def set_calibration(self, poni_filename):
-        self.poni = pyFAI.load(poni_filename)
+        self.poni_filename = poni_filename
+        self.poni = get_integrator(poni_filename, 'geometry')
 
     def calculate_n_azi_pnts(self):
         """
@@ -75,28 +223,123 @@ class DiffImg(object):
         print(tth_max)
         return tth_max
 
+    def get_radial_bins(self, dtth=None, max_bins=None):
+        """
+        two theta range covered by the detector and number of bins from
+        the pixel size and distance in poni.  needs set_calibration.
+
+        :param dtth: bin width in degree.  None for DTTH or the angle of
+            a pixel divided by TTH_OVERSAMPLING
+        :param max_bins: maximum number of bins.  None for MAX_TTH_BINS
+        :return: radial_range, n_bins
+        """
+        if dtth is None:
+            dtth = DTTH
+        if dtth is None:
+            dtth = np.rad2deg(
+                np.max([self.poni.pixel1, self.poni.pixel2]) /
+                self.poni.dist) / TTH_OVERSAMPLING
+        if max_bins is None:
+            max_bins = MAX_TTH_BINS
+        # pyFAI keeps this array, so it is made only once for a geometry
+        tth_max = np.rad2deg(self.poni.twoThetaArray(self.img.shape).max())
+        # one more bin so that the pixel at tth_max is inside the range
+        n_bins = int(np.ceil(tth_max / dtth)) + 1
+        if n_bins > max_bins:
+            n_bins = max_bins
+            dtth = tth_max / (n_bins - 1)
+        return (0., float(n_bins * dtth)), n_bins
+
+    def report_binning(self, n_bins, n_azi_bins):
+        """
+        print how much smaller the cake is than with the old 4 x diagonal
+        pixel distance bins
+        """
+        n_bins_old = self.calculate_n_azi_pnts() * 2
+        memory_saved = (n_bins_old - n_bins) * n_azi_bins * 4 / 1.e6
+        print("Cake has {0:d} x {1:d} bins instead of {2:d} x {1:d}: "
+              "{3:.1f} MB less and {4:.1f} times fewer pixels to "
+              "integrate and draw".format(n_bins, n_azi_bins, n_bins_old,
+                                          memory_saved,
+                                          n_bins_old / n_bins))
+
+    def _get_data_for_integration(self):
+        """
+        masked pixels are replaced with a dummy value instead of passing
+        the mask to pyFAI.  intensity mask changes for every image, but
+        a dummy value does not change the csr matrix.
+
+        :return: image, dummy, delta_dummy
+        """
+        if (self.mask is None) or (not np.any(self.mask)):
+            return self.img, None, None
+        dummy = np.floor(min(self.img.min(), 0.)) - 1.
+        data = np.where(self.mask, dummy, self.img).astype(np.float32)
+        return data, dummy, 0.5
+
     def integrate_to_1d(self, **kwargs):
-        n_azi_pnts = self.calculate_n_azi_pnts()  # * 2 reduced number for Mar345 data
-        radial_range = (0., self.calculate_max_twotheta())
-        tth, intensity = self.poni.integrate1d(
-            self.img, n_azi_pnts, radial_range=radial_range,
-            mask=self.mask, unit="2th_deg", polarization_factor=0.99,
-            method='csr', **kwargs)
+        radial_range, n_azi_pnts = self.get_radial_bins()
+        data, dummy, delta_dummy = self._get_data_for_integration()
+        integrator = get_integrator(
+            self.poni_filename, '1d', self.img.shape, n_azi_pnts,
+            radial_range, tuple(sorted(kwargs.items())))
+        tth, intensity = integrator.integrate1d(
+            data, n_azi_pnts, radial_range=radial_range,
+            dummy=dummy, delta_dummy=delta_dummy, unit="2th_deg",
+            polarization_factor=0.99, method='csr', **kwargs)
         """
         self.tth = tth
         self.intensity = intensity
         """
         return tth, intensity
 
+    def integrate_sectors(self, azimuth_ranges, merge=False):
+        """
+        integrate to 1d for many azimuthal ranges in one pass over the
+        image.  pixels are not split between bins, so results can be
+        slightly different from integrate_to_1d.
+
+        :param azimuth_ranges: list of [azi_min, azi_max] in degrees
+            between -180 and 180
+        :param merge: if True, return sum of all sectors
+        :return: tth, intensity.  intensity has a row for each sector
+            or is 1d if merge is True.
+        """
+        t_start = time.time()
+        radial_range, n_azi_pnts = self.get_radial_bins()
+        operator, correction, tth = get_sector_operator(
+            self.poni_filename, self.img.shape, n_azi_pnts, radial_range,
+            azimuth_ranges)
+        data = self.img.ravel().astype(np.float32)
+        if (self.mask is not None) and np.any(self.mask):
+            valid = ~self.mask.ravel()
+            data = np.where(valid, data, 0.)
+            correction = np.where(valid, correction, 0.)
+        signal = operator.dot(data)
+        norm = operator.dot(correction)
+        intensity = np.zeros_like(signal)
+        intensity[norm > 0.] = signal[norm > 0.] / norm[norm > 0.]
+        intensity = intensity.reshape(azimuth_ranges.__len__(), n_azi_pnts)
+        print("Integrating {0:d} sectors takes {1:.2f}s".format(
+            azimuth_ranges.__len__(), time.time() - t_start))
+        if merge:
+            return tth, intensity.sum(axis=0)
+        return tth, intensity
+
     def integrate_to_cake(self, **kwargs):
         t_start = time.time()
-        n_azi_pnts = self.calculate_n_azi_pnts() * 2
-        radial_range = (0., self.calculate_max_twotheta())
-        intensity_cake, tth_cake, chi_cake = self.poni.integrate2d(
-            self.img, n_azi_pnts, 360, unit="2th_deg", method='csr',
-            radial_range=radial_range, polarization_factor=0.99, mask=self.mask,
-            **kwargs)
+        radial_range, n_azi_pnts = self.get_radial_bins()
+        n_azi_bins = self.get_cake_bins()[1]
+        data, dummy, delta_dummy = self._get_data_for_integration()
+        integrator = get_integrator(
+            self.poni_filename, '2d', self.img.shape, n_azi_pnts, n_azi_bins,
+            radial_range, tuple(sorted(kwargs.items())))
+        intensity_cake, tth_cake, chi_cake = integrator.integrate2d(
+            data, n_azi_pnts, n_azi_bins, unit="2th_deg", method='csr',
+            radial_range=radial_range, polarization_factor=0.99,
+            dummy=dummy, delta_dummy=delta_dummy, **kwargs)
         print("Caking takes {0:.2f}s".format(time.time() - t_start))
+        self.report_binning(n_azi_pnts, n_azi_bins)
         self.intensity_cake = intensity_cake
         self.tth_cake = tth_cake
         self.chi_cake = chi_cake
@@ -113,6 +356,26 @@ class DiffImg(object):
         else:
             return self.intensity_cake, self.tth_cake, self.chi_cake
 
+    def get_cake_pyramid(self):
+        """
+        multi-resolution cake for display.  made again only when the cake
+        has changed.
+        """
+        if self.intensity_cake is None:
+            return None
+        pyramid = getattr(self, '_cake_pyramid', None)
+        if (pyramid is None) or (pyramid.source is not self.intensity_cake):
+            pyramid = CakePyramid(self.intensity_cake, self.tth_cake,
+                                  self.chi_cake)
+            self._cake_pyramid = pyramid
+        return pyramid
+
+    def __getstate__(self):
+        # pyramid is only for display and is made again when needed
+        state = self.__dict__.copy()
+        state.pop('_cake_pyramid', None)
+        return state
+
     def set_mask(self, range):
         if self.img is None:
             return False
@@ -128,30 +391,93 @@ class DiffImg(object):
         f_chi = chi_filen_wo_ext_in_temp + '.chi.cake.npy'
         f_int = chi_filen_wo_ext_in_temp + '.int.cake.npy'
 
-    def read_cake_from_tempfile(self, temp_dir=None):
-        tth_filen, azi_filen, int_filen = \
-            self.make_temp_filenames(temp_dir=temp_dir)
-        if os.path.exists(tth_filen) and os.path.exists(azi_filen) and \
-                os.path.exists(int_filen):
-            self.tth_cake = np.load(tth_filen)
-            self.chi_cake = np.load(azi_filen)
-            self.intensity_cake = np.load(int_filen)
-            return True
-        else:
+    def get_cake_bins(self):
+        """
+        :return: number of two theta bins and azimuthal bins for cake
+        """
+        return self.get_radial_bins()[1], 360
+
+    def make_cake_cache_meta(self, poni_filename, mask_range):
+        """
+        information which should be the same for a cake cache to be used
+        """
+        stat = os.stat(self.img_filename)
+        return {'version': CAKE_CACHE_VERSION,
+                'poni': hash_poni(poni_filename),
+                'mask': [float(m) for m in mask_range],
+                'img_mtime': stat.st_mtime,
+                'img_size': stat.st_size}
+
+    def read_cake_from_tempfile(self, temp_dir=None, poni_filename=None,
+                                mask_range=None):
+        """
+        read cake from the cache in temp_dir.  returns True only if the
+        cache was made from the same image with the same poni and mask
+        range, otherwise False.  uncompressed cake is memory mapped.
+
+        :param poni_filename: poni filename currently in use
+        :param mask_range: [min, max] of intensity mask currently in use
+        """
+        filen = self.make_temp_filename(temp_dir=temp_dir)
+        if (poni_filename is None) or (mask_range is None) or \
+                (not os.path.exists(filen)):
+            return False
+        try:
+            with np.load(filen) as cache:
+                meta = json.loads(str(cache['meta']))
+                if meta['meta'] != self.make_cake_cache_meta(
+                        poni_filename, mask_range):
+                    return False
+                tth_cake = cache['tth']
+                chi_cake = cache['azi']
+            intensity_cake = mmap_npz_member(filen, 'intensity')
+            if intensity_cake is None:
+                with np.load(filen) as cache:
+                    intensity_cake = cache['intensity']
+        except (IOError, ValueError, KeyError, zipfile.BadZipFile):
+            # broken or old cache file, cake again
             return False
+        self.set_calibration(poni_filename)
+        if list(meta['bins']) != list(self.get_cake_bins()):
+            return False
+        self.tth_cake = tth_cake
+        self.chi_cake = chi_cake
+        self.intensity_cake = intensity_cake
+        return True
+
+    def make_temp_filename(self, temp_dir=None):
+        return make_filename(self.img_filename, 'cake.npz', temp_dir=temp_dir)
+
+    def write_temp_cakefiles(self, temp_dir='temporary_pkpo', mask_range=None,
+                             dtype=None, compress=False):
+        """
+        save cake with information to validate it later.  needs
+        set_calibration before.
 
-    def make_temp_filenames(self, temp_dir=None):
-        tth_filen = make_filename(self.img_filename, 'tth.cake.npy',
-                                  temp_dir=temp_dir)
-        azi_filen = make_filename(self.img_filename, 'azi.cake.npy',
-                                  temp_dir=temp_dir)
-        int_filen = make_filename(self.img_filename, 'int.cake.npy',
-                                  temp_dir=temp_dir)
-        return tth_filen, azi_filen, int_filen
-
-    def write_temp_cakefiles(self, temp_dir='temporary_pkpo'):
-        tth_filen, azi_filen, int_filen = self.make_temp_filenames(
-            temp_dir=temp_dir)
-        np.save(tth_filen, self.tth_cake)
-        np.save(azi_filen, self.chi_cake)
-        np.save(int_filen, self.intensity_cake)
+        :param mask_range: [min, max] of intensity mask used for the cake
+        :param dtype: dtype for intensity, for example np.float32 to save
+            space.  None to keep the dtype from pyFAI.
+        :param compress: compress the file.  compressed cake cannot be
+            memory mapped.
+        """
+        filen = self.make_temp_filename(temp_dir=temp_dir)
+        if (self.poni_filename is None) or (mask_range is None):
+            return
+        intensity_cake = np.asarray(self.intensity_cake)
+        if dtype is not None:
+            intensity_cake = intensity_cake.astype(dtype)
+        meta = {'meta': self.make_cake_cache_meta(self.poni_filename,
+                                                  mask_range),
+                'bins': list(self.get_cake_bins()),
+                'dtype': intensity_cake.dtype.str}
+        if compress:
+            savez = np.savez_compressed
+        else:
+            savez = np.savez
+        try:
+            save_atomic(filen, lambda f: savez(
+                f, meta=json.dumps(meta), tth=self.tth_cake,
+                azi=self.chi_cake, intensity=intensity_cake))
+        except OSError:
+            # old cache can be memory mapped on Windows
+            pass
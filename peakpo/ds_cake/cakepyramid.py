@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class CakePyramid(object):
+    """
+    cake at several resolutions along two theta for display.  level 0 is
+    the full cake and every next level has half the two theta bins.
+    azimuthally shifted images are kept for the last shift used.
+    """
+
+    def __init__(self, intensity_cake, tth_cake, chi_cake, mode='max',
+                 min_bins=256):
+        """
+        :param mode: 'max' keeps sharp peaks and spots visible,
+            'mean' keeps the average intensity
+        :param min_bins: no more levels below this many two theta bins
+        """
+        self.source = intensity_cake
+        self.extent = [tth_cake.min(), tth_cake.max(),
+                       chi_cake.min(), chi_cake.max()]
+        self.levels = [np.asarray(intensity_cake)]
+        while self.levels[-1].shape[1] > min_bins * 2:
+            self.levels.append(self._pool(self.levels[-1], mode))
+        self._mid_angle = None
+        self._shifted = {}  # level: shifted image
+
+    def _pool(self, image, mode):
+        if image.shape[1] % 2 != 0:
+            image = np.concatenate((image, image[:, -1:]), axis=1)
+        pairs = image.reshape(image.shape[0], image.shape[1] // 2, 2)
+        if mode == 'mean':
+            return pairs.mean(axis=2)
+        return pairs.max(axis=2)
+
+    def select_level(self, tth_span, width_px):
+        """
+        choose the coarsest level which still has at least one bin for
+        every screen pixel in the visible two theta range
+
+        :param tth_span: visible two theta range in degree
+        :param width_px: width of the axes in screen pixels
+        :return: level
+        """
+        full_span = self.extent[1] - self.extent[0]
+        if (full_span <= 0.) or (width_px <= 0.):
+            return 0
+        n_visible = self.levels[0].shape[1] * min(tth_span / full_span, 1.)
+        level = 0
+        while (level + 1 < self.levels.__len__()) and \
+                (n_visible / 2. ** (level + 1) >= width_px):
+            level += 1
+        return level
+
+    def get_image(self, level, mid_angle=0):
+        """
+        :param mid_angle: azimuthal shift in number of azimuthal bins
+        :return: image at the level rolled by mid_angle along azimuth
+        """
+        if mid_angle != self._mid_angle:
+            self._mid_angle = mid_angle
+            self._shifted = {}
+        if level not in self._shifted:
+            if mid_angle == 0:
+                self._shifted[level] = self.levels[level]
+            else:
+                self._shifted[level] = np.roll(self.levels[level], mid_angle,
+                                               axis=0)
+        return self._shifted[level]
@@ -0,0 +1,133 @@
+import os
+import struct
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+import fabio
+from utils import extract_extension
+
+# recently loaded images.  memory mapped images cost little memory.
+MAX_IMAGES = 4
+_images = OrderedDict()
+_images_lock = threading.Lock()
+
+# tiff tags used for memory mapping
+_TIFF_TYPES = {3: 'H', 4: 'I'}
+_TIFF_SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+def _read_tiff_tags(f, byte_order):
+    """
+    read integer tags of the first image file directory
+
+    :return: dict of tag: list of values
+    """
+    f.seek(4)
+    ifd_offset = struct.unpack(byte_order + 'I', f.read(4))[0]
+    f.seek(ifd_offset)
+    n_entries = struct.unpack(byte_order + 'H', f.read(2))[0]
+    entries = f.read(12 * n_entries)
+    tags = {}
+    for i in range(n_entries):
+        entry = entries[i * 12:(i + 1) * 12]
+        tag, tag_type, count = struct.unpack(byte_order + 'HHI', entry[:8])
+        if tag_type not in _TIFF_TYPES:
+            continue
+        fmt = byte_order + _TIFF_TYPES[tag_type] * count
+        size = struct.calcsize(fmt)
+        if size <= 4:
+            values = struct.unpack(fmt, entry[8:8 + size])
+        else:
+            offset = struct.unpack(byte_order + 'I', entry[8:12])[0]
+            position = f.tell()
+            f.seek(offset)
+            values = struct.unpack(fmt, f.read(size))
+            f.seek(position)
+        tags[tag] = list(values)
+    return tags
+
+
+def memmap_tiff(filename):
+    """
+    memory map an uncompressed, single channel tiff whose strips are
+    stored one after another.
+
+    :param filename: tiff filename
+    :return: read-only np.memmap, None if the tiff cannot be mapped
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(4)
+        if header[:2] == b'II':
+            byte_order = '<'
+        elif header[:2] == b'MM':
+            byte_order = '>'
+        else:
+            return None
+        # 43 is BigTIFF
+        if struct.unpack(byte_order + 'H', header[2:4])[0] != 42:
+            return None
+        tags = _read_tiff_tags(f, byte_order)
+    try:
+        width = tags[256][0]
+        height = tags[257][0]
+        bits = tags.get(258, [1])[0]
+        compression = tags.get(259, [1])[0]
+        samples = tags.get(277, [1])[0]
+        sample_format = tags.get(339, [1])[0]
+        strip_offsets = tags[273]
+        strip_bytes = tags[279]
+    except KeyError:
+        # tiled tiff or missing tags
+        return None
+    if (compression != 1) or (samples != 1) or \
+            (bits not in (8, 16, 32, 64)) or \
+            (sample_format not in _TIFF_SAMPLE_FORMATS):
+        return None
+    dtype = np.dtype('{0}{1}{2:d}'.format(
+        byte_order, _TIFF_SAMPLE_FORMATS[sample_format], bits // 8))
+    for i in range(1, strip_offsets.__len__()):
+        if strip_offsets[i] != strip_offsets[i - 1] + strip_bytes[i - 1]:
+            return None
+    if sum(strip_bytes) < width * height * dtype.itemsize:
+        return None
+    return np.memmap(filename, dtype=dtype, mode='r',
+                     offset=strip_offsets[0], shape=(height, width))
+
+
+def read_image(filename):
+    """
+    read tif or mar3450 image without flipping.  uncompressed tif is
+    memory mapped.
+    """
+    if extract_extension(filename) == 'tif':
+        img = memmap_tiff(filename)
+        if img is None:
+            img = np.array(Image.open(filename))
+    elif extract_extension(filename) == 'mar3450':
+        img = np.asarray(fabio.open(filename).data)
+    return img
+
+
+def load_image(filename):
+    """
+    return image flipped upside down, as a view, from a small cache of
+    recently loaded images.  the cache is keyed on path and mtime, so a
+    changed file is read again.
+
+    :param filename: tif or mar3450 filename
+    :return: read-only view of image
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+    with _images_lock:
+        if key in _images:
+            _images.move_to_end(key)
+            return _images[key]
+    img = read_image(filename)[::-1]
+    img.flags.writeable = False
+    with _images_lock:
+        _images[key] = img
+        while _images.__len__() > MAX_IMAGES:
+            _images.popitem(last=False)
+    return img
@@ -3,3 +3,6 @@ from .jcpds import Session
 from .jcpds import UnitCell
 from .jcpds import DiffractionLine
 from .xrd import convert_tth
+from .library import JcpdsLibrary, get_jcpds_library
+from .searchmatch import search_match
+from .reflectionindex import ReflectionIndex
@@ -0,0 +1,41 @@
+"""
+d-spacings and two theta of a JCPDS card on a pressure-temperature grid.
+run from the peakpo folder, for example,
+
+    python -m ds_jcpds mgo.jcpds -p 0 100 51 -t 300 2000 5 -o mgo_pt.csv
+"""
+import argparse
+import numpy as np
+from .jcpds import JCPDS
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ds_jcpds',
+        description='Calculate diffraction lines of a JCPDS card on a '
+                    'pressure-temperature grid.')
+    parser.add_argument('jcpds', help='JCPDS filename')
+    parser.add_argument('-p', '--pressure', nargs=3, type=float,
+                        default=[0., 100., 101],
+                        metavar=('MIN', 'MAX', 'N'),
+                        help='pressures in GPa (default: 0 100 101)')
+    parser.add_argument('-t', '--temperature', nargs=3, type=float,
+                        default=[300., 300., 1],
+                        metavar=('MIN', 'MAX', 'N'),
+                        help='temperatures in K (default: 300 300 1)')
+    parser.add_argument('-w', '--wavelength', type=float, default=0.3344,
+                        help='x-ray wavelength in A (default: 0.3344)')
+    parser.add_argument('-o', '--output', required=True,
+                        help='output filename, npz or csv')
+    args = parser.parse_args(args)
+    pressures = np.linspace(args.pressure[0], args.pressure[1],
+                            int(args.pressure[2]))
+    temperatures = np.linspace(args.temperature[0], args.temperature[1],
+                               int(args.temperature[2]))
+    jcpds = JCPDS(filename=args.jcpds)
+    jcpds.write_PT_grid(args.output, pressures, temperatures,
+                        args.wavelength)
+
+
+if __name__ == '__main__':
+    main()
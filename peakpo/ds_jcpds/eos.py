@@ -0,0 +1,125 @@
+import numpy as np
+from scipy.interpolate import CubicHermiteSpline
+
+
+def _bm3_p_f(f, k0, k0p):
+    """
+    pressure and its derivative from 3rd order Birch-Murnaghan equation
+    written with Eulerian strain f = ((v0/v)**(2/3) - 1) / 2
+
+    :return: pressure, dp/df
+    """
+    c = 1. + 1.5 * (k0p - 4.) * f
+    x = 1. + 2. * f
+    p = 3. * k0 * f * x**2.5 * c
+    dp = 3. * k0 * (x**2.5 * c + 5. * f * x**1.5 * c +
+                    1.5 * (k0p - 4.) * f * x**2.5)
+    return p, dp
+
+
+def bm3_v_array(p, v0, k0, k0p, min_strain=0.01, max_iter=100):
+    """
+    find volumes for an array of pressures from 3rd order Birch-Murnaghan
+    equation.  gives the same result as pytheos.bm3_v, but all pressures
+    are solved at once with bracketed Newton steps instead of one
+    brenth call for each pressure.
+
+    :param p: pressure, number or array
+    :param v0: volume at reference conditions
+    :param k0: bulk modulus at reference conditions
+    :param k0p: pressure derivative of bulk modulus
+    :param min_strain: minimum v/v0 to find solution
+    :param max_iter: maximum number of iterations
+    :return: volume in the shape of p, nan if there is no solution
+        above min_strain.  v0 for p <= 1.e-5 as in pytheos.
+    """
+    p = np.asarray(p, dtype=float)
+    f_max = (min_strain**(-2. / 3.) - 1.) / 2.
+    p_max = _bm3_p_f(f_max, k0, k0p)[0]
+    # iterate until the pressures with a solution have converged
+    solvable = (p > 1.e-5) & (p <= p_max)
+    lo = np.zeros_like(p)
+    hi = np.full_like(p, f_max)
+    f = np.clip(p / (3. * k0), 0., f_max)
+    for i in range(max_iter):
+        p_f, dp = _bm3_p_f(f, k0, k0p)
+        r = p_f - p
+        lo = np.where(r < 0., f, lo)
+        hi = np.where(r > 0., f, hi)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f_new = f - r / dp
+        # bisection where Newton step leaves the bracket
+        bisect = ~((f_new >= lo) & (f_new <= hi))
+        f_new = np.where(bisect, (lo + hi) / 2., f_new)
+        converged = np.all((np.abs(f_new - f) <= 1.e-13 * (1. + f)) |
+                           ~solvable)
+        f = f_new
+        if converged:
+            break
+    v = v0 * (1. + 2. * f)**(-1.5)
+    v = np.where(p > p_max, np.nan, v)
+    return np.where(p <= 1.e-5, v0, v)
+
+
+class BM3VolumeTable(object):
+    """
+    volume as a function of pressure for one set of v0, k0, k0p, made
+    once so that volumes at new pressures need no root solving.
+    pressure is calculated on a grid of Eulerian strain and inverted with
+    cubic Hermite interpolation using the exact dp/df.  the grid is made
+    finer until the volume error at the midpoints is below rtol.
+    """
+
+    def __init__(self, v0, k0, k0p, min_strain=0.3, rtol=1.e-10,
+                 max_points=4096):
+        """
+        :param min_strain: minimum v/v0 in the table
+        :param rtol: maximum relative error of volume
+        :param max_points: maximum number of grid points.  if rtol is not
+            reached, the table ends before the first segment above rtol.
+        """
+        self.key = (v0, k0, k0p, min_strain)
+        self.v0 = v0
+        self.k0 = k0
+        self.k0p = k0p
+        self.min_strain = min_strain
+        f_max = (min_strain**(-2. / 3.) - 1.) / 2.
+        n = 64
+        while True:
+            f = np.linspace(0., f_max, n + 1)
+            p, dp = _bm3_p_f(f, k0, k0p)
+            # pressure may turn down for small k0p, keep rising part only
+            falling = np.nonzero(dp[1:] <= 0.)[0]
+            if falling.size > 0:
+                f = f[:falling[0] + 1]
+                p = p[:falling[0] + 1]
+                dp = dp[:falling[0] + 1]
+            f_of_p = CubicHermiteSpline(p, f, 1. / dp)
+            # compare with exact volume at the middle of each segment
+            f_mid = (f[1:] + f[:-1]) / 2.
+            error = np.abs(((1. + 2. * f_of_p(_bm3_p_f(f_mid, k0, k0p)[0])) /
+                            (1. + 2. * f_mid))**-1.5 - 1.)
+            bad = np.nonzero(error > rtol)[0]
+            if bad.size == 0:
+                break
+            if n >= max_points:
+                p = p[:bad[0] + 1]
+                error = error[:bad[0]]
+                break
+            n *= 2
+        self._f_of_p = f_of_p
+        self.p_max = p[-1]
+        self.error = error.max() if error.size > 0 else 0.
+
+    def get_v(self, p):
+        """
+        :param p: pressure, number or array
+        :return: volume, v0 for p <= 1.e-5 as in pytheos.bm3_v,
+            nan above p_max
+        """
+        p = np.asarray(p, dtype=float)
+        inside = (p > 1.e-5) & (p <= self.p_max)
+        f = self._f_of_p(np.where(inside, p, 0.))
+        v = self.v0 * (1. + 2. * f)**(-1.5)
+        v = np.where(inside, v, np.nan)
+        return np.where(p <= 1.e-5, self.v0, v)
@@ -1,7 +1,11 @@
 import numpy as np
 import os
+import time
+from collections import OrderedDict
 from pytheos import bm3_v
+from utils import extract_extension
 from .xrd import cal_UnitCellVolume, cal_dspacing
+from .eos import bm3_v_array, BM3VolumeTable
 import pymatgen as mg
 from pymatgen.analysis.diffraction.xrd import XRDCalculator
 from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
@@ -28,7 +32,50 @@ class DiffractionLine:
         self.l = 0.
 
 
-class UnitCell(object):
+# table of diffraction lines, one record for each line
+DIFFLINE_DTYPE = np.dtype([('dsp0', 'f8'), ('dsp', 'f8'), ('intensity', 'f8'),
+                           ('h', 'f8'), ('k', 'f8'), ('l', 'f8')])
+
+
+def make_difflines(difflines=()):
+    """
+    make a table of diffraction lines.  records have the same attributes
+    as DiffractionLine and changes to them are written to the table.
+
+    :param difflines: list of DiffractionLine or a table
+    :return: np.recarray with DIFFLINE_DTYPE
+    """
+    if isinstance(difflines, np.ndarray):
+        return np.asarray(difflines, dtype=DIFFLINE_DTYPE).view(np.recarray)
+    table = np.recarray(difflines.__len__(), dtype=DIFFLINE_DTYPE)
+    for i, dl in enumerate(difflines):
+        table[i] = (dl.dsp0, dl.dsp, dl.intensity, dl.h, dl.k, dl.l)
+    return table
+
+
+class DiffLineTable(object):
+    """
+    Base class for objects with diffraction lines.  DiffLines is a
+    record array, but can still be used like a list of DiffractionLine.
+    Old pickles with a list of DiffractionLine are converted when loaded.
+    """
+
+    @property
+    def DiffLines(self):
+        return self._difflines
+
+    @DiffLines.setter
+    def DiffLines(self, difflines):
+        self._difflines = make_difflines(difflines)
+
+    def __setstate__(self, state):
+        difflines = state.pop('DiffLines', None)
+        self.__dict__.update(state)
+        if difflines is not None:
+            self.DiffLines = difflines
+
+
+class UnitCell(DiffLineTable):
     """
     Class that defines a unit cell properties
     """
@@ -57,11 +104,10 @@ class UnitCell(object):
 #            alpha = self.alpha; beta = self.beta; gamma = self.gamma
         self.v = cal_UnitCellVolume(self.symmetry, self.a, self.b, self.c,
                                     self.alpha, self.beta, self.gamma)
-        for dl in self.DiffLines:
-            dsp = cal_dspacing(self.symmetry, dl.h, dl.k, dl.l,
-                               self.a, self.b, self.c,
-                               self.alpha, self.beta, self.gamma)
-            dl.dsp = dsp
+        self.DiffLines.dsp = cal_dspacing(
+            self.symmetry, self.DiffLines.h, self.DiffLines.k,
+            self.DiffLines.l, self.a, self.b, self.c,
+            self.alpha, self.beta, self.gamma)
 
     def get_tthVSint(self, wavelength):
         """
@@ -70,15 +116,8 @@ class UnitCell(object):
         If P, T, b_a, c_a have changed, run cal_dsp first for update
         """
 #        self.cal_dsp(pressure, temperature, b_a, c_a)
-        dsp = []
-        intensity = []
-        for line in self.DiffLines:
-            d = line.dsp
-            i = line.intensity
-            dsp.append(d)
-            intensity.append(i)
-        tth = 2. * np.degrees(np.arcsin(wavelength / 2. / np.array(dsp)))
-        return tth, np.array(intensity)
+        tth = 2. * np.degrees(np.arcsin(wavelength / 2. / self.DiffLines.dsp))
+        return tth, np.array(self.DiffLines.intensity)
 
     def find_DiffLine(self, tth_c, wavelength):
         """
@@ -115,7 +154,7 @@ class UnitCell(object):
         return textout
 
 
-class JCPDS(object):
+class JCPDS(DiffLineTable):
     """
     Class that defines a single JCPDS card.
     see __init__ for the involved parameters
@@ -262,18 +301,22 @@ class JCPDS(object):
             thermal_expansion = float(item[0])
         self.thermal_expansion = thermal_expansion
 
+        lines = []
         for line in inp[6:]:
             item = str.split(line)
             if len(item) != 5:
                 break
-            DiffLine = DiffractionLine()
-            DiffLine.dsp0 = float(item[0])
-            DiffLine.intensity = float(item[1])
-            DiffLine.h = float(item[2])
-            DiffLine.k = float(item[3])
-            DiffLine.l = float(item[4])
-            self.DiffLines.append(DiffLine)
+            dsp0, intensity, h, k, l = [float(x) for x in item]
+            lines.append((dsp0, 0., intensity, h, k, l))
+        self.DiffLines = np.array(lines, dtype=DIFFLINE_DTYPE)
+
+        self._set_reference_state()
 
+    def _set_reference_state(self):
+        """
+        set volume and current unit cell to reference conditions after
+        the card is read
+        """
         self._cal_v0()
         self.a = self.a0
         self.b = self.b0
@@ -305,8 +348,32 @@ class JCPDS(object):
                 self.v = self.v0
             else:
                 # print(pressure_st, self.v0, self.k0, self.k0p)
-                self.v = bm3_v(pressure_st, self.v0, self.k0, self.k0p,
-                               min_strain=0.3)
+                self.v = float(self.get_v_table().get_v(pressure_st))
+                if np.isnan(self.v):
+                    # out of the table, solve directly
+                    self.v = bm3_v(pressure_st, self.v0, self.k0, self.k0p,
+                                   min_strain=0.3)
+
+    def get_v_table(self):
+        """
+        return volume table for the current v0, k0, and k0p.
+        the table is made again only when one of them changes, for
+        example by tweaking.
+        """
+        v_table = getattr(self, '_v_table', None)
+        if (v_table is None) or \
+                (v_table.key != (self.v0, self.k0, self.k0p, 0.3)):
+            v_table = BM3VolumeTable(self.v0, self.k0, self.k0p,
+                                     min_strain=0.3)
+            self._v_table = v_table
+        return v_table
+
+    def __getstate__(self):
+        # volume table and results are made again after loading
+        state = self.__dict__.copy()
+        for key in ('_v_table', '_dsp_history', '_dsp_key'):
+            state.pop(key, None)
+        return state
 
     def cal_dsp(self, pressure=0., temperature=300.,
                 b_a=None, c_a=None, use_table_for_0GPa=True):
@@ -333,26 +400,89 @@ class JCPDS(object):
             self.a = self.a0
             self.b = self.b0
             self.c = self.c0
-            for dl in self.DiffLines:
-                dsp = dl.dsp0
-                dl.dsp = dsp
-#            DLines = self.get_DiffractionLines()
-#            for dl in DLines:
-#                dsp = dl.dsp0
-#                dl.dsp = dsp
+            self.DiffLines.dsp = self.DiffLines.dsp0
         else:
             self._cal_UCPatPT(b_a, c_a)
             DLines = self.get_DiffractionLines()
-#            a = self.a; b = self.b; c = self.c;
-#            alpha = self.alpha; beta = self.beta; gamma = self.gamma
-            for dl in DLines:
-                dsp = cal_dspacing(self.symmetry, dl.h, dl.k, dl.l,
-                                   self.a, self.b, self.c,
-                                   self.alpha, self.beta, self.gamma)
-                dl.dsp = dsp
-            # the code worked without the following line, perhaps
-            # due to the referencing or copy issue in python list
-            self.DiffLines = DLines[:]
+            DLines.dsp = cal_dspacing(self.symmetry, DLines.h, DLines.k,
+                                      DLines.l, self.a, self.b, self.c,
+                                      self.alpha, self.beta, self.gamma)
+
+    def cal_dsp_PT_grid(self, pressures, temperatures, wavelength,
+                        b_a=None, c_a=None, use_table_for_0GPa=True):
+        """
+        calculate d-spacings of all diffraction lines on a grid of
+        pressures and temperatures at once.  gives the same results as
+        calling cal_dsp at each point.  the object is not changed.
+
+        :param pressures: pressures in GPa
+        :param temperatures: temperatures in K
+        :param wavelength: x-ray wavelength in A
+        :return: volume (nP x nT), d-spacing (nP x nT x nLines),
+            two theta (nP x nT x nLines)
+        """
+        pressure = np.asarray(pressures, dtype=float).reshape(-1, 1)
+        temperature = np.asarray(temperatures, dtype=float).reshape(1, -1)
+        if b_a is None:
+            b_a = self.b0 / self.a0
+        if c_a is None:
+            c_a = self.c0 / self.a0
+        pressure_st = pressure - self.thermal_expansion * \
+            self.k0 * (temperature - 300.)
+        if self.symmetry == 'manual':
+            v = np.full(pressure_st.shape, float(self.v0))
+        else:
+            v = self.get_v_table().get_v(pressure_st)
+            missing = np.isnan(v)
+            if missing.any():
+                v[missing] = bm3_v_array(pressure_st[missing], self.v0,
+                                         self.k0, self.k0p, min_strain=0.3)
+            v = np.where(pressure == 0.0, self.v0, v)
+        DLines = self.get_DiffractionLines()
+        dsp0 = np.broadcast_to(DLines.dsp0, v.shape + DLines.shape)
+        if self.symmetry == 'manual':
+            dsp = np.array(dsp0)
+        else:
+            a, b, c = self._cal_cell_at_v(v[..., np.newaxis], b_a, c_a)
+            dsp = cal_dspacing(self.symmetry, DLines.h, DLines.k, DLines.l,
+                               a, b, c, self.alpha, self.beta, self.gamma)
+            if use_table_for_0GPa:
+                dsp = np.where((pressure == 0.0)[..., np.newaxis], dsp0, dsp)
+        tth = 2. * np.degrees(np.arcsin(wavelength / 2. / dsp))
+        return v, dsp, tth
+
+    def write_PT_grid(self, filename, pressures, temperatures, wavelength,
+                      **kwargs):
+        """
+        write results of cal_dsp_PT_grid.  npz keeps the arrays, while
+        csv has a row for each pressure, temperature, and line.
+
+        :param filename: npz or csv filename
+        """
+        t_start = time.time()
+        v, dsp, tth = self.cal_dsp_PT_grid(pressures, temperatures,
+                                           wavelength, **kwargs)
+        print("PT grid of {0:d} points takes {1:.2f}s".format(
+            v.size, time.time() - t_start))
+        DLines = self.get_DiffractionLines()
+        if extract_extension(filename) == 'csv':
+            pressure, temperature, i_line = np.meshgrid(
+                pressures, temperatures, np.arange(DLines.size),
+                indexing='ij')
+            data = np.column_stack(
+                (pressure.ravel(), temperature.ravel(),
+                 np.broadcast_to(v[..., np.newaxis], dsp.shape).ravel(),
+                 DLines.h[i_line.ravel()], DLines.k[i_line.ravel()],
+                 DLines.l[i_line.ravel()], DLines.intensity[i_line.ravel()],
+                 dsp.ravel(), tth.ravel()))
+            np.savetxt(filename, data, delimiter=',', fmt='%.6g',
+                       header='pressure,temperature,volume,h,k,l,' +
+                       'intensity,d-spacing,two_theta')
+        else:
+            np.savez(filename, name=self.name, wavelength=wavelength,
+                     pressures=pressures, temperatures=temperatures,
+                     volume=v, dsp=dsp, tth=tth, h=DLines.h, k=DLines.k,
+                     l=DLines.l, intensity=DLines.intensity)
 
     def get_DiffractionLines(self):
         """
@@ -368,23 +498,12 @@ class JCPDS(object):
         If P, T, b_a, c_a have changed, run cal_dsp first for update
         """
 #        self.cal_dsp(pressure, temperature, b_a, c_a)
-        DLines = self.get_DiffractionLines()
-
-        dsp = []
-        intensity = []
-        for line in DLines:
-            d = line.dsp
-            i = line.intensity
-            dsp.append(d)
-            intensity.append(i)
-        tth = 2. * np.degrees(np.arcsin(wavelength / 2. / np.array(dsp)))
-        return tth, np.array(intensity)
+        tth = 2. * np.degrees(np.arcsin(wavelength / 2. / self.DiffLines.dsp))
+        return tth, np.array(self.DiffLines.intensity)
 
     def get_hkl_in_text(self):
-        hkl = []
-        for line in self.DiffLines:
-            hkl.append("{0:.0f} {1:.0f} {2:.0f}".format(line.h, line.k, line.l))
-        return hkl
+        return ["{0:.0f} {1:.0f} {2:.0f}".format(h, k, l) for h, k, l in
+                zip(self.DiffLines.h, self.DiffLines.k, self.DiffLines.l)]
 
     def find_DiffLine(self, tth_c, wavelength):
         """
@@ -399,32 +518,41 @@ class JCPDS(object):
         return idx, abs(tth[idx] - tth_c), tth[idx]
 
     def _cal_UCPatPT(self, b_a, c_a):
+        cell = self._cal_cell_at_v(self.v, b_a, c_a)
+        if cell is not None:
+            self.a, self.b, self.c = cell
+
+    def _cal_cell_at_v(self, v, b_a, c_a):
+        """
+        :param v: volume, number or array
+        :return: a, b, c for the volume
+        """
         if self.symmetry == 'cubic':
-            self.a = (self.v)**(1. / 3.)
-            self.b = self.a
-            self.c = self.a
+            a = (v)**(1. / 3.)
+            b = a
+            c = a
         elif (self.symmetry == 'hexagonal') or (self.symmetry == 'trigonal'):
             # self.a = (2. * self.v / (np.sqrt(3.)*self.c0/self.a0) )**(1./3.)
-            self.a = (2. * self.v / (np.sqrt(3.) * c_a))**(1. / 3.)
-            self.b = self.a
-            self.c = self.a * c_a
+            a = (2. * v / (np.sqrt(3.) * c_a))**(1. / 3.)
+            b = a
+            c = a * c_a
         elif self.symmetry == 'tetragonal':
             # self.a = (self.v/(self.c0/self.a0))**(1./3.) ; self.b = self.a
-            self.a = (self.v / (c_a))**(1. / 3.)
-            self.b = self.a
-            self.c = c_a * self.a
+            a = (v / (c_a))**(1. / 3.)
+            b = a
+            c = c_a * a
         elif self.symmetry == 'orthorhombic':
             # self.a = (self.v/(self.b0/self.a0*self.c0/self.a0))**(1./3.)
-            self.a = (self.v / (b_a * c_a))**(1. / 3.)
-            self.c = c_a * self.a
-            self.b = b_a * self.a
+            a = (v / (b_a * c_a))**(1. / 3.)
+            c = c_a * a
+            b = b_a * a
         elif self.symmetry == 'monoclinic':
             # self.a = ( self.v / (self.b0/self.a0*self.c0/self.a0*\
             #        np.sin(np.radians(self.beta0))))**(1./3.)
-            self.a = (self.v / (b_a * c_a *
-                                np.sin(np.radians(self.beta0))))**(1. / 3.)
-            self.c = c_a * self.a
-            self.b = b_a * self.a
+            a = (v / (b_a * c_a *
+                           np.sin(np.radians(self.beta0))))**(1. / 3.)
+            c = c_a * a
+            b = b_a * a
         elif self.symmetry == 'triclinic':
             a_term = np.sqrt(1. - (np.cos(np.radians(self.alpha0)))**2. -
                              (np.cos(np.radians(self.beta0)))**2. -
@@ -434,11 +562,13 @@ class JCPDS(object):
                              np.cos(np.radians(self.gamma0)))
             # self.a = (self.v/(self.b0/self.a0*self.c0/self.a0*a_term))
             # **(1./3.)
-            self.a = (self.v / (b_a * c_a * a_term))**(1. / 3.)
-            self.c = c_a * self.a
-            self.b = b_a * self.a
+            a = (v / (b_a * c_a * a_term))**(1. / 3.)
+            c = c_a * a
+            b = b_a * a
         else:
             print('no symmetry is given')
+            return None
+        return a, b, c
 
 #    return {'ver': ver, 'header': header, 'crystal_system': crystal_system, \
 #            'K0': K0, 'K0p': K0p, 'u_param':
@@ -615,6 +745,9 @@ class JCPDSplt(JCPDS):
     Developed for supporting PeakPo but used and shared with PeakFt
     """
 
+    # number of P, T, and tweak combinations to keep results for
+    MAX_DSP_HISTORY = 8
+
     def __init__(self):
         ''' _org parameter needed : self.k0, self.k0p,
         self.thermal_expansion, self.v0
@@ -636,6 +769,10 @@ class JCPDSplt(JCPDS):
         a0, b0, c0, alpha, beta, gamma, v0 should not be tweaked
         '''
         super(JCPDSplt, self).read_file(file)
+
+    def _set_reference_state(self):
+        super(JCPDSplt, self)._set_reference_state()
+        self._dsp_history = OrderedDict()
         # make originals
         self.k0_org = self.k0
         self.k0p_org = self.k0p
@@ -645,6 +782,62 @@ class JCPDSplt(JCPDS):
     def cal_dsp(self, pressure, temperature, b_a=None, c_a=None,
                 use_table_for_0GPa=True):
         '''DiffLines are tweaked one unlike other notations'''
+        self._set_twk_parameters()
+        # results are kept for recent inputs, so that redraws for other
+        # reasons than P, T, or tweaks do not calculate again
+        key = self._make_dsp_key(pressure, temperature, use_table_for_0GPa)
+        history = self.__dict__.setdefault('_dsp_history', OrderedDict())
+        self._dsp_key = key
+        if key in history:
+            history.move_to_end(key)
+            result = history[key]
+            self.v, self.a, self.b, self.c = result['cell']
+            # lines can be shared with and changed by ucfit
+            self.DiffLines.dsp = result['dsp']
+            return
+        # get DiffLines
+        super(JCPDSplt, self).cal_dsp(pressure, temperature,
+                                      self.b_a, self.c_a,
+                                      use_table_for_0GPa=use_table_for_0GPa)
+        history[key] = {'cell': (self.v, self.a, self.b, self.c),
+                        'dsp': self.DiffLines.dsp.copy(), 'tth': {}}
+        while history.__len__() > self.MAX_DSP_HISTORY:
+            history.popitem(last=False)
+
+    def _make_dsp_key(self, pressure, temperature, use_table_for_0GPa):
+        return (pressure, temperature, use_table_for_0GPa,
+                self.twk_b_a, self.twk_c_a, self.twk_v0, self.twk_k0,
+                self.twk_k0p, self.twk_thermal_expansion,
+                self.k0_org, self.k0p_org, self.v0_org,
+                self.thermal_expansion_org, self.symmetry,
+                self.a0, self.b0, self.c0,
+                self.alpha0, self.beta0, self.gamma0)
+
+    def get_tthVSint(self, wavelength):
+        '''same as JCPDS.get_tthVSint, but two theta is kept for the
+        d-spacings of the last cal_dsp.  returned arrays are read-only'''
+        result = self.__dict__.get('_dsp_history', {}).get(
+            self.__dict__.get('_dsp_key'))
+        if (result is None) or \
+                (not np.array_equal(result['dsp'], self.DiffLines.dsp)):
+            return super(JCPDSplt, self).get_tthVSint(wavelength)
+        if wavelength not in result['tth']:
+            tth, intensity = super(JCPDSplt, self).get_tthVSint(wavelength)
+            tth.flags.writeable = False
+            intensity.flags.writeable = False
+            result['tth'][wavelength] = (tth, intensity)
+        return result['tth'][wavelength]
+
+    def cal_dsp_PT_grid(self, pressures, temperatures, wavelength,
+                        b_a=None, c_a=None, use_table_for_0GPa=True):
+        '''same as JCPDS.cal_dsp_PT_grid but with tweaked parameters.
+        b_a and c_a are ignored like in cal_dsp'''
+        self._set_twk_parameters()
+        return super(JCPDSplt, self).cal_dsp_PT_grid(
+            pressures, temperatures, wavelength, self.b_a, self.c_a,
+            use_table_for_0GPa=use_table_for_0GPa)
+
+    def _set_twk_parameters(self):
         # set tweaked parameters
         self.k0 = self.k0_org * self.twk_k0
         self.k0p = self.k0p_org * self.twk_k0p
@@ -653,17 +846,9 @@ class JCPDSplt(JCPDS):
             self.twk_thermal_expansion
         self.b_a = (self.b0 / self.a0) * self.twk_b_a
         self.c_a = (self.c0 / self.a0) * self.twk_c_a
-        # get DiffLines
-        super(JCPDSplt, self).cal_dsp(pressure, temperature,
-                                      self.b_a, self.c_a,
-                                      use_table_for_0GPa=use_table_for_0GPa)
 
     def get_dsp(self):
-        dsp = []
-        for dl in self.DiffLines:
-            d = float(dl.dsp)
-            dsp.append(d)
-        return dsp
+        return self.DiffLines.dsp.tolist()
 
     def make_TextOutput(self, pressure, temperature):
         textout = self.file + '\n'
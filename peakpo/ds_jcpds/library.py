@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import fnmatch
+import threading
+import zipfile
+from collections import OrderedDict
+import numpy as np
+from utils import save_atomic
+from .jcpds import JCPDS, JCPDSplt, DIFFLINE_DTYPE
+from .xrd import cal_dspacing
+
+# change this when the index format changes
+LIBRARY_INDEX_VERSION = 'jcpdslib1'
+
+# order follows crystal system numbers in jcpds files
+SYMMETRIES = ['cubic', 'hexagonal', 'tetragonal', 'orthorhombic',
+              'monoclinic', 'triclinic', 'manual']
+
+# one record for each card, lines of all cards are in one table
+CARD_DTYPE = np.dtype([
+    ('mtime', 'f8'), ('size', 'i8'), ('version', 'i4'), ('symmetry', 'i4'),
+    ('k0', 'f8'), ('k0p', 'f8'), ('thermal_expansion', 'f8'),
+    ('a0', 'f8'), ('b0', 'f8'), ('c0', 'f8'),
+    ('alpha0', 'f8'), ('beta0', 'f8'), ('gamma0', 'f8'), ('v0', 'f8'),
+    ('start', 'i8'), ('n_lines', 'i8')])
+
+# recently used libraries
+MAX_LIBRARIES = 2
+_libraries = OrderedDict()
+_libraries_lock = threading.Lock()
+
+
+def get_jcpds_library(path):
+    """
+    :param path: folder of jcpds files
+    :return: JcpdsLibrary for the folder, refreshed
+    """
+    key = os.path.abspath(path)
+    with _libraries_lock:
+        if key in _libraries:
+            _libraries.move_to_end(key)
+            library = _libraries[key]
+        else:
+            library = JcpdsLibrary(path)
+            _libraries[key] = library
+            while _libraries.__len__() > MAX_LIBRARIES:
+                _libraries.popitem(last=False)
+    library.refresh()
+    return library
+
+
+class JcpdsLibrary(object):
+    """
+    index of all jcpds files in a folder.  cell, EOS parameters, and
+    diffraction lines of all cards are kept in arrays and saved in a
+    binary index file.  only new or changed files are read on refresh.
+    """
+
+    def __init__(self, path, search_ext='*.jcpds', index_filename=None):
+        """
+        :param path: folder of jcpds files
+        :param index_filename: None for temporary_pkpo/jcpds_index.npz
+            in the folder
+        """
+        self.path = path
+        self.search_ext = search_ext
+        if index_filename is None:
+            index_filename = os.path.join(path, 'temporary_pkpo',
+                                          'jcpds_index.npz')
+        self.index_filename = index_filename
+        self.filenames = []  # without path
+        self.comments = []
+        self.cards = np.zeros(0, dtype=CARD_DTYPE)
+        self.lines = np.zeros(0, dtype=DIFFLINE_DTYPE).view(np.recarray)
+        self.errors = []  # files which could not be read
+        self._positions = {}  # filename: position in self.filenames
+        self._dsp_ref = None
+        self._index_read = False
+
+    def __len__(self):
+        return self.filenames.__len__()
+
+    def refresh(self, force=False):
+        """
+        read new or changed files and update the index file
+
+        :param force: read all files again
+        :return: True if the index has changed
+        """
+        if not self._index_read:
+            self._read_index()
+            self._index_read = True
+        t_start = time.time()
+        stats = {}
+        try:
+            for entry in os.scandir(self.path):
+                if fnmatch.fnmatch(entry.name, self.search_ext):
+                    stat = entry.stat()
+                    stats[entry.name] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            pass
+        records = []
+        self.errors = []
+        n_read = 0
+        for name in sorted(stats):
+            i = self._positions.get(name, -1)
+            if (not force) and (i >= 0) and \
+                    ((self.cards[i]['mtime'], self.cards[i]['size']) ==
+                     stats[name]):
+                records.append((name, self.comments[i], self.cards[i],
+                                self.get_lines(i)))
+                continue
+            try:
+                record = self._read_card(name, stats[name])
+            except Exception:
+                self.errors.append(name)
+                continue
+            records.append(record)
+            n_read += 1
+        if (n_read == 0) and (records.__len__() == self.__len__()):
+            return False
+        self._set_records(records)
+        self._write_index()
+        print("Indexing {0:d} of {1:d} JCPDS takes {2:.2f}s".format(
+            n_read, self.__len__(), time.time() - t_start))
+        return True
+
+    def _read_card(self, name, stat):
+        jcpds = JCPDS()
+        jcpds.read_file(os.path.join(self.path, name))
+        card = np.zeros((), dtype=CARD_DTYPE)
+        card['mtime'], card['size'] = stat
+        card['version'] = jcpds.version
+        card['symmetry'] = SYMMETRIES.index(jcpds.symmetry) + 1
+        for field in ('k0', 'k0p', 'thermal_expansion', 'a0', 'b0', 'c0',
+                      'alpha0', 'beta0', 'gamma0', 'v0'):
+            card[field] = getattr(jcpds, field)
+        return name, jcpds.comments, card, jcpds.DiffLines
+
+    def _set_records(self, records):
+        self.filenames = [record[0] for record in records]
+        self.comments = [record[1] for record in records]
+        self.cards = np.zeros(records.__len__(), dtype=CARD_DTYPE)
+        start = 0
+        for i, record in enumerate(records):
+            self.cards[i] = record[2]
+            self.cards[i]['start'] = start
+            self.cards[i]['n_lines'] = record[3].size
+            start += record[3].size
+        if records == []:
+            lines = np.zeros(0, dtype=DIFFLINE_DTYPE)
+        else:
+            lines = np.concatenate([record[3] for record in records])
+        self.lines = lines.view(np.recarray)
+        self._positions = {name: i for i, name in enumerate(self.filenames)}
+        self._dsp_ref = None
+
+    def _read_index(self):
+        if not os.path.exists(self.index_filename):
+            return
+        try:
+            with np.load(self.index_filename) as index:
+                meta = json.loads(str(index['meta']))
+                if meta['version'] != LIBRARY_INDEX_VERSION:
+                    return
+                cards = index['cards']
+                lines = index['lines']
+        except (IOError, ValueError, KeyError, EOFError,
+                zipfile.BadZipFile):
+            # broken or old index, read all files again
+            return
+        self.filenames = meta['filenames']
+        self.comments = meta['comments']
+        self.cards = cards
+        self.lines = lines.view(np.recarray)
+        self._positions = {name: i for i, name in enumerate(self.filenames)}
+        self._dsp_ref = None
+
+    def _write_index(self):
+        meta = {'version': LIBRARY_INDEX_VERSION,
+                'filenames': self.filenames, 'comments': self.comments}
+        try:
+            temp_path = os.path.dirname(self.index_filename)
+            if not os.path.exists(temp_path):
+                os.makedirs(temp_path)
+            save_atomic(self.index_filename, lambda f: np.savez(
+                f, meta=json.dumps(meta), cards=self.cards,
+                lines=np.asarray(self.lines)))
+        except OSError:
+            # read-only library, keep the index in memory only
+            pass
+
+    def find(self, filename):
+        """
+        :param filename: jcpds filename with or without path
+        :return: position of the card, -1 if not in the library
+        """
+        path, name = os.path.split(filename)
+        if (path != '') and \
+                (os.path.abspath(path) != os.path.abspath(self.path)):
+            return -1
+        return self._positions.get(name, -1)
+
+    def get_lines(self, i):
+        """
+        :return: diffraction lines of card i, a view of the library table
+        """
+        start = self.cards[i]['start']
+        return self.lines[start:start + self.cards[i]['n_lines']]
+
+    def get_card_index(self):
+        """
+        :return: card position for every line in the library table
+        """
+        return np.repeat(np.arange(self.__len__()), self.cards['n_lines'])
+
+    def get_reference_dsp(self):
+        """
+        d-spacings of all lines calculated from hkl and the reference
+        cell, as cal_dsp does at high pressure.  table d-spacings for
+        manual cards.  d-spacings of all cards change with the cube root
+        of volume at high pressure.
+        """
+        if self._dsp_ref is not None:
+            return self._dsp_ref
+        card_index = self.get_card_index()
+        dsp_ref = np.array(self.lines.dsp0, dtype=float)
+        symmetry = self.cards['symmetry'][card_index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for code, sym in enumerate(SYMMETRIES, start=1):
+                if sym == 'manual':
+                    continue
+                in_sym = symmetry == code
+                if not in_sym.any():
+                    continue
+                cards = self.cards[card_index[in_sym]]
+                dsp_ref[in_sym] = cal_dspacing(
+                    sym, self.lines.h[in_sym], self.lines.k[in_sym],
+                    self.lines.l[in_sym], cards['a0'], cards['b0'],
+                    cards['c0'], cards['alpha0'], cards['beta0'],
+                    cards['gamma0'])
+        self._dsp_ref = dsp_ref
+        return dsp_ref
+
+    def make_jcpds(self, i, cls=JCPDSplt):
+        """
+        make a card object from the index without reading the file.
+        same as reading the file with cls.read_file.
+
+        :param i: position or filename of the card
+        :param cls: JCPDS or JCPDSplt
+        """
+        if not isinstance(i, (int, np.integer)):
+            i = self.find(i)
+        card = self.cards[i]
+        jcpds = cls()
+        jcpds.file = os.path.join(self.path, self.filenames[i])
+        jcpds.name = os.path.splitext(self.filenames[i])[0]
+        jcpds.version = int(card['version'])
+        jcpds.comments = self.comments[i]
+        jcpds.symmetry = SYMMETRIES[card['symmetry'] - 1]
+        for field in ('k0', 'k0p', 'thermal_expansion', 'a0', 'b0', 'c0',
+                      'alpha0', 'beta0', 'gamma0'):
+            setattr(jcpds, field, float(card[field]))
+        jcpds.DiffLines = self.get_lines(i).copy()
+        jcpds._set_reference_state()
+        return jcpds
+
+    def search(self, name=None, symmetry=None, dsp=None, tolerance=0.005,
+               n_strongest=3):
+        """
+        find cards by name, symmetry, and strongest lines
+
+        :param name: part of the name or a wildcard such as 'mg*o',
+            case insensitive
+        :param symmetry: symmetry name or list of names
+        :param dsp: d-spacings in A at reference conditions that should
+            all be among the strongest lines of a card
+        :param tolerance: relative tolerance for dsp
+        :param n_strongest: number of strongest lines of a card for dsp
+        :return: positions of matching cards
+        """
+        match = np.ones(self.__len__(), dtype=bool)
+        if name is not None:
+            pattern = name.lower()
+            if not any(c in pattern for c in '*?['):
+                pattern = '*' + pattern + '*'
+            match &= np.array([fnmatch.fnmatchcase(filen.lower(), pattern)
+                               for filen in self.filenames], dtype=bool)
+        if symmetry is not None:
+            if isinstance(symmetry, str):
+                symmetry = [symmetry]
+            codes = [SYMMETRIES.index(sym) + 1 for sym in symmetry]
+            match &= np.isin(self.cards['symmetry'], codes)
+        if dsp is not None:
+            card_index = self.get_card_index()
+            # rank lines by intensity within each card
+            order = np.lexsort((-self.lines.intensity, card_index))
+            rank = np.empty(order.size, dtype=int)
+            rank[order] = np.arange(order.size) - \
+                self.cards['start'][card_index[order]]
+            strong = rank < n_strongest
+            dsp0_strong = self.lines.dsp0[strong]
+            card_strong = card_index[strong]
+            for d in np.atleast_1d(dsp):
+                found = np.abs(dsp0_strong - d) <= tolerance * d
+                match &= np.isin(np.arange(self.__len__()),
+                                 card_strong[found])
+        return np.nonzero(match)[0]
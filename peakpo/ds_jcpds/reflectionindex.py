@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class ReflectionIndex(object):
+    """
+    two theta of diffraction lines of many phases merged and sorted for
+    nearest line lookup.  made again only when the d-spacings of a phase
+    or the wavelength change, that is when P, T, or tweaks change.
+    """
+
+    def __init__(self):
+        self._key = None
+        self.phases = []
+        self.tth = np.zeros(0)
+        self.phase_index = np.zeros(0, dtype=int)
+        self.line_index = np.zeros(0, dtype=int)
+
+    def update(self, phases, wavelength):
+        """
+        :param phases: list of JCPDS or UnitCell with current d-spacings.
+            for lines at the same two theta, the earlier phase is found.
+        :param wavelength: x-ray wavelength in A
+        :return: True if the index was made again
+        """
+        key = (wavelength,) + tuple(
+            (id(phase), phase.DiffLines.dsp.tobytes()) for phase in phases)
+        if key == self._key:
+            return False
+        tth_lst = []
+        for phase in phases:
+            tth, intensity = phase.get_tthVSint(wavelength)
+            tth_lst.append(np.asarray(tth, dtype=float).reshape(-1))
+        if tth_lst == []:
+            tth = np.zeros(0)
+        else:
+            tth = np.concatenate(tth_lst)
+        n_lines = [t.size for t in tth_lst]
+        phase_index = np.repeat(np.arange(phases.__len__()), n_lines)
+        line_index = np.concatenate(
+            [np.arange(n) for n in n_lines]) if n_lines != [] else \
+            np.zeros(0, dtype=int)
+        # lines beyond the reach of the wavelength have nan
+        valid = np.isfinite(tth)
+        order = np.argsort(tth[valid], kind='stable')
+        self.tth = tth[valid][order]
+        self.phase_index = phase_index[valid][order]
+        self.line_index = line_index[valid][order]
+        self.phases = list(phases)
+        self._key = key
+        return True
+
+    def find(self, tth_c):
+        """
+        :param tth_c: two theta to look up
+        :return: phase, index of line in the phase, two theta of the line.
+            None if there is no line.
+        """
+        if self.tth.size == 0:
+            return None
+        i = np.searchsorted(self.tth, tth_c)
+        if i == self.tth.size:
+            i -= 1
+        elif (i > 0) and \
+                (abs(self.tth[i - 1] - tth_c) <= abs(self.tth[i] - tth_c)):
+            i -= 1
+        # first of the lines at the same two theta
+        i = np.searchsorted(self.tth, self.tth[i], side='left')
+        return self.phases[self.phase_index[i]], int(self.line_index[i]), \
+            self.tth[i]
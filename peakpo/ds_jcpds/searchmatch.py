@@ -0,0 +1,128 @@
+import time
+import numpy as np
+from .eos import bm3_v_array
+from .library import SYMMETRIES
+
+# maximum number of line and pressure pairs handled at once
+MAX_CHUNK = 1000000
+
+
+def _sum_by_card(values, starts, ends):
+    """
+    sum rows of values for each card, lines of a card are from start to end
+    """
+    cumsum = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=cumsum[1:])
+    return cumsum[ends] - cumsum[starts]
+
+
+def search_match(library, tth_obs, wavelength, pressures, temperature=300.,
+                 tolerance=0.05, min_intensity=5., tth_range=None,
+                 n_candidates=20):
+    """
+    rank all cards in a JCPDS library by how well their lines explain
+    observed peaks, and find the best pressure for each card.
+    d-spacings are calculated for all lines and pressures at once in
+    the same way as JCPDS.cal_dsp with untweaked axial ratios.
+
+    score is (fraction of line intensity found among observed peaks)**2
+    x sqrt(fraction of observed peaks explained) x (1 - 0.5 mean
+    deviation / tolerance).  all strong lines of a right phase should be
+    found, while a minor phase explains only a few of observed peaks.
+
+    :param library: JcpdsLibrary
+    :param tth_obs: observed peak positions in two theta
+    :param wavelength: x-ray wavelength in A
+    :param pressures: pressures in GPa to test
+    :param temperature: temperature in K
+    :param tolerance: maximum two theta difference for a match
+    :param min_intensity: lines weaker than this are ignored
+    :param tth_range: two theta range of the data.  lines outside are
+        ignored.  None for the range of observed peaks.
+    :param n_candidates: number of candidates to return
+    :return: list of dict of candidates, best first
+    """
+    t_start = time.time()
+    tth_obs = np.sort(np.asarray(tth_obs, dtype=float))
+    pressures = np.asarray(pressures, dtype=float)
+    if (tth_obs.size == 0) or (library.__len__() == 0):
+        return []
+    if tth_range is None:
+        tth_range = (tth_obs[0] - tolerance, tth_obs[-1] + tolerance)
+    cards = library.cards
+    card_index = library.get_card_index()
+    manual = cards['symmetry'] == SYMMETRIES.index('manual') + 1
+    # volume ratio for every card and pressure
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        pressure_st = pressures[np.newaxis, :] - \
+            (cards['thermal_expansion'] * cards['k0'])[:, np.newaxis] * \
+            (temperature - 300.)
+        v = bm3_v_array(pressure_st, cards['v0'][:, np.newaxis],
+                        cards['k0'][:, np.newaxis],
+                        cards['k0p'][:, np.newaxis], min_strain=0.3)
+        scale = (v / cards['v0'][:, np.newaxis])**(1. / 3.)
+    dsp_ref = library.get_reference_dsp()
+    dsp0 = library.lines.dsp0
+    intensity = np.where(library.lines.intensity >= min_intensity,
+                         library.lines.intensity, 0.)
+    starts = cards['start']
+    ends = starts + cards['n_lines']
+    n_cards = cards.size
+    score = np.zeros((n_cards, pressures.size))
+    obs_fraction = np.zeros_like(score)
+    line_fraction = np.zeros_like(score)
+    chunk = max(1, MAX_CHUNK // max(dsp0.size, 1))
+    for j0 in range(0, pressures.size, chunk):
+        p = pressures[j0:j0 + chunk]
+        dsp = dsp_ref[:, np.newaxis] * scale[card_index, j0:j0 + chunk]
+        # table d-spacing at 0 GPa and for manual cards
+        use_table = (p == 0.)[np.newaxis, :] | \
+            manual[card_index][:, np.newaxis]
+        dsp = np.where(use_table, dsp0[:, np.newaxis], dsp)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tth = 2. * np.degrees(np.arcsin(wavelength / 2. / dsp))
+        in_range = (tth >= tth_range[0]) & (tth <= tth_range[1]) & \
+            (intensity > 0.)[:, np.newaxis]
+        # nearest observed peak for every line
+        i_right = np.minimum(np.searchsorted(tth_obs, tth), tth_obs.size - 1)
+        i_left = np.maximum(i_right - 1, 0)
+        d_left = np.abs(tth - tth_obs[i_left])
+        d_right = np.abs(tth - tth_obs[i_right])
+        nearest = np.where(d_left <= d_right, i_left, i_right)
+        dist = np.minimum(d_left, d_right)
+        matched = in_range & (dist <= tolerance)
+        w_total = _sum_by_card(intensity[:, np.newaxis] * in_range,
+                               starts, ends)
+        w_matched = _sum_by_card(intensity[:, np.newaxis] * matched,
+                                 starts, ends)
+        n_matched = _sum_by_card(matched.astype(float), starts, ends)
+        dev = _sum_by_card(np.where(matched, dist, 0.), starts, ends)
+        # observed peaks explained by at least one line of a card
+        explained = np.zeros((n_cards, p.size, tth_obs.size), dtype=bool)
+        i_line, i_p = np.nonzero(matched)
+        explained[card_index[i_line], i_p, nearest[i_line, i_p]] = True
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f_obs = explained.sum(axis=2) / float(tth_obs.size)
+            f_line = np.where(w_total > 0., w_matched / w_total, 0.)
+            mean_dev = np.where(n_matched > 0., dev / n_matched, tolerance)
+        obs_fraction[:, j0:j0 + chunk] = f_obs
+        line_fraction[:, j0:j0 + chunk] = f_line
+        score[:, j0:j0 + chunk] = f_line**2 * np.sqrt(f_obs) * \
+            (1. - 0.5 * mean_dev / tolerance)
+    score = np.nan_to_num(score)
+    i_best = score.argmax(axis=1)
+    best = score[np.arange(n_cards), i_best]
+    ranked = np.argsort(-best, kind='stable')[:n_candidates]
+    candidates = []
+    for i in ranked:
+        if best[i] <= 0.:
+            break
+        candidates.append({
+            'index': int(i), 'filename': library.filenames[i],
+            'pressure': float(pressures[i_best[i]]),
+            'score': float(best[i]),
+            'obs_fraction': float(obs_fraction[i, i_best[i]]),
+            'line_fraction': float(line_fraction[i, i_best[i]])})
+    print("Search-match of {0:d} JCPDS at {1:d} pressures takes {2:.2f}s".
+          format(n_cards, pressures.size, time.time() - t_start))
+    return candidates
@@ -12,7 +12,12 @@ def convert_tth(tth, wl1, wl2):
 
 
 def cal_dspacing(symmetry, h, k, l, a, b, c, alpha, beta, gamma):
-
+    """
+    calculate d-spacing.  h, k, l can be numbers or arrays of the same
+    shape, in which case d-spacings of all lines are returned in an array.
+    """
+    h, k, l = np.asarray(h, dtype=float), np.asarray(k, dtype=float), \
+        np.asarray(l, dtype=float)
     if symmetry == 'cubic':
         dsp = 1. / np.sqrt((h * h + k * k + l * l) / (a * a))
     elif symmetry == 'hexagonal':
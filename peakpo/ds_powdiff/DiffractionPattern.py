@@ -1,8 +1,13 @@
 import numpy as np
 import os
 import time
-from utils import writechi, readchi, make_filename
-from .background import fit_bg_cheb_auto
+import hashlib
+import zipfile
+from utils import writechi, make_filename, read_chi_with_sidecar, save_atomic
+from .background import fit_bg_cheb_auto, fit_bg_cheb_auto_stack
+
+# change this when the background algorithm changes the output
+BG_CACHE_VERSION = 'bg1'
 
 
 class Pattern(object):
@@ -23,13 +28,16 @@ class Pattern(object):
         self.y_bg = None
         self.params_chbg = [20, 10, 20]
 
-    def read_file(self, fname):
+    def read_file(self, fname, temp_dir=None):
         """
         read a chi file and get raw xy
+
+        :param temp_dir: folder for binary sidecar of the chi file.
+            None to parse the chi file every time.
         """
         if fname.endswith('.chi'):
-            data = np.loadtxt(fname, skiprows=4)
-            twotheta, intensity = data.T
+            twotheta, intensity = read_chi_with_sidecar(
+                fname, temp_dir=temp_dir)
         else:
             raise ValueError('Only support CHI, MSA, and EDS formats')
         # set file name information
@@ -119,44 +127,88 @@ class Pattern(object):
                 "2-theta, CHEB BG:" + ' '.join(map(str, self.params_chbg)) + "\n\n"
             writechi(f_bgsub, self.x_bgsub, self.y_bgsub, preheader=text)
 
-    def read_bg_from_tempfile(self, temp_dir=None):
-        bgsub_filen, bg_filen = self.make_temp_filenames(temp_dir=temp_dir)
-        if os.path.exists(bgsub_filen) and os.path.exists(bg_filen):
-            roi, bg_params, x_bgsub, y_bgsub = readchi(bgsub_filen)
-            __, __, x_bg, y_bg = readchi(bg_filen)
-            self.set_bg(x_bg, y_bg, x_bgsub, y_bgsub, roi, bg_params)
-            return True
-        else:
+    def make_bg_cache_key(self, roi, params):
+        """
+        hash of the raw data, roi, and background parameters.
+        any change in these gives a different key.
+        """
+        h = hashlib.sha1()
+        h.update(BG_CACHE_VERSION.encode())
+        h.update(np.ascontiguousarray(self.x_raw, dtype=float).tobytes())
+        h.update(np.ascontiguousarray(self.y_raw, dtype=float).tobytes())
+        h.update(np.asarray(roi, dtype=float).tobytes())
+        h.update(np.asarray(params, dtype=int).tobytes())
+        return h.hexdigest()
+
+    def make_temp_filename(self, temp_dir=None):
+        return make_filename(self.fname, 'bg.npz', temp_dir=temp_dir)
+
+    def read_bg_from_tempfile(self, roi, params, temp_dir=None):
+        """
+        read background from the binary cache in temp_dir.
+        returns True only if the cache was made from the same raw data
+        with the same roi and params, otherwise False.
+        """
+        filen = self.make_temp_filename(temp_dir=temp_dir)
+        if not os.path.exists(filen):
             return False
-
-    def make_temp_filenames(self, temp_dir=None):
-        bgsub_filen = make_filename(self.fname, 'bgsub.chi',
-                                    temp_dir=temp_dir)
-        bg_filen = make_filename(self.fname, 'bg.chi',
-                                 temp_dir=temp_dir)
-        return bgsub_filen, bg_filen
-
-    def temp_files_exist(self, temp_dir=None):
-        bgsub_filen, bg_filen = self.make_temp_filenames(temp_dir=temp_dir)
-        if os.path.exists(bgsub_filen) and os.path.exists(bg_filen):
-            return True
-        else:
+        try:
+            with np.load(filen) as cache:
+                if str(cache['key']) != self.make_bg_cache_key(roi, params):
+                    return False
+                x_bg = cache['x_bg']
+                y_bg = cache['y_bg']
+                y_bgsub = cache['y_bgsub']
+        except (IOError, ValueError, KeyError, EOFError,
+                zipfile.BadZipFile):
+            # broken or old cache file, refit
             return False
+        self.set_bg(x_bg, y_bg, x_bg, y_bgsub, list(roi), list(params))
+        return True
 
     def write_temporary_bgfiles(self, temp_dir='temporary_pkpo'):
-        bgsub_filen, bg_filen = self.make_temp_filenames(temp_dir=temp_dir)
-        x_bgsub, y_bgsub = self.get_bgsub()
-        x_bg, y_bg = self.get_bg()
-        preheader_line0 = \
-            '# BG ROI: {0: .5f}, {1: .5f} \n'.format(self.roi[0], self.roi[1])
-        preheader_line1 = \
-            '# BG Params: {0: d}, {1: d}, {2: d} \n'.format(
-                self.params_chbg[0], self.params_chbg[1], self.params_chbg[2])
-        preheader_line2 = '\n'
-        writechi(bgsub_filen, x_bgsub, y_bgsub, preheader=preheader_line0 +
-                 preheader_line1 + preheader_line2)
-        writechi(bg_filen, x_bg, y_bg, preheader=preheader_line0 +
-                 preheader_line1 + preheader_line2)
+        """
+        save current background to the binary cache in temp_dir
+        """
+        filen = self.make_temp_filename(temp_dir=temp_dir)
+        temp_path = os.path.dirname(filen)
+        if not os.path.exists(temp_path):
+            os.makedirs(temp_path)
+        key = self.make_bg_cache_key(self.roi, self.params_chbg)
+        save_atomic(filen, lambda f: np.savez(
+            f, key=key, x_bg=self.x_bg, y_bg=self.y_bg, y_bgsub=self.y_bgsub))
+
+
+def get_chbg_stack(patterns, roi, params=None):
+    """
+    subtract background for many patterns at once.
+    Patterns sharing the same 2-theta grid in the roi are fitted together
+    in one vectorized pass.  This is equivalent to calling
+    pattern.subtract_bg(roi, params) for each pattern.
+
+    :param patterns: list of Pattern objects with raw data
+    :param roi: [min, max] for background
+    :param params: [n_points, n_iteration, n_cheborder]
+    """
+    t_start = time.time()
+    groups = {}
+    for pattern in patterns:
+        if params is not None:
+            pattern.params_chbg = params
+        x, y = pattern._get_section(pattern.x_raw, pattern.y_raw, roi)
+        key = (x.tobytes(), tuple(pattern.params_chbg))
+        if key not in groups:
+            groups[key] = (x, [], [])
+        groups[key][1].append(pattern)
+        groups[key][2].append(y)
+    for x, group, y_lst in groups.values():
+        bg_params = group[0].params_chbg
+        y_bg_stack, y_bgsub_stack = fit_bg_cheb_auto_stack(
+            x, np.asarray(y_lst), bg_params[0], bg_params[1], bg_params[2])
+        for pattern, y_bg, y_bgsub in zip(group, y_bg_stack, y_bgsub_stack):
+            pattern.set_bg(x, y_bg, x, y_bgsub, roi, bg_params)
+    print("Bgsub for {0:d} patterns takes {1:.2f}s".format(
+        patterns.__len__(), time.time() - t_start))
 
 
 class PatternPeakPo(Pattern):
@@ -1,2 +1,3 @@
-from .DiffractionPattern import PatternPeakPo
+from .DiffractionPattern import PatternPeakPo, get_chbg_stack
 from .powdiff import get_DataSection
+from .loader import load_patterns
@@ -2,7 +2,7 @@ import numpy as np
 
 
 def fit_bg_cheb_auto(x, y_obs, n_points=20, n_iteration=10, n_cheborder=20,
-                     accurate=True):
+                     accurate=True, engine='fast'):
     """
     this returns cheb parameter for fitted background
     best for synchrotron XRD is:
@@ -13,8 +13,13 @@ def fit_bg_cheb_auto(x, y_obs, n_points=20, n_iteration=10, n_cheborder=20,
     :param n_iteration:
     :param n_cheborder:
     :param accurate:
+    :param engine: 'fast' for the running-sum smoother or 'reference' for
+        the original loop.  Both give the same result.
     """
-    y_bg_smooth = smooth_bruckner(x, y_obs, n_points, n_iteration)
+    if engine == 'reference':
+        y_bg_smooth = smooth_bruckner(x, y_obs, n_points, n_iteration)
+    else:
+        y_bg_smooth = smooth_bruckner_fast(x, y_obs, n_points, n_iteration)
 
     # get cheb input parameters
     x_cheb = 2. * (x - x[0]) / (x[-1] - x[0]) - 1.
@@ -27,6 +32,10 @@ def fit_bg_cheb_auto(x, y_obs, n_points=20, n_iteration=10, n_cheborder=20,
 
 
 def smooth_bruckner(x, y_obs, n_smooth, n_iter):
+    """
+    reference implementation of the Bruckner smoothing.  Slow, kept for
+    checking smooth_bruckner_fast.
+    """
     y_original = y_obs
 
     n_data = y_obs.size
@@ -51,3 +60,110 @@ def smooth_bruckner(x, y_obs, n_smooth, n_iter):
         y = y_new
 
     return y[n:n + n_data]
+
+
+def smooth_bruckner_fast(x, y_obs, n_smooth, n_iter):
+    """
+    same as smooth_bruckner but the window average is updated with a
+    running sum, so one iteration costs O(n) instead of O(n * n_smooth).
+    Points are updated in place during the sweep like in the reference,
+    which is why this is not a cumsum over the whole array.
+
+    :param x: x
+    :param y_obs: observed y
+    :param n_smooth: half width of the smoothing window
+    :param n_iter: number of iterations
+    """
+    n_data = y_obs.size
+    n = n_smooth
+    y = np.empty(n_data + n + n)
+    y[n:n + n_data] = y_obs[0:n_data]
+    y[0:n].fill(y_obs[n])
+    y[n + n_data:n_data + n + n].fill(y_obs[-1])
+
+    y_avg = np.average(y)
+    y_min = np.min(y)
+    y_c = y_avg + 2. * (y_avg - y_min)
+    y[np.where(y > y_c)] = y_c
+
+    # python floats are much faster than numpy scalars for the sweep
+    y_lst = y.tolist()
+    n_window = float(n + n + 1)
+    for j in range(0, n_iter):
+        y_sum = sum(y_lst[0:n + n + 1])
+        for i in range(n, n_data - 1 - n - 1):
+            y_i = y_lst[i]
+            y_window = y_sum / n_window
+            if y_window < y_i:
+                y_lst[i] = y_window
+                y_sum += y_window - y_i
+            y_sum += y_lst[i + n + 1] - y_lst[i - n]
+
+    return np.asarray(y_lst[n:n + n_data])
+
+
+def fit_bg_cheb_auto_stack(x, y_obs_stack, n_points=20, n_iteration=10,
+                           n_cheborder=20):
+    """
+    fit backgrounds for a stack of patterns sharing the same x.
+    One Chebyshev design matrix is built and used for the whole stack.
+
+    :param x: x, shared by all patterns
+    :param y_obs_stack: 2D array, (n_patterns, n_data)
+    :param n_points:
+    :param n_iteration:
+    :param n_cheborder:
+    :return: y_bg_stack, y_bgsub_stack
+    """
+    y_obs_stack = np.atleast_2d(y_obs_stack)
+    y_bg_smooth = smooth_bruckner_stack(x, y_obs_stack, n_points, n_iteration)
+
+    x_cheb = 2. * (x - x[0]) / (x[-1] - x[0]) - 1.
+    design = np.polynomial.chebyshev.chebvander(x_cheb, n_cheborder)
+    # scale columns for conditioning, same as chebfit does
+    scale = np.sqrt(np.square(design).sum(axis=0))
+    scale[scale == 0] = 1.
+    cheb_parameters = np.linalg.lstsq(design / scale, y_bg_smooth.T,
+                                      rcond=None)[0]
+    cheb_parameters = (cheb_parameters.T / scale).T
+    y_bg_stack = np.dot(design, cheb_parameters).T
+    return y_bg_stack, y_obs_stack - y_bg_stack
+
+
+def smooth_bruckner_stack(x, y_obs_stack, n_smooth, n_iter):
+    """
+    smooth_bruckner_fast for a 2D stack of patterns, (n_patterns, n_data).
+    The sweep runs along the data points and is vectorized over patterns.
+    """
+    n_ptn, n_data = y_obs_stack.shape
+    if n_ptn < 24:
+        # numpy overhead per step is not worth it for a few patterns
+        return np.asarray([smooth_bruckner_fast(x, y_obs, n_smooth, n_iter)
+                           for y_obs in y_obs_stack])
+    n = n_smooth
+    # points along axis 0 so that each step touches a contiguous row
+    y = np.empty((n_data + n + n, n_ptn))
+    y[n:n + n_data] = y_obs_stack.T
+    y[0:n] = y_obs_stack[:, n]
+    y[n + n_data:n_data + n + n] = y_obs_stack[:, -1]
+
+    y_avg = np.average(y, axis=0)
+    y_min = np.min(y, axis=0)
+    y_c = y_avg + 2. * (y_avg - y_min)
+    np.minimum(y, y_c, out=y)
+
+    n_window = float(n + n + 1)
+    y_window = np.empty(n_ptn)
+    y_diff = np.empty(n_ptn)
+    for j in range(0, n_iter):
+        y_sum = y[0:n + n + 1].sum(axis=0)
+        for i in range(n, n_data - 1 - n - 1):
+            np.divide(y_sum, n_window, out=y_window)
+            np.minimum(y_window, y[i], out=y_window)
+            np.subtract(y_window, y[i], out=y_diff)
+            y[i] = y_window
+            y_sum += y_diff
+            y_sum += y[i + n + 1]
+            y_sum -= y[i - n]
+
+    return y[n:n + n_data].T.copy()
@@ -0,0 +1,93 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .DiffractionPattern import PatternPeakPo, get_chbg_stack
+
+MIN_FILES_FOR_POOL = 16
+
+
+def _read_a_pattern(filename, wavelength, display, bg_roi, bg_params,
+                    temp_dir=None):
+    """
+    read a chi file and its background from temp_dir if a valid cache
+    exists.  returns pattern and boolean for whether background is ready.
+    """
+    pattern = PatternPeakPo()
+    pattern.read_file(filename, temp_dir=temp_dir)
+    pattern.wavelength = wavelength
+    pattern.display = display
+    if temp_dir is None:
+        return pattern, False
+    return pattern, pattern.read_bg_from_tempfile(bg_roi, bg_params,
+                                                  temp_dir=temp_dir)
+
+
+def _load_a_pattern(args):
+    """
+    worker for the process pool.  should stay at the module level so that
+    it can be pickled.
+    """
+    filename, wavelength, display, bg_roi, bg_params, temp_dir = args
+    pattern, success = _read_a_pattern(filename, wavelength, display,
+                                       bg_roi, bg_params, temp_dir=temp_dir)
+    if not success:
+        pattern.get_chbg(bg_roi, params=bg_params, yshift=0)
+        if temp_dir is not None:
+            pattern.write_temporary_bgfiles(temp_dir=temp_dir)
+    return pattern
+
+
+def load_patterns(filenames, wavelength, display, bg_roi, bg_params,
+                  temp_dir=None, n_workers=None):
+    """
+    read chi files and subtract background, returns a list of
+    PatternPeakPo in the same order as filenames.
+
+    :param filenames: list of chi filenames
+    :param wavelength: list of wavelength, one for each file
+    :param display: list of display flags, one for each file
+    :param bg_roi: [min, max] for background
+    :param bg_params: [n_points, n_iteration, n_cheborder]
+    :param temp_dir: folder for background cache, None to ignore cache
+    :param n_workers: number of processes.  None for all cores,
+        1 or less for serial loading in this process.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, filenames.__len__())
+    # starting processes costs more than loading a handful of files
+    if (n_workers > 1) and (filenames.__len__() >= MIN_FILES_FOR_POOL):
+        t_start = time.time()
+        args = [(f, wl, dp, bg_roi, bg_params, temp_dir)
+                for f, wl, dp in zip(filenames, wavelength, display)]
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                patterns = list(executor.map(_load_a_pattern, args))
+            print("Loading {0:d} patterns with {1:d} processes takes "
+                  "{2:.2f}s".format(patterns.__len__(), n_workers,
+                                    time.time() - t_start))
+            return patterns
+        except (BrokenProcessPool, OSError) as inst:
+            print('Parallel loading failed, fall back to serial: ' +
+                  str(inst))
+    return _load_patterns_serial(filenames, wavelength, display, bg_roi,
+                                 bg_params, temp_dir=temp_dir)
+
+
+def _load_patterns_serial(filenames, wavelength, display, bg_roi, bg_params,
+                          temp_dir=None):
+    patterns = []
+    ptn_to_fit = []
+    for f, wl, dp in zip(filenames, wavelength, display):
+        pattern, success = _read_a_pattern(f, wl, dp, bg_roi, bg_params,
+                                           temp_dir=temp_dir)
+        if not success:
+            ptn_to_fit.append(pattern)
+        patterns.append(pattern)
+    if ptn_to_fit != []:
+        get_chbg_stack(ptn_to_fit, bg_roi, params=bg_params)
+        if temp_dir is not None:
+            for pattern in ptn_to_fit:
+                pattern.write_temporary_bgfiles(temp_dir=temp_dir)
+    return patterns
@@ -1 +1,3 @@
 from .section import Section
+from .batchfit import fit_sections_in_series, write_batch_fit_table
+from .peakfinder import find_peaks, group_peaks
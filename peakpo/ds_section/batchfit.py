@@ -0,0 +1,167 @@
+import os
+import csv
+import copy
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from ds_powdiff import get_DataSection
+from .section import Section
+
+# one row for each section, pattern, and peak
+BATCH_FIT_DTYPE = np.dtype([
+    ('section', 'i4'), ('file_index', 'i4'), ('pressure', 'f8'),
+    ('temperature', 'f8'), ('peak', 'i4'), ('phasename', 'U64'),
+    ('h', 'f8'), ('k', 'f8'), ('l', 'f8'),
+    ('center', 'f8'), ('center_err', 'f8'), ('fwhm', 'f8'),
+    ('fwhm_err', 'f8'), ('area', 'f8'), ('area_err', 'f8'),
+    ('fraction', 'f8'), ('fraction_err', 'f8'),
+    ('chisqr', 'f8'), ('redchi', 'f8'), ('success', '?')])
+
+
+def _get_peak_rows(file_index, peaks, fit_result, success):
+    """
+    :return: rows of fit results for the table without section, pressure,
+        and temperature
+    """
+    rows = []
+    if fit_result is not None:
+        params = fit_result.params
+    for k, peak in enumerate(peaks):
+        values = []
+        for field, scale in (('center', 1.), ('sigma', 2.),
+                             ('amplitude', 1.), ('fraction', 1.)):
+            if fit_result is None:
+                values += [np.nan, np.nan]
+                continue
+            par = params["p{0:d}_{1:s}".format(k, field)]
+            values += [par.value * scale,
+                       np.nan if par.stderr is None else par.stderr * scale]
+        if fit_result is None:
+            values += [np.nan, np.nan, False]
+        else:
+            values += [fit_result.chisqr, fit_result.redchi, success]
+        rows.append([file_index, k, peak['phasename'], peak['h'],
+                     peak['k'], peak['l']] + values)
+    return rows
+
+
+def _fit_a_chain(args):
+    """
+    worker for the process pool.  fits one section over patterns in the
+    given order, starting each fit from the result of the previous
+    pattern.  should stay at the module level so that it can be pickled.
+    """
+    peaks_in_queue, baseline_in_queue, poly_order, data = args
+    rows = []
+    for file_index, x, y_bgsub, y_bg in data:
+        section = Section()
+        section.set(x, y_bgsub, y_bg)
+        section.peaks_in_queue = copy.deepcopy(peaks_in_queue)
+        section.baseline_in_queue = copy.deepcopy(baseline_in_queue)
+        try:
+            section.prepare_for_fitting(poly_order)
+            section.conduct_fitting()
+        except Exception as inst:
+            print('Fitting pattern {0:d} failed: '.format(file_index) +
+                  str(inst))
+            rows += _get_peak_rows(file_index, peaks_in_queue, None, False)
+            continue
+        success = section.fit_result.success and \
+            np.isfinite(section.fit_result.chisqr)
+        rows += _get_peak_rows(file_index, section.peaks_in_queue,
+                               section.fit_result, success)
+        # a failed fit is a bad start for the next pattern
+        if success:
+            peaks_in_queue = section.peaks_in_queue
+            baseline_in_queue = section.baseline_in_queue
+    return rows
+
+
+def fit_sections_in_series(sections, patterns, start=0, pressures=None,
+                           temperatures=None, n_workers=None):
+    """
+    fit sections over a series of patterns, such as waterfall patterns
+    from a compression run.  each section is fitted first to the pattern
+    at start with its current peaks, then forward and backward through
+    the series, each fit starting from the result of the neighbouring
+    pattern.  the chains of all sections and directions are independent
+    and run in parallel over n_workers processes.
+
+    :param sections: list of Section with peaks and baseline in queue
+    :param patterns: list of PatternPeakPo with background subtracted
+    :param start: index of the pattern the sections were made for
+    :param pressures: pressures for the table, one for each pattern
+    :param temperatures: temperatures for the table, one for each pattern
+    :param n_workers: number of processes.  None for all cores,
+        1 or less for fitting in this process.
+    :return: structured array of BATCH_FIT_DTYPE
+    """
+    t_start = time.time()
+    n_ptns = patterns.__len__()
+    if pressures is None:
+        pressures = [np.nan] * n_ptns
+    if temperatures is None:
+        temperatures = [np.nan] * n_ptns
+    args = []
+    section_index = []
+    for i, section in enumerate(sections):
+        roi = section.get_xrange()
+        data = []
+        for j, pattern in enumerate(patterns):
+            x, y_bg = get_DataSection(pattern.x_bg, pattern.y_bg, roi)
+            __, y_bgsub = get_DataSection(
+                pattern.x_bgsub, pattern.y_bgsub, roi)
+            data.append((j, x, y_bgsub, y_bg))
+        for chain in (data[start:], data[:start][::-1]):
+            if chain == []:
+                continue
+            args.append((section.peaks_in_queue, section.baseline_in_queue,
+                         section.get_order_of_baseline_in_queue(), chain))
+            section_index.append(i)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, args.__len__())
+    chains = None
+    if n_workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                chains = list(executor.map(_fit_a_chain, args))
+        except (BrokenProcessPool, OSError) as inst:
+            print('Parallel fitting failed, fall back to serial: ' +
+                  str(inst))
+    if chains is None:
+        n_workers = 1
+        chains = [_fit_a_chain(arg) for arg in args]
+    rows = []
+    for i, chain in zip(section_index, chains):
+        for row in chain:
+            rows.append(tuple([i, row[0], pressures[row[0]],
+                               temperatures[row[0]]] + row[1:]))
+    table = np.array(rows, dtype=BATCH_FIT_DTYPE)
+    table = table[np.lexsort((table['peak'], table['file_index'],
+                              table['section']))]
+    print("Fitting {0:d} sections over {1:d} patterns with {2:d} processes "
+          "takes {3:.2f}s".format(sections.__len__(), n_ptns, n_workers,
+                                  time.time() - t_start))
+    return table
+
+
+def write_batch_fit_table(filename, table, filenames=None):
+    """
+    write results of fit_sections_in_series in a csv file
+
+    :param filenames: pattern filenames to write with file index
+    """
+    fields = list(BATCH_FIT_DTYPE.names)
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        if filenames is None:
+            writer.writerow(fields)
+        else:
+            writer.writerow(fields[:2] + ['filename'] + fields[2:])
+        for row in table:
+            items = list(row.tolist())
+            if filenames is not None:
+                items.insert(2, filenames[row['file_index']])
+            writer.writerow(items)
@@ -0,0 +1,94 @@
+import numpy as np
+from scipy.signal import savgol_filter, savgol_coeffs
+
+# one record for each peak found
+FOUND_PEAK_DTYPE = np.dtype([
+    ('center', 'f8'), ('height', 'f8'), ('fwhm', 'f8'), ('prominence', 'f8'),
+    ('amplitude', 'f8')])
+# area / (height x half width) of a pseudo-Voigt with fraction 0.5
+PV_AREA_FACTOR = 1. / (0.5 * np.sqrt(np.log(2.) / np.pi) + 0.5 / np.pi)
+
+
+def _get_mad(values):
+    """
+    :return: standard deviation estimated from median absolute deviation
+    """
+    return 1.4826 * np.median(np.abs(values - np.median(values)))
+
+
+def find_peaks(x, y, fwhm, n_sigma=5., min_prominence=0.):
+    """
+    find peaks in background subtracted data from minima of the smoothed
+    second derivative, which also finds shoulders of overlapped peaks.
+    second derivative is from a Savitzky-Golay filter about fwhm wide.
+    a peak should be above n_sigma x noise both in height and in
+    curvature.  prominence is the height of a gaussian of the given fwhm
+    with the same curvature, so that it does not include neighbouring
+    peaks or baseline.
+
+    :param x: x values in increasing order
+    :param y: background subtracted y values
+    :param fwhm: typical full width at half maximum in x unit
+    :param n_sigma: minimum height and curvature in unit of their noise
+    :param min_prominence: minimum prominence in y unit
+    :return: recarray of FOUND_PEAK_DTYPE in the order of center.
+        amplitude is the area of a pseudo-Voigt with fraction 0.5.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    dx = np.median(np.diff(x))
+    half = max(int(round(fwhm / dx / 2.)), 2)
+    if x.size < 2 * half + 3:
+        return np.zeros(0, dtype=FOUND_PEAK_DTYPE).view(np.recarray)
+    window = 2 * half + 1
+    y_smooth = savgol_filter(y, window, 3)
+    d2 = savgol_filter(y, window, 3, deriv=2, delta=dx)
+    noise = _get_mad(y - y_smooth)
+    # noise of the second derivative from the filter for white noise
+    noise_d2 = noise * np.sqrt(
+        (savgol_coeffs(window, 3, deriv=2, delta=dx)**2).sum())
+    # local minima of negative curvature
+    i = np.nonzero((d2[1:-1] < d2[:-2]) & (d2[1:-1] <= d2[2:]) &
+                   (d2[1:-1] < 0.))[0] + 1
+    height = y_smooth[i]
+    keep = (height >= n_sigma * noise) & (-d2[i] >= n_sigma * noise_d2)
+    i, height = i[keep], height[keep]
+    # height of a gaussian of the given fwhm with the same curvature
+    prominence = -d2[i] * fwhm**2 / (8. * np.log(2.))
+    keep = prominence >= min_prominence
+    i, height, prominence = i[keep], height[keep], prominence[keep]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        width = np.sqrt(8. * np.log(2.) * height / -d2[i])
+    width = np.clip(np.nan_to_num(width), 2. * dx, 4. * fwhm)
+    # parabola through the curvature minimum for position between points
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = 0.5 * (d2[i - 1] - d2[i + 1]) / \
+            (d2[i - 1] - 2. * d2[i] + d2[i + 1])
+    shift = np.clip(np.nan_to_num(shift), -0.5, 0.5)
+    peaks = np.zeros(i.size, dtype=FOUND_PEAK_DTYPE).view(np.recarray)
+    peaks.center = np.interp(i + shift, np.arange(x.size), x)
+    peaks.height = height
+    peaks.fwhm = width
+    peaks.prominence = prominence
+    peaks.amplitude = height * width / 2. * PV_AREA_FACTOR
+    return peaks
+
+
+def group_peaks(peaks, margin=3.):
+    """
+    group peaks which overlap within margin x fwhm, so that each group
+    can be fitted in a section
+
+    :param peaks: recarray from find_peaks
+    :param margin: extent of a peak on each side in unit of fwhm
+    :return: list of [xmin, xmax] for each group
+    """
+    if peaks.size == 0:
+        return []
+    lower = peaks.center - margin * peaks.fwhm
+    upper = peaks.center + margin * peaks.fwhm
+    # a new group starts where no earlier peak reaches
+    reach = np.maximum.accumulate(upper)
+    starts = np.r_[0, np.nonzero(lower[1:] > reach[:-1])[0] + 1]
+    ends = np.r_[starts[1:], peaks.size]
+    return [[lower[s:e].min(), reach[e - 1]] for s, e in zip(starts, ends)]
@@ -0,0 +1,323 @@
+import time
+import numpy as np
+from scipy.optimize import leastsq
+
+# parameters of a peak in the order used in arrays
+PEAK_FIELDS = ['amplitude', 'center', 'sigma', 'fraction']
+# same as lmfit.lineshapes
+TINY = 1.e-15
+LN2 = np.log(2.)
+
+
+class _FitAborted(Exception):
+    pass
+
+
+def get_parameter_names(poly_order, n_peaks):
+    """
+    :return: names of baseline and peak parameters as made in
+        Section.prepare_for_fitting, baseline first
+    """
+    names = ["b_c{0:d}".format(i) for i in range(poly_order + 1)]
+    for i in range(n_peaks):
+        names += ["p{0:d}_{1:s}".format(i, field) for field in PEAK_FIELDS]
+    return names
+
+
+def eval_pseudo_voigt(x, values, poly_order, n_peaks, jacobian=False):
+    """
+    evaluate the baseline and all pseudo-Voigt peaks at once.
+    same functions as lmfit PolynomialModel and PseudoVoigtModel.
+
+    :param x: x values
+    :param values: parameter values in the order of get_parameter_names
+    :param jacobian: return derivatives for all parameters too
+    :return: baseline, peaks in (n_peaks, x.size), and
+        jacobian in (x.size, values.size) if requested
+    """
+    x = np.asarray(x, dtype=float)
+    n_base = poly_order + 1
+    powers = x[:, np.newaxis] ** np.arange(n_base)
+    baseline = powers.dot(values[:n_base])
+    amplitude, center, sigma, fraction = \
+        values[n_base:].reshape(n_peaks, 4).T[:, :, np.newaxis]
+    sigma = np.maximum(sigma, TINY)
+    u = x - center
+    u2 = u * u
+    s2 = sigma * sigma
+    # area normalized gaussian with the same fwhm as the lorentzian
+    # exp is slow for arguments that underflow
+    gauss = np.sqrt(LN2 / np.pi) / sigma * \
+        np.exp(np.maximum(-LN2 * u2 / s2, -700.))
+    lorentz = sigma / np.pi / (s2 + u2)
+    shape = (1. - fraction) * gauss + fraction * lorentz
+    peaks = amplitude * shape
+    if not jacobian:
+        return baseline, peaks
+    jac = np.empty((x.size, values.size))
+    jac[:, :n_base] = powers
+    d_gauss_d_center = gauss * 2. * LN2 * u / s2
+    d_lorentz_d_center = lorentz * 2. * u / (s2 + u2)
+    d_gauss_d_sigma = gauss * (2. * LN2 * u2 / s2 - 1.) / sigma
+    d_lorentz_d_sigma = lorentz * (u2 - s2) / sigma / (s2 + u2)
+    jac_peaks = jac[:, n_base:].reshape(x.size, n_peaks, 4)
+    jac_peaks[:, :, 0] = shape.T
+    jac_peaks[:, :, 1] = (amplitude * ((1. - fraction) * d_gauss_d_center +
+                                       fraction * d_lorentz_d_center)).T
+    jac_peaks[:, :, 2] = (amplitude * ((1. - fraction) * d_gauss_d_sigma +
+                                       fraction * d_lorentz_d_sigma)).T
+    jac_peaks[:, :, 3] = (amplitude * (lorentz - gauss)).T
+    jac[:, n_base:] = jac_peaks.reshape(x.size, n_peaks * 4)
+    return baseline, peaks, jac
+
+
+class FitParameter(object):
+    """
+    value, stderr, and vary of a fitted parameter, as in lmfit Parameter
+    """
+
+    def __init__(self, name, value, stderr, vary):
+        self.name = name
+        self.value = value
+        self.stderr = stderr  # None if not known
+        self.vary = vary
+
+
+class FitRecord(object):
+    """
+    compact result of a section fit, kept in Section.fit_result.
+    parameter values, stderrs, and vary flags are in arrays in the order
+    of get_parameter_names.  data, model, and covariance are not kept, so
+    that sections stay cheap to copy and save.  profiles are calculated
+    again when needed from poly_order and n_peaks.  has the attributes
+    of lmfit ModelResult that PeakPo uses.
+    """
+
+    def __init__(self, poly_order, n_peaks):
+        self.poly_order = poly_order
+        self.n_peaks = n_peaks
+        self.names = get_parameter_names(poly_order, n_peaks)
+        self.values = np.zeros(self.names.__len__())
+        self.stderrs = np.full(self.names.__len__(), np.nan)  # nan for None
+        self.vary = np.zeros(self.names.__len__(), dtype=bool)
+        self.method = 'native'
+        self.success = False
+        self.aborted = False
+        self.message = ''
+        self.nfev = 0
+        self.ndata = 0
+        self.nvarys = 0
+        self.nfree = 0
+        self.chisqr = np.nan
+        self.redchi = np.nan
+        self.aic = np.nan
+        self.bic = np.nan
+
+    @property
+    def params(self):
+        """
+        dict of FitParameter, made from the arrays on each call
+        """
+        params = {}
+        for name, value, stderr, vary in zip(
+                self.names, self.values, self.stderrs, self.vary):
+            params[name] = FitParameter(
+                name, float(value),
+                None if np.isnan(stderr) else float(stderr), bool(vary))
+        return params
+
+    def eval(self, x):
+        """
+        :return: fit profile, baseline included
+        """
+        baseline, peaks = eval_pseudo_voigt(
+            x, self.values, self.poly_order, self.n_peaks)
+        return baseline + peaks.sum(axis=0)
+
+    def eval_components(self, x):
+        """
+        :return: dict of profiles, 'b_' for baseline and 'p0_', 'p1_', ...
+            for peaks as in lmfit ModelResult.eval_components
+        """
+        baseline, peaks = eval_pseudo_voigt(
+            x, self.values, self.poly_order, self.n_peaks)
+        components = {'b_': baseline}
+        for i in range(self.n_peaks):
+            components["p{0:d}_".format(i)] = peaks[i]
+        return components
+
+
+def make_fit_record(result, poly_order, n_peaks):
+    """
+    :param result: lmfit ModelResult of the composite model made in
+        Section.prepare_for_fitting
+    :return: FitRecord
+    """
+    record = FitRecord(poly_order, n_peaks)
+    for i, name in enumerate(record.names):
+        par = result.params[name]
+        record.values[i] = par.value
+        record.stderrs[i] = np.nan if par.stderr is None else par.stderr
+        record.vary[i] = par.vary
+    record.method = 'lmfit'
+    for key in ('success', 'aborted', 'message', 'nfev', 'ndata', 'nvarys',
+                'nfree', 'chisqr', 'redchi', 'aic', 'bic'):
+        setattr(record, key, getattr(result, key))
+    return record
+
+
+def _to_internal(values, lower, upper):
+    """
+    bounded values to unbounded internal values, same transformation as
+    lmfit uses for leastsq
+    """
+    internal = values.copy()
+    both = np.isfinite(lower) & np.isfinite(upper)
+    lower_only = np.isfinite(lower) & ~np.isfinite(upper)
+    upper_only = ~np.isfinite(lower) & np.isfinite(upper)
+    internal[both] = np.arcsin(np.clip(
+        2. * (values[both] - lower[both]) / (upper[both] - lower[both]) - 1.,
+        -1., 1.))
+    internal[lower_only] = np.sqrt(
+        (values[lower_only] - lower[lower_only] + 1.)**2 - 1.)
+    internal[upper_only] = np.sqrt(
+        (upper[upper_only] - values[upper_only] + 1.)**2 - 1.)
+    return internal
+
+
+def _to_external(internal, lower, upper):
+    """
+    :return: bounded values and their derivatives to internal values
+    """
+    values = internal.copy()
+    derivative = np.ones_like(internal)
+    both = np.isfinite(lower) & np.isfinite(upper)
+    lower_only = np.isfinite(lower) & ~np.isfinite(upper)
+    upper_only = ~np.isfinite(lower) & np.isfinite(upper)
+    half_range = (upper[both] - lower[both]) / 2.
+    values[both] = lower[both] + (np.sin(internal[both]) + 1.) * half_range
+    derivative[both] = np.cos(internal[both]) * half_range
+    root = np.sqrt(internal**2 + 1.)
+    values[lower_only] = lower[lower_only] - 1. + root[lower_only]
+    derivative[lower_only] = internal[lower_only] / root[lower_only]
+    values[upper_only] = upper[upper_only] + 1. - root[upper_only]
+    derivative[upper_only] = -internal[upper_only] / root[upper_only]
+    return values, derivative
+
+
+def fit_pseudo_voigt(x, y, parameters, poly_order, n_peaks, max_nfev=None,
+                     iter_cb=None):
+    """
+    fit a polynomial baseline and pseudo-Voigt peaks with analytic
+    derivatives.  all peaks are evaluated in one array operation instead
+    of walking a composite lmfit model.  vary flags and bounds of the
+    parameters are kept.  uses the same Levenberg-Marquardt solver and
+    bound transformation as lmfit leastsq, so that fits end at the same
+    minimum.  standard errors are from the covariance scaled by reduced
+    chi-square as in lmfit.
+
+    :param x: x values
+    :param y: y values to fit
+    :param parameters: lmfit Parameters from Section.prepare_for_fitting
+    :param poly_order: order of baseline polynomial
+    :param n_peaks: number of peaks
+    :param max_nfev: maximum number of function evaluations,
+        None for 2000 * (number of varied parameters + 1) as in lmfit
+    :param iter_cb: function called after each evaluation as
+        iter_cb(number of evaluations, chisqr).  return True to abort the
+        fit, then the result has aborted True and the last values tried.
+    :return: FitRecord
+    """
+    t_start = time.time()
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    names = get_parameter_names(poly_order, n_peaks)
+    pars = [parameters[name] for name in names]
+    lower = np.array([-np.inf if par.min is None else par.min
+                      for par in pars], dtype=float)
+    upper = np.array([np.inf if par.max is None else par.max
+                      for par in pars], dtype=float)
+    values = np.clip(np.array([par.value for par in pars], dtype=float),
+                     lower, upper)
+    internal = _to_internal(values, lower, upper)
+    free = np.nonzero([par.vary for par in pars])[0]
+    fixed = np.ones(values.size, dtype=bool)
+    fixed[free] = False
+    if max_nfev is None:
+        max_nfev = 2000 * (free.size + 1)
+
+    def unpack(internal_free):
+        internal_all = internal.copy()
+        internal_all[free] = internal_free
+        values_all, derivative = _to_external(internal_all, lower, upper)
+        # fixed parameters stay exactly as given
+        values_all[fixed] = values[fixed]
+        return values_all, derivative
+
+    def residual(internal_free):
+        baseline, peaks = eval_pseudo_voigt(
+            x, unpack(internal_free)[0], poly_order, n_peaks)
+        return baseline + peaks.sum(axis=0) - y
+
+    # number of evaluations and the last values tried
+    progress = {'nfev': 0, 'internal': internal[free]}
+
+    def residual_with_cb(internal_free):
+        resid = residual(internal_free)
+        progress['nfev'] += 1
+        progress['internal'] = internal_free
+        if (iter_cb is not None) and \
+                iter_cb(progress['nfev'], (resid**2).sum()):
+            raise _FitAborted()
+        return resid
+
+    def jacobian(internal_free):
+        values_all, derivative = unpack(internal_free)
+        jac = eval_pseudo_voigt(
+            x, values_all, poly_order, n_peaks, jacobian=True)[2]
+        return jac[:, free] * derivative[free]
+
+    result = FitRecord(poly_order, n_peaks)
+    result.ndata = x.size
+    result.vary[free] = True
+    if free.size == 0:
+        internal_fit = internal[free]
+        values_fit = values
+        result.success = True
+        result.message = 'No parameter to vary.'
+    else:
+        try:
+            internal_fit, cov_x, info, message, ier = leastsq(
+                residual_with_cb, internal[free], Dfun=jacobian,
+                full_output=True, ftol=1.5e-8, xtol=1.5e-8, maxfev=max_nfev)
+            result.success = ier in [1, 2, 3, 4]
+            result.message = message
+            result.nfev = info['nfev']
+        except _FitAborted:
+            internal_fit = progress['internal']
+            result.aborted = True
+            result.message = 'Fit aborted.'
+            result.nfev = progress['nfev']
+        values_fit = unpack(internal_fit)[0]
+    resid = residual(internal_fit)
+    result.values = values_fit
+    result.nvarys = free.size
+    result.nfree = max(x.size - free.size, 1)
+    result.chisqr = (resid**2).sum()
+    result.redchi = result.chisqr / result.nfree
+    neg2_log_likel = x.size * np.log(max(result.chisqr, TINY) / x.size)
+    result.aic = neg2_log_likel + 2. * free.size
+    result.bic = neg2_log_likel + np.log(x.size) * free.size
+    # covariance from derivatives to bounded values
+    jac = eval_pseudo_voigt(
+        x, values_fit, poly_order, n_peaks, jacobian=True)[2][:, free]
+    # zero for fixed parameters as in lmfit
+    result.stderrs[fixed] = 0.
+    try:
+        covar = np.linalg.inv(jac.T.dot(jac)) * result.redchi
+        result.stderrs[free] = np.sqrt(np.diag(covar))
+    except np.linalg.LinAlgError:
+        pass
+    print("Fitting {0:d} peaks takes {1:.2f}s".format(
+        n_peaks, time.time() - t_start))
+    return result
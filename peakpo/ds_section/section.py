@@ -2,6 +2,8 @@ import numpy as np
 import datetime
 import copy
 from lmfit.models import PolynomialModel, PseudoVoigtModel
+from .pvfit import fit_pseudo_voigt, make_fit_record, FitRecord
+from .peakfinder import find_peaks
 
 
 class Section(object):
@@ -16,6 +18,27 @@ class Section(object):
         self.peaks_in_queue = []  # list of dic, value, constraints
         self.peakinfo = {}
 
+    def __getstate__(self):
+        # lmfit parameters and model are made again by prepare_for_fitting
+        state = self.__dict__.copy()
+        state.pop('parameters', None)
+        state.pop('fit_model', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.parameters = None
+        self.fit_model = None
+        # sections saved with lmfit ModelResult
+        if (self.fit_result is not None) and \
+                (not isinstance(self.fit_result, FitRecord)):
+            try:
+                self.fit_result = make_fit_record(
+                    self.fit_result, self.get_order_of_baseline_in_queue(),
+                    self.get_number_of_peaks_in_queue())
+            except (AttributeError, KeyError) as inst:
+                print('Fit result is kept as it is: ' + str(inst))
+
     def get_xrange(self):
         return (self.x.min(), self.x.max())
 
@@ -61,10 +84,16 @@ class Section(object):
         if (x_center > self.x.max()) or (x_center < self.x.min()):
             return False
         y_center = self.get_nearest_intensity(x_center)
+        self._append_peak(x_center, y_center * fwhm * 4., fwhm, hkl=hkl,
+                          phase_name=phase_name)
+        return True
+
+    def _append_peak(self, center, amplitude, sigma, hkl=[0, 0, 0],
+                     phase_name=''):
         peak = {}
-        peak['center'] = x_center
-        peak['amplitude'] = y_center * fwhm * 4.
-        peak['sigma'] = fwhm
+        peak['center'] = center
+        peak['amplitude'] = amplitude
+        peak['sigma'] = sigma
         peak['fraction'] = 0.5
         peak['center_vary'] = True
         peak['amplitude_vary'] = True
@@ -75,7 +104,33 @@ class Section(object):
         peak['k'] = hkl[1]
         peak['l'] = hkl[2]
         self.peaks_in_queue.append(peak)
-        return True
+
+    def set_peaks_found(self, peaks):
+        """
+        replace peaks in queue with found peaks.  fit result is dropped
+        as it is for the old peaks.
+
+        :param peaks: recarray from peakfinder.find_peaks
+        """
+        self.peaks_in_queue[:] = []
+        self.fit_result = None
+        for peak in peaks:
+            # sigma is half of fwhm for PseudoVoigtModel
+            self._append_peak(float(peak['center']), float(peak['amplitude']),
+                              float(peak['fwhm']) / 2.)
+
+    def find_peaks(self, fwhm, n_sigma=5., min_prominence=0.):
+        """
+        find peaks in background subtracted data and put them in queue
+        instead of the peaks there.  see peakfinder.find_peaks.
+
+        :param fwhm: typical full width at half maximum
+        :return: number of peaks found
+        """
+        peaks = find_peaks(self.x, self.y_bgsub, fwhm, n_sigma=n_sigma,
+                           min_prominence=min_prominence)
+        self.set_peaks_found(peaks)
+        return peaks.size
 
     def get_order_of_baseline_in_queue(self):
         return self.baseline_in_queue.__len__() - 1
@@ -152,10 +207,32 @@ class Section(object):
         self.peakinfo = peakinfo
         self.fit_model = mod
 
-    def conduct_fitting(self):
-        out = self.fit_model.fit(
-            self.y_bgsub, self.parameters, x=self.x)
-        self.fit_result = copy.deepcopy(out)
+    def conduct_fitting(self, native=True, iter_cb=None):
+        """
+        :param native: use fit_pseudo_voigt with analytic derivatives.
+            False to fit the lmfit composite model.
+        :param iter_cb: function called during the fit as
+            iter_cb(number of evaluations, chisqr).  return True to abort,
+            then the previous fit result and queue are kept.
+        """
+        if native:
+            out = fit_pseudo_voigt(
+                self.x, self.y_bgsub, self.parameters,
+                self.get_order_of_baseline_in_queue(),
+                self.get_number_of_peaks_in_queue(), iter_cb=iter_cb)
+        else:
+            if iter_cb is None:
+                lmfit_cb = None
+            else:
+                def lmfit_cb(params, iter, resid, *args, **kws):
+                    return iter_cb(iter, (resid**2).sum())
+            out = self.fit_model.fit(
+                self.y_bgsub, self.parameters, x=self.x, iter_cb=lmfit_cb)
+            out = make_fit_record(out, self.get_order_of_baseline_in_queue(),
+                                  self.get_number_of_peaks_in_queue())
+        if out.aborted:
+            return False
+        self.fit_result = out
         self.timestamp = str(datetime.datetime.now())[:-7]
         self.copy_fit_result_to_queue()
         if self.fit_result is None:
@@ -171,17 +248,15 @@ class Section(object):
 
     def copy_fit_result_to_queue(self):
         n_peaks = self.get_number_of_peaks_in_queue()
+        params = self.fit_result.params
         # self.clear_queue()
         i = 0
         for peak in self.peaks_in_queue:
             prefix = "p{0:d}_".format(i)
-            peak['center'] = self.fit_result.params[prefix + 'center'].value
-            peak['amplitude'] = self.fit_result.params[
-                prefix + 'amplitude'].value
-            peak['sigma'] = self.fit_result.params[
-                prefix + 'sigma'].value
-            peak['fraction'] = self.fit_result.params[
-                prefix + 'fraction'].value
+            peak['center'] = params[prefix + 'center'].value
+            peak['amplitude'] = params[prefix + 'amplitude'].value
+            peak['sigma'] = params[prefix + 'sigma'].value
+            peak['fraction'] = params[prefix + 'fraction'].value
             peak['phasename'] = self.peakinfo[prefix + 'phasename']
             peak['h'] = self.peakinfo[prefix + 'h']
             peak['k'] = self.peakinfo[prefix + 'k']
@@ -190,7 +265,7 @@ class Section(object):
         i = 0
         for factor in self.baseline_in_queue:
             prefix = "b_c{0:d}".format(i)
-            factor['value'] = self.fit_result.params[prefix].value
+            factor['value'] = params[prefix].value
             i += 1
 
     def get_number_of_peaks_in_queue(self):
@@ -212,12 +287,12 @@ class Section(object):
 
     def get_fit_profile(self, bgsub=False):
         if bgsub:
-            return self.fit_result.best_fit
+            return self.fit_result.eval(x=self.x)
         else:
-            return self.fit_result.best_fit + self.y_bg
+            return self.fit_result.eval(x=self.x) + self.y_bg
 
     def get_fit_residue(self, bgsub=False):
-        return self.y_bgsub - self.fit_result.best_fit + \
+        return self.y_bgsub - self.fit_result.eval(x=self.x) + \
             self.get_fit_residue_baseline(bgsub=bgsub)
 
     def get_fit_residue_baseline(self, bgsub=False):
@@ -5,9 +5,11 @@ import xlwt
 from ds_cake import DiffImg
 # do not change the module structure for ds_jcpds and ds_powdiff for
 # retro compatibility
-from ds_jcpds import JCPDSplt, Session
-from ds_powdiff import PatternPeakPo, get_DataSection
-from ds_section import Section
+from ds_jcpds import JCPDSplt, Session, get_jcpds_library, search_match
+from ds_powdiff import PatternPeakPo, get_DataSection, get_chbg_stack, \
+    load_patterns
+from ds_section import Section, fit_sections_in_series, find_peaks, \
+    group_peaks
 from utils import samefilename, make_filename, change_file_path
 
 
@@ -32,6 +34,10 @@ class PeakPoModel(object):
         self.section_lst = []
         self.saved_pressure = 10.
         self.saved_temperature = 300.
+        self.n_workers = None  # None for all cores, 1 for serial loading
+        self.n_prefetch = 1  # neighbours on each side, 0 for no prefetch
+        self.cake_dtype = None  # such as 'float32' for smaller cake cache
+        self.cake_compress = False
 
     def exist_in_waterfall(self, filename):
         if not self.waterfall_exist():
@@ -231,58 +237,85 @@ class PeakPoModel(object):
     def same_filename_as_base_ptn(self, filename):
         return samefilename(self.base_ptn.fname, filename)
 
-    def set_base_ptn(self, new_base_ptn_filen, wavelength):
+    def set_base_ptn(self, new_base_ptn_filen, wavelength, temp_dir=None):
         """
         :param new_base_ptn: PatternPeakPo object
+        :param temp_dir: folder for binary sidecar of the chi file
         """
         self.reset_base_ptn()
-        self.base_ptn.read_file(new_base_ptn_filen)
+        self.base_ptn.read_file(new_base_ptn_filen, temp_dir=temp_dir)
         self.set_chi_path(os.path.split(new_base_ptn_filen)[0])
         self.set_base_ptn_wavelength(wavelength)
         self.base_ptn.display = True
 
+    def replace_base_ptn(self, new_base_ptn):
+        """
+        :param new_base_ptn: PatternPeakPo object which is already loaded
+        """
+        self.base_ptn = new_base_ptn
+        self.set_chi_path(os.path.split(new_base_ptn.fname)[0])
+        self.base_ptn.display = True
+
     def get_base_ptn(self):
         return self.base_ptn
 
     def append_a_waterfall_ptn(self, filename, wavelength,
                                bg_roi, bg_params, temp_dir=None):
         pattern = PatternPeakPo()
-        pattern.read_file(filename)
+        pattern.read_file(filename, temp_dir=temp_dir)
         pattern.wavelength = wavelength
         pattern.display = False
         if temp_dir is None:
             pattern.get_chbg(bg_roi, params=bg_params, yshift=0)
         else:
-            success = pattern.read_bg_from_tempfile(temp_dir=temp_dir)
+            success = pattern.read_bg_from_tempfile(
+                bg_roi, bg_params, temp_dir=temp_dir)
             if not success:
                 pattern.get_chbg(bg_roi, params=bg_params, yshift=0)
+                pattern.write_temporary_bgfiles(temp_dir=temp_dir)
         self.waterfall_ptn.append(pattern)
 
+    def append_waterfall_ptns(self, filenames, wavelength,
+                              bg_roi, bg_params, temp_dir=None):
+        """
+        append many patterns at once.  Files are read and processed in
+        parallel over self.n_workers processes.
+        """
+        n_files = filenames.__len__()
+        new_ptns = load_patterns(
+            filenames, [wavelength] * n_files, [False] * n_files,
+            bg_roi, bg_params, temp_dir=temp_dir, n_workers=self.n_workers)
+        self.waterfall_ptn += new_ptns
+
     def replace_a_waterfall(self, new_pattern, index_to_replace):
         self.waterfall_ptn[index_to_replace] = new_pattern
 
     def set_waterfall_ptn(
             self, filenames, wavelength, display, bg_roi, bg_params,
             temp_dir=None):
-        new_waterfall_ptn = []
-        for f, wl, dp in zip(filenames, wavelength, display):
-            pattern = PatternPeakPo()
-            pattern.read_file(f)
-            pattern.wavelength = wl
-            pattern.display = dp
-            if temp_dir is None:
-                pattern.get_chbg(bg_roi, params=bg_params, yshift=0)
-            else:
-                success = pattern.read_bg_from_tempfile(temp_dir=temp_dir)
-                if not success:
-                    pattern.get_chbg(bg_roi, params=bg_params, yshift=0)
-            new_waterfall_ptn.append(pattern)
-        self.waterfall_ptn = new_waterfall_ptn
+        self.waterfall_ptn = load_patterns(
+            filenames, wavelength, display, bg_roi, bg_params,
+            temp_dir=temp_dir, n_workers=self.n_workers)
 
-    def append_a_jcpds(self, filen, color):
+    def subtract_bg_waterfall(self, bg_roi, bg_params):
+        """
+        refit backgrounds of all waterfall patterns in one batch
+        """
+        if not self.waterfall_exist():
+            return
+        get_chbg_stack(self.waterfall_ptn, bg_roi, params=bg_params)
+
+    def append_a_jcpds(self, filen, color, library=None):
+        """
+        :param library: JcpdsLibrary to take the card from instead of
+            reading the file, if the file is in it
+        """
         try:
-            phase = JCPDSplt()
-            phase.read_file(filen)  # phase.file = f
+            if (library is not None) and (library.find(filen) >= 0):
+                phase = library.make_jcpds(library.find(filen))
+            else:
+                phase = JCPDSplt()
+                phase.read_file(filen)  # phase.file = f
             phase.color = color
         except:
             return False
@@ -360,6 +393,86 @@ class PeakPoModel(object):
         else:
             return True
 
+    def get_peak_positions_in_sections(self):
+        """
+        :return: centers of peaks in saved sections and the current
+            section, fitted values if the section was fitted
+        """
+        sections = list(self.section_lst)
+        if self.current_section_exist() and \
+                (not self.current_section_saved()):
+            sections.append(self.current_section)
+        tth = []
+        for section in sections:
+            tth += section.get_peak_positions()
+        return tth
+
+    def search_match_jcpds(self, path, wavelength, pressures,
+                           temperature=300., **kwargs):
+        """
+        rank JCPDS cards in a folder against peaks in sections.
+        see ds_jcpds.search_match for kwargs.
+
+        :return: list of dict of candidates, best first
+        """
+        tth_obs = self.get_peak_positions_in_sections()
+        if tth_obs == []:
+            return []
+        if self.base_ptn_exist() and ('tth_range' not in kwargs):
+            kwargs['tth_range'] = self.base_ptn.roi
+        library = get_jcpds_library(path)
+        return search_match(library, tth_obs, wavelength, pressures,
+                            temperature=temperature, **kwargs)
+
+    def fit_sections_over_waterfall(self, sections=None, pressures=None,
+                                    temperatures=None):
+        """
+        fit sections over all waterfall patterns, starting from the base
+        pattern if it is in the waterfall
+
+        :param sections: list of Section, None for the current section
+        :param pressures: pressures for the table, one for each pattern
+        :param temperatures: temperatures for the table, one for each pattern
+        :return: structured array of results, see fit_sections_in_series
+        """
+        if sections is None:
+            sections = [self.current_section]
+        start = 0
+        if self.base_ptn_exist():
+            for i, pattern in enumerate(self.waterfall_ptn):
+                if pattern.fname == self.base_ptn.fname:
+                    start = i
+                    break
+        return fit_sections_in_series(
+            sections, self.waterfall_ptn, start=start, pressures=pressures,
+            temperatures=temperatures, n_workers=self.n_workers)
+
+    def propose_sections(self, fwhm, margin=3., n_sigma=5.,
+                         min_prominence=0.):
+        """
+        find peaks in the whole base pattern and make a section for each
+        group of overlapping peaks, with the peaks in queue
+
+        :param fwhm: typical full width at half maximum
+        :param margin: section extends margin x fwhm beyond the peaks
+        :return: list of Section, not saved in section_lst
+        """
+        if not self.base_ptn_exist():
+            return []
+        x = self.base_ptn.x_bgsub
+        peaks = find_peaks(x, self.base_ptn.y_bgsub, fwhm, n_sigma=n_sigma,
+                           min_prominence=min_prominence)
+        sections = []
+        for roi in group_peaks(peaks, margin=margin):
+            roi = [max(roi[0], x.min()), min(roi[1], x.max())]
+            section = Section()
+            section.set(*self.get_single_section(roi))
+            in_section = (peaks.center >= section.x.min()) & \
+                (peaks.center <= section.x.max())
+            section.set_peaks_found(peaks[in_section])
+            sections.append(section)
+        return sections
+
     def save_peak_fit_results_to_xls(self, xls_filen):
         """
         returns boolean for success
@@ -395,6 +508,7 @@ class PeakPoModel(object):
             sheet.write(6, 1, section.fit_result.aic)
             sheet.write(7, 0, 'Bayesian info crit')
             sheet.write(7, 1, section.fit_result.bic)
+            params = section.fit_result.params
             # write peak params and errors first
             lineno = 8
             sheet.write(lineno, 1, 'Phase')
@@ -422,30 +536,20 @@ class PeakPoModel(object):
                 sheet.write(lineno, 2, section.peakinfo[prefix + 'h'])
                 sheet.write(lineno, 3, section.peakinfo[prefix + 'k'])
                 sheet.write(lineno, 4, section.peakinfo[prefix + 'l'])
-                sheet.write(lineno, 5, section.fit_result.
-                            params[prefix + 'amplitude'].value)
-                sheet.write(lineno, 6, section.fit_result.
-                            params[prefix + 'amplitude'].stderr)
-                sheet.write(lineno, 7, section.fit_result.
-                            params[prefix + 'amplitude'].vary)
-                sheet.write(lineno, 8, section.fit_result.
-                            params[prefix + 'center'].value)
-                sheet.write(lineno, 9, section.fit_result.
-                            params[prefix + 'center'].stderr)
-                sheet.write(lineno, 10, section.fit_result.
-                            params[prefix + 'center'].vary)
-                sheet.write(lineno, 11, section.fit_result.
-                            params[prefix + 'sigma'].value * 2.)
-                sheet.write(lineno, 12, section.fit_result.
-                            params[prefix + 'sigma'].stderr * 2.)
-                sheet.write(lineno, 13, section.fit_result.
-                            params[prefix + 'sigma'].vary)
-                sheet.write(lineno, 14, section.fit_result.
-                            params[prefix + 'fraction'].value)
-                sheet.write(lineno, 15, section.fit_result.
-                            params[prefix + 'fraction'].stderr)
-                sheet.write(lineno, 16, section.fit_result.
-                            params[prefix + 'fraction'].vary)
+                sheet.write(lineno, 5, params[prefix + 'amplitude'].value)
+                sheet.write(lineno, 6, params[prefix + 'amplitude'].stderr)
+                sheet.write(lineno, 7, params[prefix + 'amplitude'].vary)
+                sheet.write(lineno, 8, params[prefix + 'center'].value)
+                sheet.write(lineno, 9, params[prefix + 'center'].stderr)
+                sheet.write(lineno, 10, params[prefix + 'center'].vary)
+                sheet.write(lineno, 11, params[prefix + 'sigma'].value * 2.)
+                sigma_stderr = params[prefix + 'sigma'].stderr
+                sheet.write(lineno, 12, None if sigma_stderr is None
+                            else sigma_stderr * 2.)
+                sheet.write(lineno, 13, params[prefix + 'sigma'].vary)
+                sheet.write(lineno, 14, params[prefix + 'fraction'].value)
+                sheet.write(lineno, 15, params[prefix + 'fraction'].stderr)
+                sheet.write(lineno, 16, params[prefix + 'fraction'].vary)
                 lineno += 1
             lineno += 1
             sheet.write(lineno, 0, 'Baseline factors')
@@ -458,9 +562,9 @@ class PeakPoModel(object):
             for i in range(n_order + 1):
                 prefix = "b_c{0:d}".format(i)
                 sheet.write(lineno, 0, prefix)
-                sheet.write(lineno, 1, section.fit_result.params[prefix].value)
-                sheet.write(lineno, 2, section.fit_result.params[prefix].stderr)
-                sheet.write(lineno, 3, section.fit_result.params[prefix].vary)
+                sheet.write(lineno, 1, params[prefix].value)
+                sheet.write(lineno, 2, params[prefix].stderr)
+                sheet.write(lineno, 3, params[prefix].vary)
                 lineno += 1
             lineno += 2
             sheet.write(lineno, 0, 'x_data')
@@ -0,0 +1,167 @@
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from ds_powdiff import PatternPeakPo
+from ds_cake import DiffImg
+from utils import make_filename
+
+
+def find_associated_img(filename):
+    """
+    :param filename: chi filename
+    :return: tif or mar3450 image filename for the chi, None if not found
+    """
+    for ext in ('tif', 'mar3450'):
+        filen_img = make_filename(filename, ext, original=True)
+        if os.path.exists(filen_img):
+            return filen_img
+    return None
+
+
+def prefetch_a_pattern(filename, wavelength, bg_roi, bg_params,
+                       temp_dir=None, cake_settings=None):
+    """
+    read a chi file, subtract background and make cake the same way as
+    the base pattern controller does, but without touching the widget.
+
+    :param temp_dir: folder for temporary files, None to ignore them
+    :param cake_settings: None for no cake,
+        or [poni_filename, mask_range, use_temp_cake, cake_dtype,
+        cake_compress]
+    :return: PatternPeakPo, DiffImg or None
+    """
+    pattern = PatternPeakPo()
+    pattern.read_file(filename, temp_dir=temp_dir)
+    pattern.wavelength = wavelength
+    pattern.display = True
+    x_raw = pattern.x_raw
+    # roi out of the data range is set by the widget in the main thread
+    if (x_raw.min() < bg_roi[0] < x_raw.max()) and \
+            (x_raw.min() < bg_roi[1] < x_raw.max()):
+        if (temp_dir is None) or (not pattern.read_bg_from_tempfile(
+                bg_roi, bg_params, temp_dir=temp_dir)):
+            pattern.subtract_bg(bg_roi, bg_params, yshift=0)
+            if temp_dir is not None:
+                pattern.write_temporary_bgfiles(temp_dir=temp_dir)
+    if cake_settings is None:
+        return pattern, None
+    filen_img = find_associated_img(filename)
+    if filen_img is None:
+        return pattern, None
+    poni_filename, mask_range, use_temp_cake, cake_dtype, cake_compress = \
+        cake_settings
+    temp_dir_cake = os.path.join(os.path.split(filename)[0],
+                                 'temporary_pkpo')
+    diff_img = DiffImg()
+    diff_img.load(filen_img)
+    if use_temp_cake and os.path.exists(temp_dir_cake) and \
+            diff_img.read_cake_from_tempfile(
+                temp_dir=temp_dir_cake, poni_filename=poni_filename,
+                mask_range=mask_range):
+        return pattern, diff_img
+    diff_img.set_calibration(poni_filename)
+    diff_img.set_mask(mask_range)
+    diff_img.integrate_to_cake()
+    if not os.path.exists(temp_dir_cake):
+        os.makedirs(temp_dir_cake)
+    diff_img.write_temp_cakefiles(temp_dir=temp_dir_cake,
+                                  mask_range=mask_range, dtype=cake_dtype,
+                                  compress=cake_compress)
+    return pattern, diff_img
+
+
+class Prefetcher(object):
+    """
+    load base patterns in a worker thread ahead of Next/Prev clicks and
+    keep them in a small least recently used cache.
+    """
+
+    def __init__(self, max_size=6):
+        """
+        :param max_size: maximum number of patterns to keep
+        """
+        self.max_size = max_size
+        self.executor = None
+        self._jobs = OrderedDict()  # filename: [future, settings, mtime]
+
+    def request(self, filenames, settings):
+        """
+        start loading files which are not in the cache yet.  jobs for
+        other files are cancelled if they have not started.
+
+        :param filenames: list of chi filenames, most wanted first
+        :param settings: dict of arguments for prefetch_a_pattern
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        for filename in list(self._jobs.keys()):
+            if filename not in filenames:
+                if self._jobs[filename][0].cancel():
+                    del self._jobs[filename]
+        for filename in filenames:
+            if filename in self._jobs:
+                if self._jobs[filename][1] == settings:
+                    self._jobs.move_to_end(filename)
+                    continue
+                self._jobs[filename][0].cancel()
+                del self._jobs[filename]
+            if not os.path.exists(filename):
+                continue
+            future = self.executor.submit(prefetch_a_pattern, filename,
+                                          **settings)
+            self._jobs[filename] = [future, settings,
+                                    os.path.getmtime(filename)]
+        while self._jobs.__len__() > self.max_size:
+            filename, job = self._jobs.popitem(last=False)
+            job[0].cancel()
+
+    def pop(self, filename, settings):
+        """
+        :return: PatternPeakPo and DiffImg prefetched with the same
+            settings, or None, None.  waits if the file is being loaded.
+            DiffImg is None if cake settings have changed.
+        """
+        if filename not in self._jobs:
+            return None, None
+        future, settings_job, mtime = self._jobs.pop(filename)
+        if (not self._same_settings(settings_job, settings)) or \
+                (not os.path.exists(filename)) or \
+                (os.path.getmtime(filename) != mtime):
+            future.cancel()
+            return None, None
+        # a job still in the queue is slower than loading here
+        if future.cancel():
+            return None, None
+        t_start = time.time()
+        try:
+            pattern, diff_img = future.result()
+        except Exception as inst:
+            print('Prefetching failed: ' + str(inst))
+            return None, None
+        print("Waiting for prefetched pattern takes {0:.2f}s".format(
+            time.time() - t_start))
+        if settings_job['cake_settings'] != settings['cake_settings']:
+            diff_img = None
+        return pattern, diff_img
+
+    def _same_settings(self, settings1, settings2):
+        """
+        compare settings except for cake
+        """
+        for key in settings1:
+            if (key != 'cake_settings') and \
+                    (settings1[key] != settings2[key]):
+                return False
+        return True
+
+    def clear(self):
+        for future, settings, mtime in self._jobs.values():
+            future.cancel()
+        self._jobs.clear()
+
+    def shutdown(self):
+        self.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -2,6 +2,7 @@ import sys
 import time
 import numpy
 import traceback
+import multiprocessing
 from io import StringIO
 from PyQt5 import QtWidgets
 import qdarkstyle
@@ -42,12 +43,16 @@ def excepthook(exc_type, exc_value, traceback_obj):
     errorbox.exec_()
 
 
-app = QtWidgets.QApplication(sys.argv)
-sys.excepthook = excepthook
-app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
-# app.setStyleSheet('fusion')
-controller = MainController()
-controller.show_window()
-ret = app.exec_()
-controller.write_setting()
-sys.exit(ret)
+if __name__ == '__main__':
+    # the guard keeps worker processes from opening new windows on
+    # platforms that spawn processes (Windows and macOS)
+    multiprocessing.freeze_support()
+    app = QtWidgets.QApplication(sys.argv)
+    sys.excepthook = excepthook
+    app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
+    # app.setStyleSheet('fusion')
+    controller = MainController()
+    controller.show_window()
+    ret = app.exec_()
+    controller.write_setting()
+    sys.exit(ret)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# modules in peakpo import each other by absolute names, such as ds_powdiff
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,57 @@
+import numpy as np
+from ds_powdiff.background import fit_bg_cheb_auto, fit_bg_cheb_auto_stack, \
+    smooth_bruckner, smooth_bruckner_fast
+
+
+def make_pattern(seed=0, n_data=1200):
+    """
+    synthetic diffraction pattern with a smooth background, peaks, and
+    noise
+    """
+    rng = np.random.RandomState(seed)
+    x = np.linspace(3., 30., n_data)
+    y = 200. + 50. * np.exp(-x / 10.) + 5. * np.sin(x / 4.)
+    for center, height in zip(rng.uniform(4., 29., 15),
+                              rng.uniform(20., 500., 15)):
+        y += height * np.exp(-0.5 * ((x - center) / 0.05)**2)
+    y += rng.normal(0., 2., n_data)
+    return x, y
+
+
+def test_smooth_bruckner_fast_same_as_reference():
+    x, y = make_pattern()
+    np.testing.assert_allclose(smooth_bruckner_fast(x, y, 20, 10),
+                               smooth_bruckner(x, y, 20, 10),
+                               rtol=1.e-10)
+
+
+def test_fit_bg_cheb_auto_fast_same_as_reference():
+    x, y = make_pattern(seed=1)
+    np.testing.assert_allclose(
+        fit_bg_cheb_auto(x, y, 20, 10, 20, engine='fast'),
+        fit_bg_cheb_auto(x, y, 20, 10, 20, engine='reference'),
+        rtol=1.e-10)
+
+
+def check_stack_same_as_each(n_patterns):
+    x, y = make_pattern(seed=2)
+    rng = np.random.RandomState(3)
+    y_stack = y * rng.uniform(0.5, 1.5, (n_patterns, 1)) + \
+        rng.normal(0., 2., (n_patterns, x.size))
+    y_bg_stack, y_bgsub_stack = fit_bg_cheb_auto_stack(
+        x, y_stack, 20, 10, 20)
+    for y_obs, y_bg, y_bgsub in zip(y_stack, y_bg_stack, y_bgsub_stack):
+        y_bg_each = fit_bg_cheb_auto(x, y_obs, 20, 10, 20)
+        np.testing.assert_allclose(y_bg, y_bg_each, rtol=1.e-9)
+        np.testing.assert_allclose(y_bgsub, y_obs - y_bg_each, rtol=1.e-9,
+                                   atol=1.e-9 * np.abs(y_obs).max())
+
+
+def test_fit_bg_cheb_auto_stack_few_patterns():
+    # smoothed one by one below the threshold of smooth_bruckner_stack
+    check_stack_same_as_each(5)
+
+
+def test_fit_bg_cheb_auto_stack_many_patterns():
+    # smoothed together, vectorized over patterns
+    check_stack_same_as_each(30)
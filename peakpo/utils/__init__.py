@@ -1,7 +1,10 @@
 from .pyqtutils import undo_button_press, SpinBoxFixStyle
 from .fileutils import samefilename, extract_filename, make_filename, \
     get_sorted_filelist, find_from_filelist, writechi, readchi, \
-    extract_extension, change_file_path
-from .dialogs import dialog_savefile, ErrorMessageBox, InformationBox
+    extract_extension, change_file_path, save_atomic, read_chi_data, \
+    read_chi_with_sidecar
+from .fileindex import FileIndex
+from .dialogs import dialog_savefile, ErrorMessageBox, InformationBox, \
+    SearchMatchDialog
 from .excelutils import xls_ucfitlist, xls_jlist
 from .physutils import convert_wl_to_energy
@@ -84,3 +84,58 @@ class InformationBox(QtWidgets.QDialog):
 
     def setText(self, text_str):
         self.text_lbl.setText(text_str)
+
+
+class SearchMatchDialog(QtWidgets.QDialog):
+    """
+    show candidates from search-match and let the user choose cards to
+    load
+    """
+
+    def __init__(self, candidates, *args, **kwargs):
+        """
+        :param candidates: list of dict from ds_jcpds.search_match
+        """
+        super(SearchMatchDialog, self).__init__(*args, **kwargs)
+        self.setWindowTitle("Search-match candidates")
+        self.candidates = candidates
+
+        self.table = QtWidgets.QTableWidget(candidates.__len__(), 5)
+        self.table.setHorizontalHeaderLabels(
+            ['JCPDS', 'P (GPa)', 'Score', 'Lines found', 'Peaks explained'])
+        for i, candidate in enumerate(candidates):
+            texts = [candidate['filename'],
+                     "{0:.1f}".format(candidate['pressure']),
+                     "{0:.3f}".format(candidate['score']),
+                     "{0:.0%}".format(candidate['line_fraction']),
+                     "{0:.0%}".format(candidate['obs_fraction'])]
+            for j, text in enumerate(texts):
+                item = QtWidgets.QTableWidgetItem(text)
+                item.setFlags(QtCore.Qt.ItemIsSelectable |
+                              QtCore.Qt.ItemIsEnabled)
+                self.table.setItem(i, j, item)
+        self.table.setSelectionBehavior(
+            QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(
+            QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.table.resizeColumnsToContents()
+        self.load_btn = QtWidgets.QPushButton('Load selected')
+        self.close_btn = QtWidgets.QPushButton('Close')
+
+        _layout = QtWidgets.QGridLayout()
+        _layout.addWidget(self.table, 0, 0, 1, 10)
+        _layout.addWidget(self.load_btn, 1, 8)
+        _layout.addWidget(self.close_btn, 1, 9)
+
+        self.setLayout(_layout)
+        self.resize(600, 400)
+        self.load_btn.clicked.connect(self.accept)
+        self.close_btn.clicked.connect(self.reject)
+
+    def get_selected(self):
+        """
+        :return: selected candidates in the order of rank
+        """
+        rows = sorted(set(index.row() for index in
+                          self.table.selectionModel().selectedRows()))
+        return [self.candidates[i] for i in rows]
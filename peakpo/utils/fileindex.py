@@ -0,0 +1,127 @@
+import os
+import time
+import fnmatch
+
+
+class FileIndex(object):
+    """
+    sorted list of files in a folder with name to position lookup.
+    The folder is scanned again only when its mtime changes, and then
+    only files added since the last scan are stat-ed.  When sorted by
+    mtime, all files are stat-ed at each refresh, as rewriting a file
+    does not change the folder mtime.
+    """
+
+    # folder mtime within this many seconds of a scan is not trusted,
+    # as network and FAT file systems have coarse time stamps
+    MTIME_SLACK = 2.
+
+    def __init__(self, path, search_ext='*.chi', sorted_by_name=True):
+        """
+        :param path: folder to index
+        :param search_ext: wildcard for files to include
+        :param sorted_by_name: sort by name if True, by mtime if False
+        """
+        self.path = path
+        self.search_ext = search_ext
+        self.sorted_by_name = sorted_by_name
+        self._dir_mtime = None
+        self._mtimes = {}  # name: mtime of file
+        self._names = []
+        self._positions = {}  # name: position in self._names
+
+    def __len__(self):
+        return self._names.__len__()
+
+    def __getitem__(self, i):
+        return os.path.join(self.path, self._names[i])
+
+    def set_sort(self, sorted_by_name):
+        if sorted_by_name == self.sorted_by_name:
+            return
+        self.sorted_by_name = sorted_by_name
+        if not sorted_by_name:
+            # mtimes kept while sorted by name may be out of date
+            self._mtimes = dict.fromkeys(self._mtimes)
+        self._sort()
+
+    def refresh(self, force=False):
+        """
+        scan the folder if it has changed since the last scan
+
+        :param force: scan regardless of folder mtime
+        :return: True if the folder was scanned or the order may have changed
+        """
+        try:
+            dir_mtime = os.stat(self.path).st_mtime
+        except OSError:
+            self._dir_mtime = None
+            self._mtimes = {}
+            self._sort()
+            return True
+        if (not force) and (dir_mtime == self._dir_mtime):
+            if self.sorted_by_name:
+                return False
+            return self._restat()
+        names = set()
+        for entry in os.scandir(self.path):
+            # hidden files, which glob skips
+            if entry.name.startswith('.'):
+                continue
+            if fnmatch.fnmatch(entry.name, self.search_ext):
+                names.add(entry.name)
+        mtimes = {}
+        for name in names:
+            if self.sorted_by_name:
+                # stat is postponed until sorting by time is requested
+                mtimes[name] = self._mtimes.get(name)
+            else:
+                mtimes[name] = self._get_mtime(name)
+        self._mtimes = mtimes
+        self._sort()
+        # a file added within the same time stamp tick would be missed
+        if time.time() - dir_mtime < self.MTIME_SLACK:
+            self._dir_mtime = None
+        else:
+            self._dir_mtime = dir_mtime
+        return True
+
+    def index(self, filename):
+        """
+        :param filename: filename with or without path
+        :return: position of the file, -1 if not in the index
+        """
+        return self._positions.get(os.path.split(filename)[1], -1)
+
+    def get_filelist(self):
+        return [os.path.join(self.path, name) for name in self._names]
+
+    def _restat(self):
+        """
+        stat the indexed files again
+
+        :return: True if any mtime has changed
+        """
+        mtimes = {name: self._get_mtime(name) for name in self._mtimes}
+        if mtimes == self._mtimes:
+            return False
+        self._mtimes = mtimes
+        self._sort()
+        return True
+
+    def _get_mtime(self, name):
+        try:
+            return os.path.getmtime(os.path.join(self.path, name))
+        except OSError:
+            return 0.
+
+    def _sort(self):
+        if self.sorted_by_name:
+            self._names = sorted(self._mtimes)
+        else:
+            for name, mtime in self._mtimes.items():
+                if mtime is None:
+                    self._mtimes[name] = self._get_mtime(name)
+            self._names = sorted(self._mtimes,
+                                 key=lambda name: (self._mtimes[name], name))
+        self._positions = {name: i for i, name in enumerate(self._names)}
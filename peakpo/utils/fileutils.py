@@ -1,5 +1,8 @@
+import os
 import os.path
 import glob
+import tempfile
+import warnings
 import numpy as np
 import re
 
@@ -20,14 +23,88 @@ def readchi(filen):
     read chi with BG ROI and BG PARAMS
     """
     with open(filen) as f:
-        content = f.readlines()
-    roi = re.findall(r"[-+]?\d*\.\d+|\d+", content[0])
-    bg_params = re.findall(r"[-+]?\d*\.\d+|\d+", content[1])
-    data = np.loadtxt(filen, skiprows=4)
-    x, y = data.T
+        line0 = f.readline()
+        line1 = f.readline()
+    roi = re.findall(r"[-+]?\d*\.\d+|\d+", line0)
+    bg_params = re.findall(r"[-+]?\d*\.\d+|\d+", line1)
+    x, y = read_chi_data(filen)
     return [float(r) for r in roi], [int(b) for b in bg_params], x, y
 
 
+def read_chi_data(filen):
+    """
+    read x and y from a chi file.  The four header lines are skipped and
+    the rest is parsed in one call to numpy C parser.  Falls back to
+    np.loadtxt for files with unusual layout.
+
+    :param filen: chi filename
+    :return: x, y
+    """
+    with open(filen, 'r') as f:
+        for i in range(3):
+            f.readline()
+        line_n = f.readline()
+        text = f.read()
+    try:
+        n_points = int(line_n.strip('# \n'))
+    except ValueError:
+        n_points = None
+    with warnings.catch_warnings():
+        # numpy warns instead of raising when it cannot parse to the end
+        warnings.simplefilter('error')
+        try:
+            data = np.fromstring(text, sep=' ')
+        except (ValueError, DeprecationWarning):
+            data = None
+    if (data is None) or (data.size == 0) or (data.size % 2 != 0) or \
+            ((n_points is not None) and (data.size != 2 * n_points)):
+        data = np.loadtxt(filen, skiprows=4)
+        return data[:, 0], data[:, 1]
+    data = data.reshape(-1, 2)
+    return data[:, 0].copy(), data[:, 1].copy()
+
+
+def read_chi_with_sidecar(filen, temp_dir=None):
+    """
+    read x and y from a chi file through a binary sidecar in temp_dir.
+    The sidecar is a npy file with shape (2, n + 1).  The first column
+    holds the size and mtime of the chi file it was made from, and the
+    rest is x and y.  A valid sidecar is memory mapped, so x and y are
+    views on the file and no parsing or copying is needed.
+
+    :param filen: chi filename
+    :param temp_dir: folder for the sidecar.  None to read the chi only.
+    :return: x, y
+    """
+    if temp_dir is None:
+        return read_chi_data(filen)
+    stat = os.stat(filen)
+    f_sidecar = make_filename(filen, 'chi.npy', temp_dir=temp_dir)
+    if os.path.exists(f_sidecar):
+        try:
+            data = np.load(f_sidecar, mmap_mode='r')
+            if (data.ndim == 2) and (data.shape[0] == 2) and \
+                    (data[0, 0] == stat.st_size) and \
+                    (data[1, 0] == stat.st_mtime):
+                return np.asarray(data[0, 1:]), np.asarray(data[1, 1:])
+        except (IOError, ValueError):
+            pass
+    x, y = read_chi_data(filen)
+    data = np.empty((2, x.size + 1))
+    data[0, 0] = stat.st_size
+    data[1, 0] = stat.st_mtime
+    data[0, 1:] = x
+    data[1, 1:] = y
+    try:
+        if not os.path.exists(os.path.dirname(f_sidecar)):
+            os.makedirs(os.path.dirname(f_sidecar))
+        save_atomic(f_sidecar, lambda f: np.save(f, data))
+    except OSError:
+        # sidecar is optional, for example an old one may still be mapped
+        pass
+    return x, y
+
+
 def find_from_filelist(flist, filen):
     i = 0
     for s in flist:
@@ -116,3 +193,25 @@ def change_file_path(filename, new_path):
     path, filen_ext = os.path.split(filename)
     new_filename = os.path.join(new_path, filen_ext)
     return new_filename
+
+
+def save_atomic(filename, writer):
+    """
+    write to a different name first and then rename, so that a reader
+    never sees a half written file.  the temporary file is unique, so
+    that two threads writing the same file do not mix their contents.
+    it is removed when writing fails.
+
+    :param filename: filename to write
+    :param writer: function which writes to an open binary file, writer(f)
+    """
+    fd, filen_part = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            writer(f)
+        os.replace(filen_part, filename)
+    except BaseException:
+        if os.path.exists(filen_part):
+            os.remove(filen_part)
+        raise
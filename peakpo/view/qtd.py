@@ -1491,6 +1491,17 @@ class Ui_MainWindow(object):
         self.pushButton_ExportXLS.setMaximumSize(QtCore.QSize(70, 25))
         self.pushButton_ExportXLS.setObjectName("pushButton_ExportXLS")
         self.horizontalLayout_20.addWidget(self.pushButton_ExportXLS)
+        self.pushButton_SearchMatchJCPDS = QtWidgets.QPushButton(self.groupBox_9)
+        sizePolicy = QtWidgets.QSizePolicy(
+            QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(
+            self.pushButton_SearchMatchJCPDS.sizePolicy().hasHeightForWidth())
+        self.pushButton_SearchMatchJCPDS.setSizePolicy(sizePolicy)
+        self.pushButton_SearchMatchJCPDS.setMaximumSize(QtCore.QSize(70, 25))
+        self.pushButton_SearchMatchJCPDS.setObjectName("pushButton_SearchMatchJCPDS")
+        self.horizontalLayout_20.addWidget(self.pushButton_SearchMatchJCPDS)
         self.verticalLayout_23.addWidget(self.groupBox_9)
         self.groupBox_8 = QtWidgets.QGroupBox(self.tab_JCPDSList2)
         sizePolicy = QtWidgets.QSizePolicy(
@@ -1947,6 +1958,9 @@ class Ui_MainWindow(object):
         self.pushButton_PkFtSectionSavetoXLS = QtWidgets.QPushButton(self.frame_28)
         self.pushButton_PkFtSectionSavetoXLS.setObjectName("pushButton_PkFtSectionSavetoXLS")
         self.gridLayout_20.addWidget(self.pushButton_PkFtSectionSavetoXLS, 1, 2, 1, 1)
+        self.pushButton_PkFtSectionFitWaterfall = QtWidgets.QPushButton(self.frame_28)
+        self.pushButton_PkFtSectionFitWaterfall.setObjectName("pushButton_PkFtSectionFitWaterfall")
+        self.gridLayout_20.addWidget(self.pushButton_PkFtSectionFitWaterfall, 2, 0, 1, 1)
         self.verticalLayout_15.addWidget(self.frame_28)
         self.tableWidget_PkFtSections = QtWidgets.QTableWidget(self.tab_PeakFitSection)
         sizePolicy = QtWidgets.QSizePolicy(
@@ -2025,6 +2039,9 @@ class Ui_MainWindow(object):
         self.pushButton_AddRemoveFromMouse.setCheckable(True)
         self.pushButton_AddRemoveFromMouse.setObjectName("pushButton_AddRemoveFromMouse")
         self.gridLayout_18.addWidget(self.pushButton_AddRemoveFromMouse, 1, 0, 1, 1)
+        self.pushButton_FindPeaks = QtWidgets.QPushButton(self.groupBox_32)
+        self.pushButton_FindPeaks.setObjectName("pushButton_FindPeaks")
+        self.gridLayout_18.addWidget(self.pushButton_FindPeaks, 1, 1, 1, 1)
         self.label_16 = QtWidgets.QLabel(self.groupBox_32)
         sizePolicy = QtWidgets.QSizePolicy(
             QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Preferred)
@@ -3007,6 +3024,9 @@ class Ui_MainWindow(object):
         self.pushButton_ExportXLS.setToolTip(_translate(
             "MainWindow", "Save JCPDSs to an excel file"))
         self.pushButton_ExportXLS.setText(_translate("MainWindow", "Save XLS"))
+        self.pushButton_SearchMatchJCPDS.setToolTip(_translate(
+            "MainWindow", "Rank JCPDS cards in a folder against peaks in sections"))
+        self.pushButton_SearchMatchJCPDS.setText(_translate("MainWindow", "Search"))
         self.groupBox_8.setTitle(_translate("MainWindow", "Selected"))
         self.pushButton_SaveTwkJCPDS.setToolTip(_translate(
             "MainWindow", "Save Twk\'ed JCPDSs for the checked items"))
@@ -3099,6 +3119,9 @@ class Ui_MainWindow(object):
         self.pushButton_PkFtSectionSavetoXLS.setToolTip(_translate(
             "MainWindow", "Save all fitting results in an excel file"))
         self.pushButton_PkFtSectionSavetoXLS.setText(_translate("MainWindow", "Save to XLS"))
+        self.pushButton_PkFtSectionFitWaterfall.setToolTip(_translate(
+            "MainWindow", "Fit saved sections over all waterfall patterns and save a csv file"))
+        self.pushButton_PkFtSectionFitWaterfall.setText(_translate("MainWindow", "Fit waterfall"))
         self.tabWidget_PeakFit.setTabText(self.tabWidget_PeakFit.indexOf(
             self.tab_PeakFitSection), _translate("MainWindow", "Sections"))
         self.groupBox_35.setTitle(_translate("MainWindow", "Section"))
@@ -3120,6 +3143,9 @@ class Ui_MainWindow(object):
         self.pushButton_AddRemoveFromMouse.setToolTip(_translate(
             "MainWindow", "Get starting peak positions from mouse click"))
         self.pushButton_AddRemoveFromMouse.setText(_translate("MainWindow", "From mouse"))
+        self.pushButton_FindPeaks.setToolTip(_translate(
+            "MainWindow", "Find peaks in the current section, using Initial FWHM in Config"))
+        self.pushButton_FindPeaks.setText(_translate("MainWindow", "Find peaks"))
         self.label_16.setText(_translate("MainWindow", "Min. Intensity"))
         self.pushButton_AddRemoveFromJlist.setToolTip(_translate(
             "MainWindow", "Recieve starting peak position values from JCPDS"))